@@ -0,0 +1,70 @@
+"""Synthetic FITS trees for the upload benchmarks."""
+import random
+from pathlib import Path
+
+FITS_BLOCK_SIZE = 2880
+NOISE_BLOCK_SIZE = 64 * 1024
+
+KB = 1024
+MB = 1024 * KB
+
+# Each scenario stresses a different part of an upload: per-file overheads, transfers, and scanning.
+SCENARIOS = {
+    'small-files': dict(file_count=2000, file_size=16 * KB, depth=1, fanout=20),
+    'huge-cubes': dict(file_count=3, file_size=128 * MB, depth=0, fanout=1),
+    'deep-tree': dict(file_count=500, file_size=64 * KB, depth=12, fanout=4),
+}
+
+
+def _build_header(data_size: int, index: int) -> bytes:
+    # A 16-bit, 1D image. Only the size of the data matters here.
+    cards = ['SIMPLE  =                    T',
+             'BITPIX  =                   16',
+             'NAXIS   =                    1',
+             f'NAXIS1  = {data_size // 2:>20}',
+             f"DATE-OBS= '2024-01-01T00:{index // 60 % 60:02d}:{index % 60:02d}'",
+             "ORIGIN  = 'oort benchmarks'",
+             'END']
+    header = ''.join(card.ljust(80) for card in cards).encode('ascii')
+    return header.ljust(-(-len(header) // FITS_BLOCK_SIZE) * FITS_BLOCK_SIZE, b' ')
+
+
+def _build_noise_block(seed: int) -> bytes:
+    # Noise on the low byte of each pixel only, so that the data compresses about as much as raw images do.
+    rng = random.Random(seed)
+    return bytes(value for _ in range(NOISE_BLOCK_SIZE // 2) for value in (0x10, rng.getrandbits(8)))
+
+
+def write_fits_file(path: Path, data_size: int, index: int = 0, noise_block: bytes = None):
+    noise_block = noise_block or _build_noise_block(index)
+    padded_size = -(-data_size // FITS_BLOCK_SIZE) * FITS_BLOCK_SIZE
+    with open(path, 'wb') as f:
+        f.write(_build_header(data_size, index))
+        remaining = padded_size
+        while remaining > 0:
+            block = noise_block[:remaining]
+            f.write(block)
+            remaining -= len(block)
+
+
+def build_tree(root: Path, file_count: int, file_size: int, depth: int, fanout: int) -> Path:
+    """Write file_count FITS files, spread over fanout chains of depth nested folders.
+
+    Trees are kept between runs: a tree whose files are all present is not written again.
+    """
+    folders = [root]
+    for branch in range(fanout if depth > 0 else 0):
+        folder = root
+        for level in range(depth):
+            folder = folder / f'branch_{branch}_level_{level}'
+            folders.append(folder)
+
+    paths = [folders[index % len(folders)] / f'image_{index:06d}.fits' for index in range(file_count)]
+    if all(path.exists() for path in paths):
+        return root
+
+    noise_block = _build_noise_block(0)
+    for index, path in enumerate(paths):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        write_fits_file(path, file_size, index, noise_block)
+    return root
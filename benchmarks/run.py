@@ -0,0 +1,172 @@
+"""
+End-to-end upload benchmarks, against a local stand-in of the Arcsecond API.
+
+Run from the repository root:
+
+    python -m benchmarks.run
+    python -m benchmarks.run -s small-files -j 8 --latency 50 --bandwidth 10
+
+Each scenario uploads a synthetic FITS tree in a separate process, so that its peak RSS is that of
+the upload alone, and reports files/s, MB/s, peak RSS and the requests received by the stand-in.
+Uploaded files are memory-mapped: the peak RSS includes the pages of the files being sent.
+"""
+import json
+import multiprocessing
+import queue
+import tempfile
+import time
+from pathlib import Path
+
+import click
+
+from benchmarks.fits_trees import MB, SCENARIOS, build_tree
+from tests.standin import StandInArcsecond
+
+DATASET = {'uuid': '5d2c6e0a-7f3b-4e8d-9a1c-2b4f6d8e0a13', 'name': 'Benchmarks'}
+
+
+def _run_upload(url: str, folder: str, options: dict, results):
+    # Runs in a fresh process. The test settings of Oort keep the benchmark away from the user's logs.
+    import logging
+    import os
+    os.environ['OORT_TESTS'] = '1'
+
+    from oort.cli.helpers import build_uploader_options
+    from oort.common.api import DEFAULT_POOL_SIZE, OortAPI
+    from oort.common.context import Context
+    from oort.uploader.datasets import DatasetCache
+    from oort.uploader.pipeline import walk_async
+    from oort.uploader.walker import walk
+    from tests.standin import StandInConfig
+
+    logging.disable(logging.INFO)
+    config = StandInConfig(url)
+    api = OortAPI(config, '', pool_size=max(options['jobs'], DEFAULT_POOL_SIZE))
+    context = Context(config, DATASET['uuid'], '', api=api)
+    context.update_dataset(DATASET)
+    dataset_cache = DatasetCache()
+    dataset_cache.add(DATASET)
+    uploader_options = build_uploader_options(jobs=options['jobs'],
+                                              chunk_threshold=options['chunk_threshold'],
+                                              compression=options['compression'])
+
+    started = time.perf_counter()
+    if options['use_asyncio']:
+        success_uploads, failed_uploads = walk_async(context, folder, in_flight=options['jobs'],
+                                                     dataset_cache=dataset_cache, uploader_options=uploader_options)
+    else:
+        success_uploads, failed_uploads = walk(context, folder, jobs=options['jobs'],
+                                               dataset_cache=dataset_cache, uploader_options=uploader_options)
+    duration = time.perf_counter() - started
+    api.close()
+
+    results.put({'duration': duration,
+                 'success_count': len(success_uploads),
+                 'failed_count': len(failed_uploads),
+                 'peak_rss': _get_peak_rss()})
+
+
+def _get_peak_rss() -> int:
+    """Return the peak RSS of the current process, in bytes."""
+    import resource
+    import sys
+    try:
+        # Unlike ru_maxrss on Linux, the high water mark is not inherited from the parent through fork and exec.
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is in bytes on macOS, and in kB elsewhere.
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss if sys.platform == 'darwin' else peak_rss * 1024
+
+
+def run_scenario(name: str, folder: Path, standin: StandInArcsecond, options: dict) -> dict:
+    file_paths = [path for path in folder.glob('**/*') if path.is_file()]
+    total_size = sum(path.stat().st_size for path in file_paths)
+
+    with standin.lock:
+        standin.request_counts = {}
+        standin.connection_count = 0
+        standin.datafiles = {}
+
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=_run_upload, args=(standin.url, str(folder), options, results))
+    process.start()
+    while True:
+        try:
+            result = results.get(timeout=1)
+            break
+        except queue.Empty:
+            if not process.is_alive():
+                raise click.ClickException(f'The upload of {name} failed (exit code {process.exitcode}).')
+    process.join()
+
+    return dict(result,
+                scenario=name,
+                file_count=len(file_paths),
+                total_size=total_size,
+                files_per_second=result['success_count'] / result['duration'],
+                megabytes_per_second=total_size / MB / result['duration'],
+                request_counts=dict(standin.request_counts),
+                connection_count=standin.connection_count)
+
+
+def print_report(results: list):
+    click.echo(f"\n{'scenario':<14}{'files':>8}{'MB':>10}{'seconds':>10}{'files/s':>10}{'MB/s':>10}"
+               f"{'RSS MB':>10}{'failed':>8}  requests (connections)")
+    for result in results:
+        requests = ', '.join(f'{method} {count}' for method, count in sorted(result['request_counts'].items()))
+        click.echo(f"{result['scenario']:<14}{result['file_count']:>8}{result['total_size'] / MB:>10.1f}"
+                   f"{result['duration']:>10.2f}{result['files_per_second']:>10.1f}"
+                   f"{result['megabytes_per_second']:>10.1f}{result['peak_rss'] / MB:>10.1f}"
+                   f"{result['failed_count']:>8}  {requests} ({result['connection_count']})")
+
+
+@click.command()
+@click.option('-s', '--scenario', 'scenarios', multiple=True, type=click.Choice(list(SCENARIOS.keys())),
+              help="The scenarios to run (all of them by default).")
+@click.option('--scale', type=click.FloatRange(min=0, min_open=True), default=1.0, show_default=True,
+              help="Multiply the number of files of each scenario.")
+@click.option('-j', '--jobs', type=click.IntRange(min=1), default=4, show_default=True)
+@click.option('--asyncio', 'use_asyncio', is_flag=True, default=False)
+@click.option('--chunk-threshold', type=click.IntRange(min=1), help="In MB.")
+@click.option('--compress', 'compression', type=click.Choice(['gzip', 'bz2']))
+@click.option('--latency', type=click.FloatRange(min=0), default=0, show_default=True,
+              help="Milliseconds added by the stand-in to each response.")
+@click.option('--bandwidth', type=click.FloatRange(min=0, min_open=True),
+              help="MB/s read by the stand-in from each connection (unlimited by default).")
+@click.option('--workdir', type=click.Path(file_okay=False),
+              help="Where synthetic trees are written, and kept between runs (a temporary folder by default).")
+@click.option('--json', 'json_path', type=click.Path(dir_okay=False), help="Also write the results as JSON.")
+def main(scenarios, scale, jobs, use_asyncio, chunk_threshold, compression, latency, bandwidth, workdir,
+         json_path):
+    options = dict(jobs=jobs, use_asyncio=use_asyncio, chunk_threshold=chunk_threshold, compression=compression)
+    with tempfile.TemporaryDirectory() as temporary_dir:
+        root = Path(workdir or temporary_dir)
+        results = []
+        with StandInArcsecond() as standin:
+            standin.datasets[DATASET['uuid']] = DATASET
+            standin.store_content = False
+            standin.latency = latency / 1000
+            standin.bandwidth = bandwidth * MB if bandwidth else None
+
+            for name in scenarios or SCENARIOS.keys():
+                settings = dict(SCENARIOS[name])
+                settings['file_count'] = max(1, int(settings['file_count'] * scale))
+                click.echo(f"Preparing {name} ({settings['file_count']} files)...")
+                folder = build_tree(root / f"{name}-{settings['file_count']}", **settings)
+                click.echo(f"Uploading {name}...")
+                results.append(run_scenario(name, folder, standin, options))
+
+    print_report(results)
+    if json_path:
+        Path(json_path).write_text(json.dumps({'options': dict(options, latency=latency, bandwidth=bandwidth),
+                                               'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Startup benchmark of the `oort` command.
+
+Run from the repository root:
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup -n 20 --top 15 --json startup.json
+
+Each run imports oort.cli.cli in a fresh interpreter with `python -X importtime`, and the report gives
+the median import time of oort.cli.cli, the modules costing the most, and the wall time of
+`oort --version` (interpreter startup included). Pipeline scripts calling Oort thousands of times pay
+for all of it on every call.
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import click
+
+CLI_MODULE = 'oort.cli.cli'
+
+# Modules that `oort --version` and `oort --help` must not import: they are only needed by the commands
+# talking to the API, or uploading files.
+HEAVY_MODULES = ['arcsecond', 'requests', 'urllib3', 'requests_toolbelt', 'asyncio', 'multiprocessing',
+                 'sqlite3', 'concurrent.futures', 'logging.handlers', 'oort.common.api', 'oort.uploader.walker']
+
+
+def _get_environment() -> dict:
+    # The test settings of Oort keep the benchmark away from the user's logs.
+    return dict(os.environ, OORT_TESTS='1')
+
+
+def parse_import_times(output: str) -> dict:
+    """Parse the output of `python -X importtime` into {module: (self us, cumulative us)}."""
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, module = line[len('import time:'):].split('|')
+        times[module.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def measure_import(module: str = CLI_MODULE) -> dict:
+    """Import a module in a fresh interpreter, and return the import times of all the modules it loaded."""
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                             capture_output=True, text=True, env=_get_environment(), check=True)
+    return parse_import_times(process.stderr)
+
+
+def get_loaded_modules(module: str = CLI_MODULE) -> set:
+    """Import a module in a fresh interpreter, and return the names of all the loaded modules."""
+    code = f'import sys, json, {module}; print(json.dumps(sorted(sys.modules.keys())))'
+    process = subprocess.run([sys.executable, '-c', code],
+                             capture_output=True, text=True, env=_get_environment(), check=True)
+    return set(json.loads(process.stdout))
+
+
+def measure_command(args: list) -> float:
+    """Return the wall time (in seconds) of an oort command, run in a fresh interpreter."""
+    started = time.perf_counter()
+    # As the `oort` entry point does, minus the lookup of the entry point itself.
+    subprocess.run([sys.executable, '-c', f'from {CLI_MODULE} import main; main()'] + args,
+                   capture_output=True, env=_get_environment(), check=True)
+    return time.perf_counter() - started
+
+
+@click.command()
+@click.option('-n', '--repeat', type=click.IntRange(min=1), default=10, show_default=True,
+              help="The number of fresh interpreters measured.")
+@click.option('--top', type=click.IntRange(min=0), default=10, show_default=True,
+              help="The number of most expensive modules listed.")
+@click.option('--json', 'json_path', type=click.Path(dir_okay=False), help="Also write the results as JSON.")
+def main(repeat, top, json_path):
+    runs = [measure_import() for _ in range(repeat)]
+    modules = set.intersection(*(set(run.keys()) for run in runs))
+    median_times = {module: (statistics.median(run[module][0] for run in runs),
+                             statistics.median(run[module][1] for run in runs)) for module in modules}
+    version_times = [measure_command(['--version']) for _ in range(repeat)]
+    heavy_modules = sorted(set(HEAVY_MODULES) & get_loaded_modules())
+
+    cli_time = median_times[CLI_MODULE][1]
+    click.echo(f"import {CLI_MODULE}: {cli_time / 1000:.1f} ms (median of {repeat}), {len(modules)} modules")
+    click.echo(f"oort --version: {statistics.median(version_times) * 1000:.1f} ms (median of {repeat})")
+    click.echo(f"heavy modules loaded: {', '.join(heavy_modules) or 'none'}")
+    if top > 0:
+        click.echo(f"\n{'self [ms]':>10}{'cumulative [ms]':>17}  module")
+        for module, (self_us, cumulative_us) in sorted(median_times.items(), key=lambda item: -item[1][0])[:top]:
+            click.echo(f"{self_us / 1000:>10.1f}{cumulative_us / 1000:>17.1f}  {module}")
+
+    if json_path:
+        Path(json_path).write_text(json.dumps({'repeat': repeat,
+                                               'import_time_us': cli_time,
+                                               'version_time_s': statistics.median(version_times),
+                                               'heavy_modules': heavy_modules,
+                                               'modules': {m: list(t) for m, t in median_times.items()}}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,18 @@
+from pathlib import Path
+
 import click
-from arcsecond import ArcsecondAPI, ArcsecondConfig, cli as ArcsecondCLI
-from arcsecond.options import State
 
 from oort import __version__
-from oort.common.context import Context
-from oort.uploader.walker import walk
+from oort.common.constants import (DEFAULT_BUNDLE_SIZE, DEFAULT_LOG_MAX_BYTES, DEFAULT_MAX_ATTEMPTS,
+                                   DEFAULT_POLL_INTERVAL, DEFAULT_SETTLE_DELAY, DIGEST_ALGORITHMS, LOG_FORMATS, MB)
+from oort.uploader.compression import CODECS
+from oort.uploader.filters import PathFilter
+from oort.uploader.scheduling import DEFAULT_SCHEDULING_POLICY, SCHEDULING_POLICIES
 from .errors import OortCloudError, InvalidUploadOptionsOortCloudError
-from .helpers import display_command_summary
-from .options import basic_options
+from .options import ShardParamType, State, basic_options, filter_options
+
+# Only light modules are imported above: arcsecond, requests and the uploader stack are imported by the
+# commands needing them, so that `oort --version` and `oort --help` start fast. See benchmarks/startup.py.
 
 pass_state = click.make_pass_decorator(State, ensure=True)
 
@@ -17,9 +22,22 @@ CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
 
 @click.group(invoke_without_command=True)
 @click.option('--version', is_flag=True, help=VERSION_HELP_STRING)
+@click.option('--log-dir',
+              required=False, type=click.Path(file_okay=False, writable=True),
+              help="The folder of the log files (default: 'logs' in the Oort config folder, or $OORT_LOG_DIR).")
+@click.option('--log-format',
+              required=False, type=click.Choice(LOG_FORMATS), default='text', show_default=True,
+              help="The format of the log file. 'json' writes one JSON object per line.")
+@click.option('--log-rotation',
+              required=False, type=click.Choice(['size', 'daily']), default='size', show_default=True,
+              help="Start a new log file when it reaches --log-max-size, or every day.")
+@click.option('--log-max-size',
+              required=False, type=click.IntRange(min=1), default=DEFAULT_LOG_MAX_BYTES // MB, show_default=True,
+              help="The size (in MB) of log files rotated by size.")
 @basic_options
 @click.pass_context
-def main(ctx, version=False, **kwargs):
+def main(ctx, version=False, log_dir=None, log_format='text', log_rotation='size',
+         log_max_size=DEFAULT_LOG_MAX_BYTES // MB, **kwargs):
     """
     Oort-Cloud ('oort' command) is a super-easy upload manager for arcsecond.io.
 
@@ -34,10 +52,20 @@ def main(ctx, version=False, **kwargs):
     local folder structure. Of course, the cleaner the local folders structure,
     the cleaner it will appear in Arcsecond.io.
 
-    Oort-Cloud v2 works only with one direct mode (a whole new local monitor is
-    in preparation). This direct mode (command `oort upload ...`) uploads files
-    immediately, and returns.
+    Oort-Cloud v2 works with two modes. The direct mode (command `oort upload ...`)
+    uploads files immediately, and returns. The watch mode (command `oort watch ...`)
+    keeps running, and uploads new files as soon as they have been written.
+
+    Logs are written in the background, into rotated log files (10 at most), one per process.
     """
+    if ctx.invoked_subcommand is not None:
+        from oort.common.logger import configure_oort_logging
+
+        configure_oort_logging(log_dir=log_dir,
+                               log_format=log_format,
+                               debug=ctx.ensure_object(State).verbose,
+                               max_bytes=log_max_size * MB,
+                               rotate_when='midnight' if log_rotation == 'daily' else None)
     if version:
         click.echo(__version__)
     elif ctx.invoked_subcommand is None:
@@ -60,6 +88,8 @@ def login(state, username, upload_key):
     This Upload key is safer than the Access Key, since it gives
     just enough permissions to upload files to your account.
     """
+    from arcsecond import ArcsecondAPI, ArcsecondConfig
+
     config = ArcsecondConfig(state)
     _, error = ArcsecondAPI(config).login(username, upload_key=upload_key)
     if error:
@@ -74,6 +104,8 @@ def login(state, username, upload_key):
 @click.argument('fqdn', required=False, nargs=1)
 @pass_state
 def api(state, name=None, fqdn=None):
+    from arcsecond import cli as ArcsecondCLI
+
     ArcsecondCLI.api(state, name, fqdn)
 
 
@@ -84,6 +116,8 @@ def api(state, name=None, fqdn=None):
 @basic_options
 @pass_state
 def datasets(state, organisation=None):
+    from arcsecond import ArcsecondAPI, ArcsecondConfig
+
     org_subdomain = organisation or ''
     if org_subdomain:
         click.echo(f" • Fetching datasets for organisation '{org_subdomain}'...")
@@ -113,9 +147,78 @@ def datasets(state, organisation=None):
 @click.option('-o', '--organisation',
               required=False, nargs=1,
               help="The subdomain, if uploading for an Observatory Portal.")
+@click.option('-j', '--jobs',
+              required=False, nargs=1, type=click.IntRange(min=1), default=1, show_default=True,
+              help="The number of files to upload in parallel.")
+@click.option('-f', '--force',
+              is_flag=True, default=False,
+              help="Upload all files, even those already uploaded from this folder into this dataset.")
+@click.option('--digest',
+              required=False, type=click.Choice(DIGEST_ALGORITHMS),
+              help="Compute a digest of every file to upload, and record it in the local ledger.")
+@click.option('--chunk-threshold',
+              required=False, type=click.IntRange(min=1),
+              help="Experimental: upload files larger than this size (in MB) in resumable chunks, "
+                   "if the server supports it (files are otherwise uploaded in single requests).")
+@click.option('--chunk-size',
+              required=False, type=click.IntRange(min=1), default=64, show_default=True,
+              help="The size (in MB) of the chunks of resumable uploads.")
+@click.option('--asyncio', 'use_asyncio',
+              is_flag=True, default=False,
+              help="Run the upload as an asyncio pipeline, keeping up to --jobs uploads in flight. "
+                   "The HTTP client being blocking, each in-flight upload still takes a worker thread.")
+@click.option('--max-rate',
+              required=False, type=click.FloatRange(min=0, min_open=True),
+              help="The maximum upload bandwidth (in MB/s) shared by all uploads.")
+@click.option('--adaptive',
+              is_flag=True, default=False,
+              help="Adjust the number of parallel uploads (up to --jobs) to the measured throughput and errors.")
+@click.option('--retries',
+              required=False, type=click.IntRange(min=0), default=DEFAULT_MAX_ATTEMPTS - 1, show_default=True,
+              help="The number of times an upload failing with a transient error is retried.")
+@click.option('--retry-budget',
+              required=False, type=click.IntRange(min=0),
+              help="The maximum number of retries for the whole upload (unlimited by default).")
+@click.option('--schedule', 'scheduling_policy',
+              required=False, type=click.Choice(list(SCHEDULING_POLICIES.keys())),
+              default=DEFAULT_SCHEDULING_POLICY, show_default=True,
+              help="The order in which files are uploaded.")
+@click.option('--bundle-threshold',
+              required=False, type=click.FloatRange(min=0, min_open=True),
+              help="Upload files smaller than this size (in MB) grouped into tar archives.")
+@click.option('--bundle-size',
+              required=False, type=click.IntRange(min=1), default=DEFAULT_BUNDLE_SIZE // MB, show_default=True,
+              help="The target size (in MB) of the tar archives of small files.")
+@click.option('--compress', 'compression',
+              required=False, type=click.Choice(list(CODECS.keys())),
+              help="Compress uncompressed FITS and XISF files on the fly, with the given format.")
+@click.option('--metrics-dir',
+              required=False, type=click.Path(file_okay=False, writable=True),
+              help="Write upload metrics into this folder, as a Prometheus textfile and a JSON summary.")
+@click.option('--read-headers',
+              is_flag=True, default=False,
+              help="Read the headers of FITS and XISF files, and attach DATE-OBS, OBJECT, TELESCOP etc. as tags.")
+@click.option('--skip-undated',
+              is_flag=True, default=False,
+              help="Skip FITS and XISF files without DATE-OBS in their header (implies --read-headers).")
+@click.option('--manifest', 'manifest_file',
+              required=False, type=click.Path(exists=True, dir_okay=False),
+              help="Upload the files listed in this manifest (see `oort scan`), instead of scanning the folder.")
+@click.option('--shard',
+              required=False, type=ShardParamType(),
+              help="Only upload the slice i/N of the files (e.g. 2/4), to split an upload across hosts.")
+@click.option('--refresh',
+              is_flag=True, default=False,
+              help="Look the dataset and organisation up again, instead of using those validated by a recent run.")
+@filter_options
 @basic_options
 @pass_state
-def upload(state, folder, dataset=None, organisation=None):
+def upload(state, folder, dataset=None, organisation=None, jobs=1, force=False, digest=None,
+           chunk_threshold=None, chunk_size=64, use_asyncio=False, max_rate=None, adaptive=False,
+           retries=DEFAULT_MAX_ATTEMPTS - 1, retry_budget=None, compression=None, metrics_dir=None,
+           include=(), exclude=(), only_data=False, read_headers=False, skip_undated=False, bundle_threshold=None,
+           bundle_size=DEFAULT_BUNDLE_SIZE // MB, scheduling_policy=DEFAULT_SCHEDULING_POLICY, manifest_file=None,
+           shard=None, refresh=False):
     """
     Upload the content of a folder.
 
@@ -131,19 +234,291 @@ def upload(state, folder, dataset=None, organisation=None):
     (with their UUID).
 
     Oort will then start walking through the folder tree and uploads regular files
-    (hidden and empty files will be skipped).
+    (hidden and empty files will be skipped). Use `--jobs N` to upload N files
+    at a time, which makes a better use of the available bandwidth.
+
+    Oort keeps a local ledger of the uploaded files. Files that have not changed
+    since they were uploaded from the same folder into the same dataset are
+    skipped, unless `--force` is used.
+
+    Files larger than `--chunk-threshold` MB are sent in chunks. An interrupted
+    upload of such a file resumes where it stopped when Oort is run again. This
+    is experimental: it needs a server providing chunked uploads (the
+    'datafiles/uploads/' endpoint). Other servers get files in single requests.
+
+    With `--asyncio`, scanning, uploading and tagging run concurrently as an
+    asyncio pipeline, which can keep hundreds of uploads in flight (with
+    `--jobs`).
+
+    Use `--max-rate` to leave some of the uplink to other uses, and `--adaptive`
+    to let Oort find the best number of parallel uploads by itself.
+
+    Uploads failing with transient errors (lost connections, timeouts, server
+    errors) are retried `--retries` times with an increasing delay. Files still
+    failing are tried once more at the end of the upload.
+
+    Files are uploaded in the order they are found, unless another `--schedule`
+    is chosen: 'newest-first' and 'oldest-first' (by modification time),
+    'smallest-first', 'largest-first', or 'round-robin' (one file of each folder
+    in turn), so that the frames needed first arrive first.
+
+    The estimated upload time uses the throughput measured by past uploads, and
+    the ETA of the progress line the throughput of the current one.
+
+    With `--bundle-threshold`, files smaller than this size are grouped into tar
+    archives of about `--bundle-size` MB, each uploaded as a single datafile.
+    This saves the per-file requests that dominate the upload of many tiny files
+    (logs, thumbnails, sidecar files). Every archive starts with a
+    '__oort_bundle__.json' manifest listing the relative paths of its files, and
+    the local ledger records the bundled files, so that they are not bundled again.
+
+    With `--compress gzip`, uncompressed FITS and XISF files are compressed on
+    the fly (e.g. 'image.fits' is uploaded as 'image.fits.gz'). Raw data often
+    compresses 2 to 4 times, making uploads as much faster on a slow uplink.
+    Files uploaded in chunks are not compressed.
+
+    With `--metrics-dir`, the durations of the upload phases (checking,
+    uploading, tagging), bytes sent, retries and errors are written into
+    'oort_upload.prom' (for the textfile collector of Prometheus' node_exporter)
+    and 'oort_upload.json' at the end of the upload.
+
+    Use `--include` and `--exclude` (both repeatable) to select files with glob
+    patterns. As in .gitignore files, a pattern without a slash matches names at
+    any depth ('*.log'), a pattern with a slash matches paths relative to the
+    folder ('night1/*.fits'), and a trailing slash only matches folders
+    ('reduced/'). Excluded folders are not even walked. `--only-data` keeps FITS
+    and XISF files only.
+
+    With `--read-headers`, the headers of FITS and XISF files are read (pixel
+    data is not), and keys such as DATE-OBS, OBJECT and TELESCOP are attached to
+    the datafiles as tags. Headers are cached locally, by file size and
+    modification time. With `--skip-undated`, FITS and XISF files without
+    DATE-OBS are not uploaded. Other files, zipped ones included (their headers
+    are not read), are uploaded.
+
+    With `--manifest`, the files listed by `oort scan` are uploaded, without
+    scanning the folder again. Paths of the manifest are relative: FOLDER may be
+    where the same storage is mounted on another host. With `--shard i/N`, only
+    a slice of the files is uploaded (chosen by hashing their relative paths),
+    so that N hosts can upload one archive together, each with its own i.
+
+    The dataset and organisation validated by a run are cached locally for an
+    hour, so that frequent runs (e.g. from cron) start uploading sooner. Use
+    `--refresh` to look them up again.
     """
+    from arcsecond import ArcsecondConfig
+
+    from oort.common.api import DEFAULT_POOL_SIZE, OortAPI
+    from oort.common.context import Context
+    from oort.common.validation import ValidationCache
+    from oort.uploader.bundles import Bundler
+    from oort.uploader.headers import HeaderCache
+    from oort.uploader.ledger import UploadLedger
+    from oort.uploader.metrics import UploadMetrics
+    from oort.uploader.pipeline import walk_async
+    from oort.uploader.progress import ThroughputHistory
+    from oort.uploader.retry import RetryPolicy
+    from oort.uploader.scanner import build_manifest, get_root_path, read_manifest_file
+    from oort.uploader.walker import walk
+    from .helpers import build_uploader_options, display_command_summary
+
+    config = ArcsecondConfig(state)
+    # One pool of HTTP connections for the whole command, sized to match the upload concurrency.
+    api = OortAPI(config, organisation, pool_size=max(jobs, DEFAULT_POOL_SIZE))
+    context = Context(config, dataset_uuid_or_name=dataset, subdomain=organisation, api=api,
+                      validation_cache=ValidationCache())
+
+    try:
+        context.validate(refresh=refresh)
+    except InvalidUploadOptionsOortCloudError as e:
+        click.echo(f"\n • ERROR {str(e)} \n")
+        return
+
+    # The folder is scanned only once, and the resulting manifest is used by both the summary and the walk.
+    path_filter = PathFilter(include, exclude, only_data)
+    if manifest_file is not None:
+        try:
+            manifest = read_manifest_file(Path(manifest_file), get_root_path(folder), shard, path_filter)
+        except (OSError, ValueError) as e:
+            click.echo(f"\n • ERROR Unable to read manifest {manifest_file}: {str(e)} \n")
+            return
+    elif shard is not None:
+        manifest = build_manifest(get_root_path(folder), path_filter)
+        manifest.files = [f for f in manifest if shard.contains(f.path.relative_to(manifest.root_path).as_posix())]
+    else:
+        manifest = build_manifest(get_root_path(folder), path_filter)
+    throughput_history = ThroughputHistory()
+    display_command_summary(context, [folder, ], manifests={folder: manifest}, throughput=throughput_history.estimate())
+    ok = input('\n   ----> OK? (Press Enter) ')
+
+    if ok.strip() == '':
+        metrics = UploadMetrics() if metrics_dir else None
+        uploader_options = build_uploader_options(jobs=jobs,
+                                                  chunk_threshold=chunk_threshold,
+                                                  chunk_size=chunk_size,
+                                                  max_rate=max_rate,
+                                                  adaptive=adaptive,
+                                                  compression=compression,
+                                                  metrics=metrics)
+        retry_policy = RetryPolicy(max_attempts=retries + 1, budget=retry_budget)
+        ledger = UploadLedger()
+        header_cache = HeaderCache() if read_headers or skip_undated else None
+        bundler = Bundler(int(bundle_threshold * MB), bundle_size * MB) if bundle_threshold else None
+        try:
+            if use_asyncio:
+                walk_async(context,
+                           folder,
+                           in_flight=jobs,
+                           manifest=manifest,
+                           ledger=ledger,
+                           force=force,
+                           digest_algorithm=digest,
+                           uploader_options=uploader_options,
+                           retry_policy=retry_policy,
+                           path_filter=path_filter,
+                           read_headers=read_headers,
+                           skip_undated=skip_undated,
+                           header_cache=header_cache,
+                           bundler=bundler,
+                           scheduling_policy=scheduling_policy,
+                           throughput_history=throughput_history)
+            else:
+                walk(context,
+                     folder,
+                     jobs=jobs,
+                     manifest=manifest,
+                     ledger=ledger,
+                     force=force,
+                     digest_algorithm=digest,
+                     uploader_options=uploader_options,
+                     retry_policy=retry_policy,
+                     path_filter=path_filter,
+                     read_headers=read_headers,
+                     skip_undated=skip_undated,
+                     header_cache=header_cache,
+                     bundler=bundler,
+                     scheduling_policy=scheduling_policy,
+                     throughput_history=throughput_history)
+        finally:
+            ledger.close()
+            if header_cache is not None:
+                header_cache.close()
+            api.close()
+            if metrics is not None:
+                metrics.finish()
+                metrics.write(Path(metrics_dir))
+                click.echo(f"\n • Upload metrics written into {metrics_dir}")
+
+
+@main.command(help='Scan a folder, and write the list of its files into a manifest file.')
+@click.argument('folder', required=True, nargs=1)
+@click.option('-o', '--output',
+              required=True, type=click.Path(dir_okay=False, writable=True),
+              help="The manifest file to write (gzipped JSON lines).")
+@filter_options
+@basic_options
+@pass_state
+def scan(state, folder, output, include=(), exclude=(), only_data=False):
+    """
+    Scan a folder, and write the list of its files into a manifest file.
+
+    The manifest lists the path (relative to the folder), size and modification
+    time of every file Oort would upload, and is written as the folder is
+    scanned. Use it with `oort upload FOLDER --manifest FILE`, and `--shard i/N`
+    to split the upload of a large archive across several hosts mounting the
+    same storage, without scanning it again.
+    """
+    from oort.uploader.scanner import get_root_path, scan_folder, write_manifest_file
+
+    root_path = get_root_path(folder)
+    path_filter = PathFilter(include, exclude, only_data)
+    count = write_manifest_file(Path(output), root_path, scan_folder(root_path, path_filter))
+    click.echo(f"\n • {count} files of {str(root_path)} written into {output}")
+
+
+@main.command(help='Watch a folder and upload new files as soon as they are written.')
+@click.argument('folder', required=True, nargs=1)
+@click.option('-d', '--dataset',
+              required=True, nargs=1, type=click.STRING,
+              help="The UUID or name of the dataset to put data in.")
+@click.option('-o', '--organisation',
+              required=False, nargs=1,
+              help="The subdomain, if uploading for an Observatory Portal.")
+@click.option('-j', '--jobs',
+              required=False, nargs=1, type=click.IntRange(min=1), default=1, show_default=True,
+              help="The number of files to upload in parallel.")
+@click.option('--settle',
+              required=False, nargs=1, type=click.FloatRange(min=0), default=DEFAULT_SETTLE_DELAY, show_default=True,
+              help="The number of seconds a file must stay unchanged before being uploaded.")
+@click.option('--polling',
+              is_flag=True, default=False,
+              help="Poll the folder instead of using filesystem events (e.g. for network file systems).")
+@click.option('--poll-interval',
+              required=False, nargs=1, type=click.FloatRange(min=0.1), default=DEFAULT_POLL_INTERVAL,
+              show_default=True,
+              help="The number of seconds between two scans of the folder, when polling.")
+@click.option('--max-rate',
+              required=False, type=click.FloatRange(min=0, min_open=True),
+              help="The maximum upload bandwidth (in MB/s) shared by all uploads.")
+@click.option('--refresh',
+              is_flag=True, default=False,
+              help="Look the dataset and organisation up again, instead of using those validated by a recent run.")
+@filter_options
+@basic_options
+@pass_state
+def watch(state, folder, dataset=None, organisation=None, jobs=1, settle=DEFAULT_SETTLE_DELAY, polling=False,
+          poll_interval=DEFAULT_POLL_INTERVAL, max_rate=None, include=(), exclude=(), only_data=False,
+          refresh=False):
+    """
+    Watch a folder, and upload its new files as soon as they have been written.
+
+    Files already present in the folder and not yet uploaded are uploaded first.
+    Then, Oort uses filesystem events (inotify, on Linux) to detect new or
+    modified files. Use `--polling` on file systems that do not report events
+    (such as some network mounts). A file is uploaded once it has not changed
+    for `--settle` seconds.
+
+    `--include`, `--exclude` and `--only-data` select files as for `oort upload`,
+    and `--refresh` ignores the cached dataset and organisation as well.
+
+    Press Ctrl-C to stop watching.
+    """
+    from arcsecond import ArcsecondConfig
+
+    from oort.common.api import DEFAULT_POOL_SIZE, OortAPI
+    from oort.common.context import Context
+    from oort.common.validation import ValidationCache
+    from oort.uploader.ledger import UploadLedger
+    from oort.uploader.watcher import watch as watch_folder
+    from .helpers import build_uploader_options, display_command_summary
+
     config = ArcsecondConfig(state)
-    context = Context(config, dataset_uuid_or_name=dataset, subdomain=organisation)
+    api = OortAPI(config, organisation, pool_size=max(jobs, DEFAULT_POOL_SIZE))
+    context = Context(config, dataset_uuid_or_name=dataset, subdomain=organisation, api=api,
+                      validation_cache=ValidationCache())
 
     try:
-        context.validate()
+        context.validate(refresh=refresh)
     except InvalidUploadOptionsOortCloudError as e:
         click.echo(f"\n • ERROR {str(e)} \n")
         return
 
-    display_command_summary(context, [folder, ])
+    path_filter = PathFilter(include, exclude, only_data)
+    display_command_summary(context, [folder, ], path_filter=path_filter)
     ok = input('\n   ----> OK? (Press Enter) ')
 
     if ok.strip() == '':
-        walk(context, folder)
+        ledger = UploadLedger()
+        try:
+            watch_folder(context,
+                         folder,
+                         ledger,
+                         jobs=jobs,
+                         settle_delay=settle,
+                         use_polling=polling,
+                         poll_interval=poll_interval,
+                         path_filter=path_filter,
+                         uploader_options=build_uploader_options(max_rate=max_rate))
+        finally:
+            ledger.close()
+            api.close()
@@ -1,41 +1,31 @@
-import math
 import pathlib
+from typing import Optional
 
 import click
 
+from oort.common.constants import MB
 from oort.common.context import Context
-from oort.common.utils import is_file_hidden
-
-
-def __get_formatted_time(seconds):
-    if seconds > 86400:
-        return f"{seconds / 86400:.1f}d"
-    elif seconds > 3600:
-        return f"{seconds / 3600:.1f}h"
-    elif seconds > 60:
-        return f"{seconds / 60:.1f}m"
-    else:
-        return f"{seconds:.1f}s"
+from oort.uploader.compression import get_codec
+from oort.uploader.filters import PathFilter
+from oort.uploader.metrics import UploadMetrics
+from oort.uploader.progress import format_duration, format_size
+from oort.uploader.throttle import AdaptiveConcurrencyLimiter, TokenBucket
+from oort.uploader.scanner import build_manifest, get_root_path
 
 
 def __get_formatted_size_times(size):
-    total = f"{__get_formatted_time(size / pow(10, 4))} on 10 kB/s, "
-    total += f"{__get_formatted_time(size / pow(10, 5))} on 100 kB/s, "
-    total += f"{__get_formatted_time(size / pow(10, 6))} on 1 MB/s, "
-    total += f"{__get_formatted_time(size / pow(10, 7))} on 10 MB/s"
+    total = f"{format_duration(size / pow(10, 4))} on 10 kB/s, "
+    total += f"{format_duration(size / pow(10, 5))} on 100 kB/s, "
+    total += f"{format_duration(size / pow(10, 6))} on 1 MB/s, "
+    total += f"{format_duration(size / pow(10, 7))} on 10 MB/s"
     return total
 
 
-def __get_formatted_bytes_size(size):
-    if size == 0:
-        return '0 Bytes'
-    k = 1024
-    units = ['Bytes', 'kB', 'MB', 'GB', 'TB', 'PB', 'EB', 'ZB', 'YB']
-    i = math.floor(math.log10(1.0 * size) / math.log10(k))
-    return f"{(size / math.pow(k, i)):.2f} {units[i]}"
-
-
-def display_command_summary(context: Context, folders: list):
+def display_command_summary(context: Context,
+                            folders: list,
+                            manifests: Optional[dict] = None,
+                            path_filter: Optional[PathFilter] = None,
+                            throughput: Optional[float] = None):
     click.echo("\n --- Upload summary --- ")
     click.echo(f" • Arcsecond username: @{context.config.username} (Upload key: {context.config.upload_key[:4]}••••)")
     if context.organisation_subdomain:
@@ -56,12 +46,45 @@ def display_command_summary(context: Context, folders: list):
     click.echo(f" • Using API server: {context.config.api_name}")
     click.echo(f" • Folder{'s' if len(folders) > 1 else ''}:")
     for folder in folders:
-        folder_path = pathlib.Path(folder).expanduser().resolve()
-        click.echo(f"   > Path: {str(folder_path.parent if folder_path.is_file() else folder_path)}")
+        folder_path = get_root_path(folder)
+        click.echo(f"   > Path: {str(folder_path)}")
 
         if folder_path == pathlib.Path.home():
             click.echo("   >>> Warning: This folder is your HOME folder. <<<")
 
-        size = sum(f.stat().st_size for f in folder_path.glob('**/*') if f.is_file() and not is_file_hidden(f))
-        click.echo(f"   > Volume: {__get_formatted_bytes_size(size)} in total in this folder.")
-        click.echo(f"   > Estimated upload time: {__get_formatted_size_times(size)}")
+        manifest = (manifests or {}).get(folder)
+        if manifest is None:
+            manifest = build_manifest(folder_path, path_filter)
+        size = manifest.total_size
+        excluded = 'hidden and filtered out' if path_filter else 'hidden'
+        click.echo(f"   > Files: {len(manifest)} ({excluded} files and folders excluded).")
+        click.echo(f"   > Volume: {format_size(size)} in total in this folder.")
+        if throughput:
+            msg = f"{format_duration(size / throughput)} at {format_size(throughput)}/s"
+            click.echo(f"   > Estimated upload time: {msg} (as measured by past uploads)")
+        else:
+            click.echo(f"   > Estimated upload time: {__get_formatted_size_times(size)}")
+
+
+def build_uploader_options(jobs: int = 1,
+                           chunk_threshold: Optional[int] = None,
+                           chunk_size: Optional[int] = None,
+                           max_rate: Optional[float] = None,
+                           adaptive: bool = False,
+                           compression: Optional[str] = None,
+                           metrics: Optional[UploadMetrics] = None) -> dict:
+    """Convert upload command options (sizes in MB, rates in MB/s) into FileUploader options."""
+    options = {}
+    if chunk_threshold is not None:
+        options.update(chunk_threshold=chunk_threshold * MB)
+    if chunk_size is not None:
+        options.update(chunk_size=chunk_size * MB)
+    if max_rate is not None:
+        options.update(rate_limiter=TokenBucket(max_rate * MB))
+    if adaptive and jobs > 1:
+        options.update(concurrency_limiter=AdaptiveConcurrencyLimiter(max_limit=jobs, initial_limit=max(1, jobs // 2)))
+    if compression is not None:
+        options.update(codec=get_codec(compression))
+    if metrics is not None:
+        options.update(metrics=metrics)
+    return options
@@ -1,6 +1,24 @@
 import click
 
-from arcsecond.options import State
+
+class State(object):
+    """The options shared by all commands, as arcsecond.options.State (which ArcsecondConfig accepts).
+
+    Defined here, so that parsing the command line does not import arcsecond.
+    """
+
+    def __init__(self, is_using_cli=True, verbose=0, api_name='main'):
+        self.is_using_cli = is_using_cli
+        self.verbose = verbose
+        self.api_name = api_name
+
+    def update(self, **kwargs):
+        self.is_using_cli = kwargs.get('is_using_cli', self.is_using_cli)
+        self.verbose = kwargs.get('verbose', self.verbose)
+        self.api_name = kwargs.get('api_name', self.api_name)
+
+    def make_new_silent(self):
+        return State(is_using_cli=self.is_using_cli, verbose=0, api_name=self.api_name)
 
 
 def verbose_option_constructor(f):
@@ -35,6 +53,16 @@ def basic_options(f):
     return f
 
 
+def filter_options(f):
+    f = click.option('--only-data', is_flag=True, default=False,
+                     help='Only upload FITS and XISF files (compressed or not).')(f)
+    f = click.option('--exclude', multiple=True,
+                     help='Skip files and folders matching this glob (e.g. "*.log", "reduced/"). Can be repeated.')(f)
+    f = click.option('--include', multiple=True,
+                     help='Only upload files matching this glob (e.g. "*.fits"). Can be repeated.')(f)
+    return f
+
+
 class MethodChoiceParamType(click.ParamType):
     name = 'method'
 
@@ -48,3 +76,18 @@ class MethodChoiceParamType(click.ParamType):
             msg += 'It must be one of {}.'.format(' '.join(self.allowed_methods))
             self.fail('%s is not a valid method' % value, param, ctx)
         return value.lower()
+
+
+class ShardParamType(click.ParamType):
+    name = 'shard'
+
+    def convert(self, value, param, ctx):
+        from oort.uploader.scanner import Shard
+
+        if isinstance(value, Shard):
+            return value
+        try:
+            number, count = (int(part) for part in value.split('/'))
+            return Shard(number, count)
+        except ValueError:
+            self.fail(f'{value} is not a valid shard. It must be i/N, with 1 <= i <= N (e.g. 2/4).', param, ctx)
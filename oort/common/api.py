@@ -0,0 +1,83 @@
+from typing import Optional
+
+import click
+import requests
+from arcsecond import ArcsecondAPIEndpoint, ArcsecondConfig
+from arcsecond.errors import ArcsecondError
+from requests.adapters import HTTPAdapter
+
+from .errors import OortAPIResponseError
+
+DEFAULT_POOL_SIZE = 10
+REQUEST_TIMEOUT = 60
+
+
+def build_session(pool_size: int = DEFAULT_POOL_SIZE) -> requests.Session:
+    """Build an HTTP session keeping up to pool_size connections alive per host."""
+    session = requests.Session()
+    # Blocking the pool makes threads wait for a free connection, instead of opening (and then
+    # discarding) extra ones when there are more concurrent requests than pooled connections.
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class SessionAPIEndpoint(ArcsecondAPIEndpoint):
+    """An ArcsecondAPIEndpoint sending its requests through a shared session, to reuse connections."""
+
+    def __init__(self,
+                 session: requests.Session,
+                 config: ArcsecondConfig,
+                 path: str,
+                 subdomain: str = '',
+                 subresource: str = ''):
+        super().__init__(config, path, subdomain, subresource)
+        self._session = session
+        self._config = config
+
+    def _perform_request(self, url, method_name, json=None, data=None, headers=None):
+        if self._config.verbose:
+            click.echo(f'Sending {method_name} request to {url}')
+
+        headers = self._check_and_set_auth_key(headers or {}, url)
+        response = self._session.request(method_name.upper(),
+                                         url,
+                                         json=json,
+                                         data=data,
+                                         headers=headers,
+                                         timeout=REQUEST_TIMEOUT)
+
+        if response is not None:
+            if 200 <= response.status_code < 300:
+                return response.json() if response.text else {}, None
+            else:
+                # The status code tells whether the request is worth retrying.
+                return None, OortAPIResponseError(response.text, response.status_code)
+        else:
+            return None, ArcsecondError()
+
+
+class OortAPI(object):
+    """The endpoints of the Arcsecond API used by Oort, sharing a single pool of HTTP connections.
+
+    One instance is built per command, and is shared by the validation calls, the dataset
+    resolution, the uploads and the tag updates.
+    """
+
+    def __init__(self,
+                 config: ArcsecondConfig,
+                 subdomain: Optional[str] = '',
+                 session: Optional[requests.Session] = None,
+                 pool_size: int = DEFAULT_POOL_SIZE):
+        self.config = config
+        self.subdomain = subdomain or ''
+        self.session = session or build_session(pool_size)
+
+        self.organisations = SessionAPIEndpoint(self.session, self.config, 'organisations')  # never subdomain here
+        self.datasets = SessionAPIEndpoint(self.session, self.config, 'datasets', self.subdomain)
+        self.datafiles = SessionAPIEndpoint(self.session, self.config, 'datafiles', self.subdomain)
+        self.datafile_uploads = SessionAPIEndpoint(self.session, self.config, 'datafiles/uploads', self.subdomain)
+
+    def close(self):
+        self.session.close()
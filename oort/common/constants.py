@@ -68,3 +68,19 @@ class Substatus(Enum):
     SKIPPED_HIDDEN_FILE = 'skipped (hidden file)'
     SKIPPED_EMPTY_FILE = 'skipped (empty file)'
     # ---
+
+
+# --- Defaults shown by the command line. Defined here, and not in the modules using them, so that
+# `oort --help` and `oort --version` do not import the uploader stack (nor arcsecond and requests). ---
+
+MB = 1024 * 1024
+
+LOG_FORMATS = ['text', 'json']
+DEFAULT_LOG_MAX_BYTES = 50 * MB
+
+DIGEST_ALGORITHMS = ['sha256', 'blake2b']
+DEFAULT_MAX_ATTEMPTS = 4
+DEFAULT_BUNDLE_SIZE = 64 * MB
+
+DEFAULT_SETTLE_DELAY = 5.0
+DEFAULT_POLL_INTERVAL = 10.0
@@ -1,7 +1,9 @@
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 
 import click
-from arcsecond import ArcsecondAPI, ArcsecondConfig
+from arcsecond import ArcsecondConfig
 
 from oort.cli.errors import (
     UnknownOrganisationOortCloudError,
@@ -11,23 +13,65 @@ from oort.cli.errors import (
     InvalidOrganisationDatasetOortCloudError,
     InvalidDatasetOortCloudError
 )
+from .api import OortAPI
+from .validation import ValidationCache
 
 
 class Context(object):
-    def __init__(self, config: ArcsecondConfig, dataset_uuid_or_name: str, subdomain: str):
+    def __init__(self,
+                 config: ArcsecondConfig,
+                 dataset_uuid_or_name: str,
+                 subdomain: str,
+                 api: Optional[OortAPI] = None,
+                 validation_cache: Optional[ValidationCache] = None):
         self._config = config
         self._dataset_uuid_or_name = dataset_uuid_or_name
         self._subdomain = subdomain
         self._dataset = None
         self._organisation = None
-        self._api = ArcsecondAPI(config, subdomain)
+        self._api = api or OortAPI(config, subdomain)
+        self._validation_cache = validation_cache
 
-    def validate(self):
+    def validate(self, refresh: bool = False):
+        """Check the credentials, the dataset and the organisation, using the lookups cached by past runs.
+
+        With refresh, cached lookups are ignored (and replaced). The role is checked first, as it is
+        local. The dataset and organisation lookups are independent, and run concurrently.
+        """
         self._validate_local_astronomer_credentials()
-        self._validate_dataset_uuid()
-        if self._subdomain:
-            self._validate_remote_organisation()
-            self._validate_astronomer_role_in_remote_organisation()
+        if refresh:
+            self.invalidate_cached_lookups()
+        if not self._subdomain:
+            self._validate_dataset_uuid()
+            return
+
+        self._validate_astronomer_role_in_remote_organisation()
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [executor.submit(self._validate_dataset_uuid),
+                       executor.submit(self._validate_remote_organisation)]
+        # Errors are raised in the same order as when lookups were sequential.
+        for future in futures:
+            future.result()
+
+    def _get_cache_key(self, kind: str, name: str) -> str:
+        # Lookups depend on the server and on the account making them.
+        fragments = [self._config.api_server, self._config.username, self._subdomain, kind, name]
+        return '|'.join(fragment or '' for fragment in fragments)
+
+    def _read_cached_lookup(self, kind: str, name: str) -> Optional[dict]:
+        if self._validation_cache is None:
+            return None
+        return self._validation_cache.get(self._get_cache_key(kind, name))
+
+    def _cache_lookup(self, kind: str, name: str, value: dict):
+        if self._validation_cache is not None:
+            self._validation_cache.set(self._get_cache_key(kind, name), value)
+
+    def invalidate_cached_lookups(self):
+        """Forget the cached lookups of this dataset and organisation, e.g. when the dataset was deleted."""
+        if self._validation_cache is not None:
+            self._validation_cache.invalidate(self._get_cache_key('dataset', str(self._dataset_uuid_or_name)),
+                                              self._get_cache_key('organisation', self._subdomain or ''))
 
     def _validate_local_astronomer_credentials(self):
         username = self._config.username
@@ -39,18 +83,24 @@ class Context(object):
             raise InvalidWatchOptionsOortCloudError('Missing upload_key.')
 
     def _validate_dataset_uuid(self):
+        cached_dataset = self._read_cached_lookup('dataset', str(self._dataset_uuid_or_name))
+        if cached_dataset is not None:
+            click.echo(f" • Using the details of dataset {self._dataset_uuid_or_name} cached by a previous run.")
+            self._dataset = cached_dataset
+            return
+
         try:
             uuid.UUID(self._dataset_uuid_or_name)
         except ValueError:
             click.echo(f" • Looking for a dataset with name {self._dataset_uuid_or_name}...")
             datasets_list, error = self._api.datasets.list(**{'name': self._dataset_uuid_or_name})
-            if len(datasets_list) == 0:
+            if error is None and len(datasets_list) == 0:
                 click.echo(f" • No dataset with name {self._dataset_uuid_or_name} found. It will be created.")
                 self._dataset = {'name': self._dataset_uuid_or_name}
-            elif len(datasets_list) == 1:
+            elif error is None and len(datasets_list) == 1:
                 click.echo(f" • One dataset with name {self._dataset_uuid_or_name}. Data will be appended to it.")
                 self._dataset = datasets_list[0]
-            else:
+            elif error is None:
                 error = f"Multiple datasets with name {self._dataset_uuid_or_name} found. Be more specific."
         else:
             click.echo(f" • Fetching details of dataset {self._dataset_uuid_or_name}...")
@@ -64,11 +114,22 @@ class Context(object):
             else:
                 raise InvalidDatasetOortCloudError(str(self._dataset_uuid_or_name), str(error))
 
+        # A dataset still to be created is not cached: the next run finds it by its name.
+        if self._dataset.get('uuid'):
+            self._cache_lookup('dataset', str(self._dataset_uuid_or_name), self._dataset)
+
     def _validate_remote_organisation(self):
+        cached_organisation = self._read_cached_lookup('organisation', self._subdomain)
+        if cached_organisation is not None:
+            click.echo(f" • Using the details of organisation {self._subdomain} cached by a previous run.")
+            self._organisation = cached_organisation
+            return
+
         click.echo(f" • Fetching details of organisation {self._subdomain}...")
         self._organisation, error = self._api.organisations.read(self._subdomain)
         if error is not None:
             raise UnknownOrganisationOortCloudError(self._subdomain, str(error))
+        self._cache_lookup('organisation', self._subdomain, self._organisation)
 
     def _validate_astronomer_role_in_remote_organisation(self):
         role = self._config.read_key(self._subdomain)
@@ -79,6 +140,10 @@ class Context(object):
         assert dataset != None
         self._dataset = dataset
 
+    @property
+    def api(self) -> OortAPI:
+        return self._api
+
     @property
     def config(self):
         return self._config
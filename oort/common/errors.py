@@ -4,3 +4,9 @@ class OortCloudError(Exception):
 
     def __str__(self):
         return self.message
+
+
+class OortAPIResponseError(OortCloudError):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
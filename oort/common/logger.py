@@ -1,27 +1,165 @@
+import atexit
+import json
 import os
+import queue
+import threading
 from datetime import datetime
-from logging import DEBUG, FileHandler, Formatter, INFO, Logger, StreamHandler, getLogger
+from logging import DEBUG, Formatter, Handler, INFO, Logger, LogRecord, StreamHandler, getLogger
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
 from pathlib import Path
+from typing import Optional
 
+from .constants import DEFAULT_LOG_MAX_BYTES, LOG_FORMATS
+from .utils import get_oort_config_dir_path
 
-def get_oort_logger(debug=False) -> Logger:
+DEFAULT_LOG_BACKUP_COUNT = 10
+
+_settings = None
+_listener = None
+_lock = threading.Lock()
+
+
+class JSONFormatter(Formatter):
+    """Format records as JSON lines, for log collectors and for grepping huge runs with jq."""
+
+    def format(self, record: LogRecord) -> str:
+        entry = {'time': datetime.fromtimestamp(record.created).isoformat(),
+                 'level': record.levelname,
+                 'logger': record.name,
+                 'thread': record.threadName,
+                 'message': record.getMessage()}
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _LazyHandler(Handler):
+    """Start the logging thread and open the log file on the first record only.
+
+    Processes spawned for compression or hashing import the loggers, and most never log anything.
+    """
+
+    def emit(self, record: LogRecord):
+        _start_oort_logging().handle(record)
+
+
+def _get_base_logger() -> Logger:
     suffix = '-tests' if os.environ.get('OORT_TESTS') == '1' else ''
-    logger = getLogger('oort-cloud' + suffix)
-    logger.setLevel(DEBUG if debug else INFO)
+    return getLogger('oort-cloud' + suffix)
+
+
+def get_oort_log_dir_path() -> Path:
+    return Path(os.environ.get('OORT_LOG_DIR') or get_oort_config_dir_path() / 'logs').expanduser()
+
+
+def configure_oort_logging(log_dir: Optional[Path] = None,
+                           log_format: str = 'text',
+                           debug: bool = False,
+                           max_bytes: int = DEFAULT_LOG_MAX_BYTES,
+                           backup_count: int = DEFAULT_LOG_BACKUP_COUNT,
+                           rotate_when: Optional[str] = None):
+    """(Re)configure the Oort loggers. Called with default values by the first get_oort_logger.
+
+    Loggers only put records in a queue: a background thread writes them to the console and to
+    a log file, rotated by size (or by time, with rotate_when, e.g. 'midnight'). Uploads never wait
+    for a slow disk or terminal. The thread is started, and the log folder created, by the first record.
+    """
+    global _settings
+    if log_format not in LOG_FORMATS:
+        raise ValueError(f'Unknown log format: {log_format}')
+
+    logger = _get_base_logger()
+    with _lock:
+        _stop_listener()
+        _settings = dict(log_dir=log_dir, log_format=log_format, max_bytes=max_bytes,
+                         backup_count=backup_count, rotate_when=rotate_when)
+        _replace_handler(logger, _LazyHandler())
+        logger.setLevel(DEBUG if debug else INFO)
+
+
+def _build_handlers(log_dir: Optional[Path],
+                    log_format: str,
+                    max_bytes: int,
+                    backup_count: int,
+                    rotate_when: Optional[str]) -> list:
+    text_formatter = Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    handlers = []
+    if os.environ.get('OORT_TESTS') != '1':
+        log_dir = Path(log_dir).expanduser() if log_dir else get_oort_log_dir_path()
+        log_dir.mkdir(parents=True, exist_ok=True)
+        # Rotation renames files behind the back of other writers: each process has its own log file.
+        log_file_path = log_dir / f"oort-{os.getpid()}.{'jsonl' if log_format == 'json' else 'log'}"
+        # Log files are only created once there is something to write.
+        if rotate_when is not None:
+            file_handler = TimedRotatingFileHandler(log_file_path, when=rotate_when, backupCount=backup_count,
+                                                    encoding='utf-8', delay=True)
+        else:
+            file_handler = RotatingFileHandler(log_file_path, maxBytes=max_bytes, backupCount=backup_count,
+                                               encoding='utf-8', delay=True)
+        file_handler.setFormatter(JSONFormatter() if log_format == 'json' else text_formatter)
+        handlers.append(file_handler)
+
+    console_handler = StreamHandler()
+    console_handler.setFormatter(text_formatter)
+    handlers.append(console_handler)
+    return handlers
+
+
+def _start_oort_logging() -> QueueHandler:
+    global _listener
+    logger = _get_base_logger()
+    with _lock:
+        for handler in logger.handlers:
+            if isinstance(handler, QueueHandler):
+                return handler
+
+        # The queue is unbounded: putting a record never blocks.
+        log_queue = queue.SimpleQueue()
+        queue_handler = QueueHandler(log_queue)
+        _listener = QueueListener(log_queue, *_build_handlers(**_settings))
+        _listener.start()
+        _replace_handler(logger, queue_handler)
+        return queue_handler
+
+
+def _replace_handler(logger: Logger, new_handler: Handler):
+    for handler in list(logger.handlers):
+        if isinstance(handler, (QueueHandler, _LazyHandler)):
+            logger.removeHandler(handler)
+    logger.addHandler(new_handler)
+
+
+def _stop_listener():
+    global _listener
+    if _listener is not None:
+        # Records already queued are written by the current handlers before they are closed.
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+def shutdown_oort_logging():
+    """Write the records still queued, and close the log files."""
+    with _lock:
+        _stop_listener()
+
+
+def _reset_in_forked_child():
+    global _listener, _lock
+    # The listener thread of the parent does not exist in a forked child, which logs into its own file.
+    _lock = threading.Lock()
+    _listener = None
+    if _settings is not None:
+        _replace_handler(_get_base_logger(), _LazyHandler())
 
-    if len(logger.handlers) == 0:
-        formatter = Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
-        if os.environ.get('OORT_TESTS') != '1':
-            log_file_path = Path(f'oort_{datetime.now().replace(microsecond=0).isoformat()}.log')
-            file_handler = FileHandler(log_file_path)
-            file_handler.setLevel(DEBUG if debug else INFO)
-            file_handler.setFormatter(formatter)
-            logger.addHandler(file_handler)
+atexit.register(shutdown_oort_logging)
+os.register_at_fork(after_in_child=_reset_in_forked_child)
 
-        console_handler = StreamHandler()
-        console_handler.setLevel(DEBUG if debug else INFO)
-        console_handler.setFormatter(formatter)
-        logger.addHandler(console_handler)
 
-    return logger
+def get_oort_logger(name: Optional[str] = None) -> Logger:
+    """Return the Oort logger, or one of its children. Cheap: call it once per module."""
+    if _settings is None:
+        configure_oort_logging()
+    logger = _get_base_logger()
+    return logger.getChild(name) if name else logger
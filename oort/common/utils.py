@@ -1,14 +1,23 @@
 import os
+from pathlib import Path
 from typing import Optional
 
-from arcsecond import ArcsecondAPI
 
+def get_oort_config_dir_path() -> Path:
+    dir_path = Path(os.environ.get('OORT_CONFIG_DIR') or Path.home() / '.config' / 'oort').expanduser()
+    dir_path.mkdir(parents=True, exist_ok=True)
+    return dir_path
 
-def is_file_hidden(path):
-    return any([part for part in path.parts if len(part) > 0 and part[0] == '.'])
+
+def get_oort_config_file_path(name: str, extension: str) -> Path:
+    suffix = '-tests' if os.environ.get('OORT_TESTS') == '1' else ''
+    return get_oort_config_dir_path() / f'{name}{suffix}.{extension}'
 
 
 def build_endpoint_kwargs(api: str = 'main', subdomain: Optional[str] = None):
+    # arcsecond (and requests) are only imported by the commands talking to the API.
+    from arcsecond import ArcsecondAPI
+
     test = os.environ.get('OORT_TESTS') == '1'
     upload_key = ArcsecondAPI.upload_key(api=api)
     kwargs = {'test': test, 'api': api, 'upload_key': upload_key}
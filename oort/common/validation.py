@@ -0,0 +1,60 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+from .utils import get_oort_config_file_path
+
+DEFAULT_VALIDATION_TTL = 3600.0
+
+
+class ValidationCache(object):
+    """The organisations and datasets validated by past runs, kept locally for ttl seconds.
+
+    Commands run every few minutes (e.g. by cron) then skip the lookups made by the previous ones.
+    Entries are keyed by API server and username, and can be invalidated explicitly. Several
+    processes may share the file: each write merges the entries written by the others.
+    """
+
+    def __init__(self, file_path: Optional[Path] = None, ttl: float = DEFAULT_VALIDATION_TTL):
+        self._file_path = file_path or get_oort_config_file_path('validation', 'json')
+        self._ttl = ttl
+        self._lock = threading.Lock()
+
+    def _read(self) -> dict:
+        try:
+            entries = json.loads(self._file_path.read_text()).get('entries', {})
+        except (OSError, ValueError, AttributeError):
+            # A missing or corrupted cache only means lookups are made again.
+            return {}
+        now = time.time()
+        return {key: entry for key, entry in entries.items() if entry.get('expires', 0) > now}
+
+    def _write(self, entries: dict):
+        temporary_path = self._file_path.with_name(f'.{self._file_path.name}.{os.getpid()}.{threading.get_ident()}')
+        try:
+            temporary_path.write_text(json.dumps({'entries': entries}))
+            os.replace(temporary_path, self._file_path)
+        except OSError:
+            pass
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._read().get(key)
+        return entry['value'] if entry is not None else None
+
+    def set(self, key: str, value: dict):
+        with self._lock:
+            entries = self._read()
+            entries[key] = {'expires': time.time() + self._ttl, 'value': value}
+            self._write(entries)
+
+    def invalidate(self, *keys: str):
+        """Forget the given entries, or all of them if no key is given."""
+        with self._lock:
+            entries = self._read()
+            for key in keys or list(entries.keys()):
+                entries.pop(key, None)
+            self._write(entries)
@@ -0,0 +1,207 @@
+import hashlib
+import json
+import tarfile
+from pathlib import Path
+from typing import Callable, Optional
+
+from oort.common.constants import DEFAULT_BUNDLE_SIZE
+from oort.common.context import Context
+from .multipart import (STREAM_BLOCK_SIZE, build_boundary, encode_multipart_epilogue, encode_multipart_preamble,
+                        get_content_type)
+from .uploader import FileUploader
+
+DEFAULT_BUNDLE_THRESHOLD = 1024 * 1024
+
+# The first member of every bundle: the list of the bundled files, with their size and mtime.
+BUNDLE_MANIFEST_NAME = '__oort_bundle__.json'
+
+TAR_BLOCK_SIZE = tarfile.BLOCKSIZE
+
+
+def _get_padding(size: int) -> bytes:
+    return b'\0' * (-size % TAR_BLOCK_SIZE)
+
+
+def _build_tar_header(name: str, size: int, mtime: float) -> bytes:
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = int(mtime)
+    info.mode = 0o644
+    # Long or non-ASCII names get an extended header, which the length computed upfront accounts for.
+    return info.tobuf(format=tarfile.PAX_FORMAT, encoding='utf-8', errors='surrogateescape')
+
+
+class Bundle(object):
+    """A group of small files, uploaded as a single tar archive, named after its content.
+
+    A bundle stands for a scanned file in walks: it has a (virtual) path below the root folder, a
+    size, and no metadata.
+    """
+
+    def __init__(self, root_path: Path, files: list):
+        self.files = files
+        self.relative_paths = [f.path.relative_to(root_path).as_posix() for f in files]
+        self.size = sum(f.size for f in files)
+        self.mtime = max(f.mtime for f in files)
+        self.digest = None
+        self.metadata = None
+        # Bundling the same files again gives the same name.
+        fingerprint = hashlib.sha256()
+        for relative_path, scanned_file in zip(self.relative_paths, files):
+            fingerprint.update(f'{relative_path}\0{scanned_file.size}\0{scanned_file.mtime}\n'.encode())
+        self.name = f'oort-bundle-{fingerprint.hexdigest()[:16]}.tar'
+        self.path = root_path / self.name
+
+    def __len__(self):
+        return len(self.files)
+
+    def __repr__(self):
+        return f'Bundle({self.name!r}, files={len(self.files)}, size={self.size})'
+
+    def build_manifest(self) -> bytes:
+        members = [{'path': relative_path, 'size': scanned_file.size, 'mtime': scanned_file.mtime}
+                   for relative_path, scanned_file in zip(self.relative_paths, self.files)]
+        return json.dumps({'files': members}, indent=1).encode()
+
+
+class Bundler(object):
+    """Group the files smaller than threshold bytes into bundles of about target_size bytes.
+
+    Files are bundled in path order, so that files of a same folder end up in the same bundles.
+    """
+
+    def __init__(self, threshold: int = DEFAULT_BUNDLE_THRESHOLD, target_size: int = DEFAULT_BUNDLE_SIZE):
+        self.threshold = threshold
+        self.target_size = target_size
+
+    def plan(self, root_path: Path, scanned_files: list):
+        """Split scanned files into (bundles, remaining files). Lone small files are not bundled."""
+        small_files, remaining_files = [], []
+        for scanned_file in scanned_files:
+            (small_files if scanned_file.size < self.threshold else remaining_files).append(scanned_file)
+
+        bundles, current, current_size = [], [], 0
+        for scanned_file in sorted(small_files, key=lambda f: f.path):
+            if len(current) > 0 and current_size + scanned_file.size > self.target_size:
+                bundles.append(current)
+                current, current_size = [], 0
+            current.append(scanned_file)
+            current_size += scanned_file.size
+        if len(current) > 0:
+            bundles.append(current)
+
+        remaining_files += [files[0] for files in bundles if len(files) == 1]
+        return [Bundle(root_path, files) for files in bundles if len(files) > 1], remaining_files
+
+
+def get_item_paths(item) -> list:
+    """Return the paths of the files uploaded by a walk item: a scanned file, or a bundle."""
+    return [str(f.path) for f in item.files] if isinstance(item, Bundle) else [str(item.path)]
+
+
+class TarBundleBody(object):
+    """A multipart/form-data body made of form fields and a bundle, streamed as a tar archive.
+
+    Bundled files being small, each one is read whole when its turn comes, and small members are
+    coalesced into blocks of STREAM_BLOCK_SIZE. The length of the archive is computed upfront from
+    the scanned sizes: a file whose size has changed since makes the upload fail.
+    """
+
+    def __init__(self,
+                 fields: list,
+                 bundle: Bundle,
+                 boundary: Optional[str] = None,
+                 callback: Optional[Callable[[int], None]] = None):
+        self.boundary = boundary or build_boundary()
+        self._bundle = bundle
+        self._callback = callback
+        self._prefix = encode_multipart_preamble(self.boundary, fields, bundle.name)
+        self._suffix = encode_multipart_epilogue(self.boundary)
+        self._manifest = bundle.build_manifest()
+        self._headers = [_build_tar_header(BUNDLE_MANIFEST_NAME, len(self._manifest), bundle.mtime)]
+        self._headers += [_build_tar_header(relative_path, f.size, f.mtime)
+                          for relative_path, f in zip(bundle.relative_paths, bundle.files)]
+        self._length = sum(len(header) for header in self._headers)
+        sizes = [len(self._manifest)] + [f.size for f in bundle.files]
+        self._length += sum(size + len(_get_padding(size)) for size in sizes)
+        self._length += 2 * TAR_BLOCK_SIZE
+        self._blocks = None
+        self.bytes_read = 0
+
+    @property
+    def content_type(self) -> str:
+        return get_content_type(self.boundary)
+
+    def open(self):
+        self._blocks = self._iter_blocks()
+        return self
+
+    def close(self):
+        self._blocks = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return len(self._prefix) + self._length + len(self._suffix)
+
+    def _iter_members(self):
+        yield self._headers[0]
+        yield self._manifest
+        yield _get_padding(len(self._manifest))
+        for header, scanned_file in zip(self._headers[1:], self._bundle.files):
+            with open(scanned_file.path, 'rb') as f:
+                content = f.read(scanned_file.size)
+            if len(content) != scanned_file.size:
+                raise OSError(f'{str(scanned_file.path)} has changed since it was scanned.')
+            yield header
+            yield content
+            yield _get_padding(scanned_file.size)
+        yield b'\0' * (2 * TAR_BLOCK_SIZE)
+
+    def _iter_blocks(self):
+        yield self._prefix
+        buffer = bytearray()
+        for data in self._iter_members():
+            buffer += data
+            if len(buffer) >= STREAM_BLOCK_SIZE:
+                yield bytes(buffer)
+                buffer.clear()
+        if len(buffer) > 0:
+            yield bytes(buffer)
+        yield self._suffix
+
+    def read(self, size: int = -1):
+        block = next(self._blocks, b'') if self._blocks is not None else b''
+        self.bytes_read += len(block)
+        if self._callback is not None and len(block) > 0:
+            self._callback(len(block))
+        return block
+
+
+class BundleUploader(FileUploader):
+    """Upload a bundle of small files as a single datafile, in a single request.
+
+    Bundles are never sent in chunks nor compressed.
+    """
+
+    def __init__(self, context: Context, root_path: Path, bundle: Bundle, **kwargs):
+        super().__init__(context, root_path, bundle.path, **dict(kwargs, chunk_threshold=None, codec=None))
+        self._bundle = bundle
+
+    @property
+    def log_prefix(self) -> str:
+        return f'[BundleUploader: {self._bundle.name} ({len(self._bundle)} files)]'
+
+    def _get_file_size(self) -> int:
+        return self._bundle.size
+
+    def _perform_single_request_upload(self, file_size: int):
+        fields = [('dataset', self._context.dataset_uuid)]
+        fields += [('tags', tag) for tag in self._tags]
+
+        with TarBundleBody(fields, self._bundle, callback=self._on_body_read) as body:
+            self._create_datafile(body, {'Content-Type': body.content_type}, self._bundle.name)
@@ -0,0 +1,233 @@
+import abc
+import atexit
+import bz2
+import os
+import struct
+import threading
+import zlib
+from pathlib import Path
+from typing import Optional
+
+from oort.common.constants import DATA_EXTENSIONS
+
+COMPRESSION_READ_SIZE = 1024 * 1024
+
+# Each message sent by a compression worker is prefixed with its kind, and the number of raw bytes read so far.
+_BLOCK_HEADER = struct.Struct('!BQ')
+_BLOCK = 0
+_LAST_BLOCK = 1
+_ERROR = 2
+
+
+class Codec(abc.ABC):
+    """A streaming compression format. Subclasses return a new compressor object, with the
+    compress(data) and flush() methods of zlib and bz2 compressors.
+
+    Codecs are sent to the compression workers, hence must be picklable (i.e. defined at module level).
+    """
+    name = None
+    extension = None
+
+    def __init__(self, level: Optional[int] = None):
+        self.level = level
+
+    @abc.abstractmethod
+    def compressor(self):
+        pass
+
+
+CODECS = {}
+
+
+def register_codec(codec_class):
+    CODECS[codec_class.name] = codec_class
+    return codec_class
+
+
+@register_codec
+class GzipCodec(Codec):
+    name = 'gzip'
+    extension = '.gz'
+
+    def compressor(self):
+        level = self.level if self.level is not None else 6
+        # wbits=31 produces a gzip stream (header and trailer included), not a raw zlib one.
+        return zlib.compressobj(level, zlib.DEFLATED, 31)
+
+
+@register_codec
+class Bzip2Codec(Codec):
+    name = 'bz2'
+    extension = '.bz2'
+
+    def compressor(self):
+        return bz2.BZ2Compressor(self.level if self.level is not None else 9)
+
+
+def get_codec(name: str, level: Optional[int] = None) -> Codec:
+    return CODECS[name](level)
+
+
+def is_compressible(file_path: Path) -> bool:
+    # Already compressed files (e.g. .fits.gz) end with a ZIP_EXTENSIONS suffix, not a data one.
+    return file_path.suffix.lower() in DATA_EXTENSIONS
+
+
+def _compress_file(file_path: Path, codec: Codec, connection):
+    # The pipe is bounded: sending blocks until the uploader has read enough.
+    compressor = codec.compressor()
+    raw_bytes_read = 0
+    with open(file_path, 'rb') as f:
+        while True:
+            data = f.read(COMPRESSION_READ_SIZE)
+            if not data:
+                break
+            raw_bytes_read += len(data)
+            block = compressor.compress(data)
+            if block:
+                connection.send_bytes(_BLOCK_HEADER.pack(_BLOCK, raw_bytes_read) + block)
+    connection.send_bytes(_BLOCK_HEADER.pack(_LAST_BLOCK, raw_bytes_read) + compressor.flush())
+
+
+def _run_compression_worker(connection):
+    # Runs in a worker process: compress the files received one after the other, until the pipe is closed.
+    while True:
+        try:
+            file_path, codec = connection.recv()
+        except EOFError:
+            break
+        try:
+            _compress_file(file_path, codec, connection)
+        except Exception as error:
+            connection.send_bytes(_BLOCK_HEADER.pack(_ERROR, 0) + str(error).encode('utf-8', errors='replace'))
+    connection.close()
+
+
+def _get_process_context():
+    # Imported here: multiprocessing is only needed once a file is actually compressed.
+    import multiprocessing
+
+    # Uploads run in threads: forking the uploader process itself could copy locks held by other threads.
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+class _CompressionWorker(object):
+    def __init__(self):
+        context = _get_process_context()
+        self.connection, child_connection = context.Pipe()
+        self._process = context.Process(target=_run_compression_worker, args=(child_connection,), daemon=True)
+        self._process.start()
+        child_connection.close()
+
+    def stop(self):
+        self.connection.close()
+        if self._process.is_alive():
+            self._process.terminate()
+        self._process.join()
+
+
+class CompressionWorkerPool(object):
+    """The worker processes compressing files for the uploads: started on demand, reused, and `size` at most.
+
+    Uploads needing a worker while all of them are busy wait for one to be released.
+    """
+
+    def __init__(self, size: Optional[int] = None):
+        self.size = size or os.cpu_count() or 1
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._idle_workers = []
+        self._lock = threading.Lock()
+
+    def acquire(self) -> _CompressionWorker:
+        self._slots.acquire()
+        with self._lock:
+            if len(self._idle_workers) > 0:
+                return self._idle_workers.pop()
+        try:
+            return _CompressionWorker()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, worker: _CompressionWorker, reusable: bool):
+        if reusable:
+            with self._lock:
+                self._idle_workers.append(worker)
+        else:
+            worker.stop()
+        self._slots.release()
+
+    def close(self):
+        with self._lock:
+            idle_workers, self._idle_workers = self._idle_workers, []
+        for worker in idle_workers:
+            worker.stop()
+
+
+_worker_pool = None
+_worker_pool_lock = threading.Lock()
+
+
+def get_compression_worker_pool() -> CompressionWorkerPool:
+    global _worker_pool
+    with _worker_pool_lock:
+        if _worker_pool is None:
+            _worker_pool = CompressionWorkerPool()
+            atexit.register(_worker_pool.close)
+        return _worker_pool
+
+
+class CompressedFileStream(object):
+    """Iterate over the compressed blocks of a file, compressed on the fly by a pooled worker process.
+
+    Nothing is written to disk, and only a few blocks are held in memory at a time.
+    """
+
+    def __init__(self, file_path: Path, codec: Codec, worker_pool: Optional[CompressionWorkerPool] = None):
+        self._file_path = file_path
+        self._codec = codec
+        self._worker_pool = worker_pool
+        self._worker = None
+        self._finished = False
+        self.raw_bytes_read = 0
+        self.compressed_bytes = 0
+
+    def open(self):
+        self._worker_pool = self._worker_pool or get_compression_worker_pool()
+        self._worker = self._worker_pool.acquire()
+        self._finished = False
+        try:
+            self._worker.connection.send((self._file_path, self._codec))
+        except BaseException:
+            self.close()
+            raise
+        return self
+
+    def close(self):
+        if self._worker is not None:
+            # A worker left in the middle of a file still has blocks to send: it is stopped, not reused.
+            self._worker_pool.release(self._worker, reusable=self._finished)
+            self._worker = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __iter__(self):
+        while not self._finished:
+            try:
+                message = self._worker.connection.recv_bytes()
+            except EOFError:
+                raise OSError(f'Compression of {str(self._file_path)} failed: its worker process exited.') from None
+            kind, raw_bytes_read = _BLOCK_HEADER.unpack_from(message)
+            block = memoryview(message)[_BLOCK_HEADER.size:]
+            self._finished = kind != _BLOCK
+            if kind == _ERROR:
+                raise OSError(f'Compression of {str(self._file_path)} failed: {bytes(block).decode("utf-8")}')
+            self.raw_bytes_read = raw_bytes_read
+            self.compressed_bytes += len(block)
+            if len(block) > 0:
+                yield block
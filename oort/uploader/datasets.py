@@ -0,0 +1,56 @@
+import threading
+
+from oort.common.api import OortAPI
+from oort.common.context import Context
+from .errors import UploadRemoteDatasetCheckError
+
+
+class DatasetCache(object):
+    """Thread-safe cache of the datasets resolved for upload, keyed by UUID and by name.
+
+    Datasets are resolved once per walk (and not once per file), with at most one API call. A
+    dataset known only by its name is created once, and its UUID is then reused by every uploader.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._datasets = {}
+
+    def get(self, uuid_or_name: str):
+        with self._lock:
+            return self._datasets.get(uuid_or_name)
+
+    def add(self, dataset: dict):
+        with self._lock:
+            self._store(dataset)
+
+    def _store(self, dataset: dict):
+        for key in (dataset.get('uuid'), dataset.get('name')):
+            if key:
+                self._datasets[key] = dataset
+
+    def resolve(self, context: Context, api: OortAPI) -> dict:
+        with self._lock:
+            key = context.dataset_uuid or context.dataset_name
+            dataset = self._datasets.get(key) if key else None
+
+            if dataset is None and context.dataset_uuid:
+                dataset, error = api.datasets.read(context.dataset_uuid)
+                if error:
+                    # E.g. the dataset was deleted since it was validated: the next run must look it up again.
+                    context.invalidate_cached_lookups()
+                    raise UploadRemoteDatasetCheckError(str(error), getattr(error, 'status_code', None))
+
+            elif dataset is None and context.dataset_name:
+                # Dataset UUID is empty, and CLI validators have already checked this dataset doesn't exist.
+                # Simply create dataset. The lock ensures it is created only once.
+                dataset, error = api.datasets.create({'name': context.dataset_name})
+                if error:
+                    raise UploadRemoteDatasetCheckError(str(error), getattr(error, 'status_code', None))
+
+            elif dataset is None:
+                raise UploadRemoteDatasetCheckError('No dataset specified.')
+
+            self._store(dataset)
+            context.update_dataset(dataset)
+            return dataset
@@ -2,8 +2,12 @@ from oort.common.errors import OortCloudError
 
 
 class UploadRemoteFileCheckError(OortCloudError):
-    pass
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
 
 
 class UploadRemoteDatasetCheckError(OortCloudError):
-    pass
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
@@ -0,0 +1,73 @@
+import fnmatch
+import re
+from typing import Optional
+
+from oort.common.constants import get_all_fits_extensions, get_all_xisf_extensions
+
+# Lowercase, and longest first, although str.endswith does not care about the order.
+DATA_FILE_SUFFIXES = tuple(sorted(set(get_all_fits_extensions() + get_all_xisf_extensions()), key=len, reverse=True))
+
+
+def _compile_patterns(patterns: list) -> Optional[re.Pattern]:
+    if len(patterns) == 0:
+        return None
+    return re.compile('|'.join(f'(?:{fnmatch.translate(pattern)})' for pattern in patterns))
+
+
+class _PatternSet(object):
+    """Glob patterns compiled into one regex for names, and one for paths relative to the root folder.
+
+    As in .gitignore files, a pattern without a slash (but a trailing one) matches a name at any depth,
+    and a pattern with a slash matches a path relative to the root folder.
+    """
+
+    def __init__(self, patterns: list):
+        patterns = [p.rstrip('/') for p in patterns]
+        self._name_regex = _compile_patterns([p for p in patterns if '/' not in p])
+        self._path_regex = _compile_patterns([p.lstrip('/') for p in patterns if '/' in p])
+
+    def __bool__(self):
+        return self._name_regex is not None or self._path_regex is not None
+
+    def matches(self, relative_path: str, name: str) -> bool:
+        return ((self._name_regex is not None and self._name_regex.match(name) is not None) or
+                (self._path_regex is not None and self._path_regex.match(relative_path) is not None))
+
+
+class PathFilter(object):
+    """Select the files to upload, from include and exclude globs compiled once.
+
+    Excludes apply to folders and files. Patterns ending with a slash only apply to folders. Excluded
+    folders are pruned by the scanner: their content is never walked. Includes only apply to files:
+    when any, a file must match one of them. With only_data, files must also have a FITS or XISF
+    extension, compressed or not (case insensitive).
+    """
+
+    def __init__(self, includes: Optional[list] = None, excludes: Optional[list] = None, only_data: bool = False):
+        includes = list(includes or [])
+        excludes = list(excludes or [])
+        self._includes = _PatternSet(includes)
+        self._excludes = _PatternSet(excludes)
+        self._file_excludes = _PatternSet([p for p in excludes if not p.endswith('/')])
+        self._only_data = only_data
+
+    def __bool__(self):
+        return bool(self._includes or self._excludes or self._only_data)
+
+    def accepts_dir(self, relative_path: str, name: str) -> bool:
+        return not self._excludes.matches(relative_path, name)
+
+    def accepts_file(self, relative_path: str, name: str) -> bool:
+        if self._only_data and not name.lower().endswith(DATA_FILE_SUFFIXES):
+            return False
+        if self._file_excludes.matches(relative_path, name):
+            return False
+        return not self._includes or self._includes.matches(relative_path, name)
+
+    def accepts_path(self, relative_path: str, is_dir: bool = False) -> bool:
+        """Whether a file or folder is accepted, its parent folders included. For paths not found by a scan."""
+        parts = relative_path.split('/')
+        for index in range(len(parts) if is_dir else len(parts) - 1):
+            if not self.accepts_dir('/'.join(parts[:index + 1]), parts[index]):
+                return False
+        return is_dir or self.accepts_file(relative_path, parts[-1])
@@ -0,0 +1,129 @@
+import hashlib
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+from oort.common.constants import DIGEST_ALGORITHMS
+from oort.common.logger import get_oort_logger
+
+logger = get_oort_logger('hasher')
+
+# Chunks are read into a single buffer, hence memory stays flat, whatever the size of the file.
+DIGEST_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def compute_file_digest(file_path: Path, algorithm: str = 'sha256', chunk_size: int = DIGEST_CHUNK_SIZE) -> str:
+    digest = hashlib.new(algorithm)
+    buffer = bytearray(chunk_size)
+    with open(file_path, 'rb', buffering=0) as f, memoryview(buffer) as view:
+        while True:
+            count = f.readinto(view)
+            if not count:
+                break
+            # Slicing a memoryview does not copy, and hashlib releases the GIL on large buffers.
+            with view[:count] as chunk:
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _compute_file_digest_or_none(file_path: Path, algorithm: str, chunk_size: int) -> Optional[str]:
+    try:
+        return compute_file_digest(file_path, algorithm, chunk_size)
+    except (OSError, ValueError) as error:
+        logger.warning(f'[Hasher] Unable to compute digest of {str(file_path)}: {str(error)}')
+        return None
+
+
+def hash_files(scanned_files: list,
+               algorithm: str = 'sha256',
+               jobs: Optional[int] = None,
+               chunk_size: int = DIGEST_CHUNK_SIZE) -> list:
+    """Compute the digest of every scanned file in a pool of processes, and set it on the file record.
+
+    Files that cannot be read are left with a None digest.
+    """
+    if algorithm not in DIGEST_ALGORITHMS:
+        raise ValueError(f'Unsupported digest algorithm: {algorithm}')
+    if len(scanned_files) == 0:
+        return scanned_files
+
+    jobs = jobs or os.cpu_count() or 1
+    file_paths = [scanned_file.path for scanned_file in scanned_files]
+    # Batching tasks amortizes the inter-process overhead on trees with many small files.
+    batch_size = max(1, len(file_paths) // (jobs * 4))
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        digests = executor.map(_compute_file_digest_or_none,
+                               file_paths,
+                               [algorithm] * len(file_paths),
+                               [chunk_size] * len(file_paths),
+                               chunksize=batch_size)
+        for scanned_file, digest in zip(scanned_files, digests):
+            scanned_file.digest = digest
+
+    return scanned_files
+
+
+def _compute_file_digests(file_paths: list, algorithm: str, chunk_size: int) -> list:
+    return [_compute_file_digest_or_none(file_path, algorithm, chunk_size) for file_path in file_paths]
+
+
+class BackgroundHasher(object):
+    """Hash files in a pool of processes, ahead of their uploads.
+
+    Files are submitted in batches, in upload order. An upload only waits for the digest of its own
+    files, before recording them in the ledger, so that hashing overlaps the uploads. Use it as a
+    context manager: the pool is shut down on exit, cancelling the hashing of files not uploaded.
+    """
+
+    def __init__(self,
+                 algorithm: str = 'sha256',
+                 jobs: Optional[int] = None,
+                 chunk_size: int = DIGEST_CHUNK_SIZE,
+                 batch_size: int = 16):
+        if algorithm not in DIGEST_ALGORITHMS:
+            raise ValueError(f'Unsupported digest algorithm: {algorithm}')
+        self._algorithm = algorithm
+        self._chunk_size = chunk_size
+        self._batch_size = batch_size
+        self._executor = ProcessPoolExecutor(max_workers=jobs or os.cpu_count() or 1)
+        self._lock = threading.Lock()
+        # File path -> (future of its batch, index in the batch).
+        self._pending = {}
+
+    def submit(self, scanned_files: list):
+        """Start hashing the files (or the files of the bundles) whose digest is unknown."""
+        files = [f for item in scanned_files for f in getattr(item, 'files', [item]) if f.digest is None]
+        for start in range(0, len(files), self._batch_size):
+            batch = files[start:start + self._batch_size]
+            future = self._executor.submit(_compute_file_digests,
+                                           [f.path for f in batch],
+                                           self._algorithm,
+                                           self._chunk_size)
+            with self._lock:
+                for index, scanned_file in enumerate(batch):
+                    self._pending[scanned_file.path] = (future, index)
+
+    def wait(self, scanned_file):
+        """Set the digests of the file (or of the files of a bundle), once computed."""
+        for f in getattr(scanned_file, 'files', [scanned_file]):
+            with self._lock:
+                future, index = self._pending.pop(f.path, (None, 0))
+            if future is None:
+                continue
+            try:
+                f.digest = future.result()[index]
+            except Exception as error:
+                # A broken pool only costs the digests, not the uploads.
+                logger.warning(f'[Hasher] Unable to compute digest of {str(f.path)}: {str(error)}')
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
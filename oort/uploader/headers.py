@@ -0,0 +1,269 @@
+import bz2
+import gzip
+import json
+import sqlite3
+import struct
+import threading
+import xml.etree.ElementTree as ElementTree
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+from oort.common.logger import get_oort_logger
+from oort.common.utils import get_oort_config_file_path
+from .filters import DATA_FILE_SUFFIXES
+
+logger = get_oort_logger('headers')
+
+# The keys extracted from headers. XISF properties are reported under their FITS keyword.
+HEADER_KEYS = ['DATE-OBS', 'OBJECT', 'TELESCOP', 'INSTRUME', 'FILTER', 'EXPTIME', 'IMAGETYP', 'OBSERVER']
+
+XISF_PROPERTIES = {
+    'Observation:Time:Start': 'DATE-OBS',
+    'Observation:Object:Name': 'OBJECT',
+    'Instrument:Telescope:Name': 'TELESCOP',
+    'Instrument:Camera:Name': 'INSTRUME',
+    'Instrument:Filter:Name': 'FILTER',
+    'Instrument:ExposureTime': 'EXPTIME',
+    'Observer:Name': 'OBSERVER',
+}
+
+FITS_BLOCK_SIZE = 2880
+FITS_CARD_SIZE = 80
+# A header spanning more blocks than this is not worth reading (or the file is not a FITS file).
+FITS_MAX_HEADER_BLOCKS = 100
+
+XISF_SIGNATURE = b'XISF0100'
+XISF_MAX_HEADER_SIZE = 16 * 1024 * 1024
+
+# Headers are small reads, whose latency dominates (on network mounts especially): threads are enough.
+DEFAULT_HEADER_JOBS = 16
+
+
+def _open_data_file(file_path: Path):
+    name = file_path.name.lower()
+    if name.endswith('.gz'):
+        # Only the leading blocks are decompressed.
+        return gzip.open(file_path, 'rb')
+    if name.endswith('.bz2'):
+        return bz2.open(file_path, 'rb')
+    return open(file_path, 'rb')
+
+
+def _parse_fits_value(value: str) -> str:
+    value = value.strip()
+    if value.startswith("'"):
+        # Quotes are escaped by doubling them, and trailing spaces of strings are not significant.
+        end = 1
+        while True:
+            end = value.find("'", end)
+            if end == -1 or value[end + 1:end + 2] != "'":
+                break
+            end += 2
+        return value[1:end if end != -1 else None].replace("''", "'").rstrip()
+    return value.split('/', 1)[0].strip()
+
+
+def _read_fits_hdu_header(f) -> Optional[dict]:
+    """Read the cards of one header, block by block, up to its END card. Return None at end of file."""
+    cards = {}
+    for index in range(FITS_MAX_HEADER_BLOCKS):
+        block = f.read(FITS_BLOCK_SIZE)
+        if len(block) == 0 and index == 0:
+            return None
+        if len(block) < FITS_BLOCK_SIZE:
+            raise ValueError('Truncated FITS header.')
+        for offset in range(0, FITS_BLOCK_SIZE, FITS_CARD_SIZE):
+            card = block[offset:offset + FITS_CARD_SIZE].decode('ascii', errors='replace')
+            keyword = card[:8].strip()
+            if index == 0 and offset == 0 and keyword not in ('SIMPLE', 'XTENSION'):
+                raise ValueError('Not a FITS file.')
+            if keyword == 'END':
+                return cards
+            if card[8:10] == '= ' and keyword not in cards:
+                cards[keyword] = _parse_fits_value(card[10:])
+    raise ValueError('FITS header too long.')
+
+
+def _get_fits_data_size(cards: dict) -> int:
+    naxis = int(cards.get('NAXIS', 0))
+    if naxis == 0:
+        return 0
+    size = 1
+    # Random groups (NAXIS1 = 0) have no image data, only groups.
+    for axis in range(2 if cards.get('NAXIS1') == '0' else 1, naxis + 1):
+        size *= int(cards.get(f'NAXIS{axis}', 0))
+    size = abs(int(cards.get('BITPIX', 8))) // 8 * int(cards.get('GCOUNT', 1)) * (int(cards.get('PCOUNT', 0)) + size)
+    return (size + FITS_BLOCK_SIZE - 1) // FITS_BLOCK_SIZE * FITS_BLOCK_SIZE
+
+
+def read_fits_header(file_path: Path) -> dict:
+    """Return the HEADER_KEYS found in the primary header of a FITS file, without reading pixel data.
+
+    When the primary HDU has no data (as for tile-compressed images), keys missing from it are
+    looked for in the header of the first extension too.
+    """
+    with _open_data_file(file_path) as f:
+        cards = _read_fits_hdu_header(f)
+        if cards is None:
+            raise ValueError('Empty FITS file.')
+        metadata = {key: cards[key] for key in HEADER_KEYS if cards.get(key)}
+        if len(metadata) < len(HEADER_KEYS) and _get_fits_data_size(cards) == 0:
+            try:
+                extension_cards = _read_fits_hdu_header(f) or {}
+            except ValueError:
+                # The primary header is enough: an unreadable extension does not make the file unreadable.
+                extension_cards = {}
+            for key in HEADER_KEYS:
+                if key not in metadata and extension_cards.get(key):
+                    metadata[key] = extension_cards[key]
+    return metadata
+
+
+def read_xisf_header(file_path: Path) -> dict:
+    """Return the HEADER_KEYS found in the XML header of an XISF file, without reading pixel data.
+
+    FITS keywords embedded in the header take precedence over the equivalent XISF properties.
+    """
+    with _open_data_file(file_path) as f:
+        prefix = f.read(16)
+        if len(prefix) < 16 or prefix[:8] != XISF_SIGNATURE:
+            raise ValueError('Not a XISF file.')
+        header_size = struct.unpack('<I', prefix[8:12])[0]
+        if header_size > XISF_MAX_HEADER_SIZE:
+            raise ValueError('XISF header too long.')
+        root = ElementTree.fromstring(f.read(header_size))
+
+    keywords, properties = {}, {}
+    for element in root.iter():
+        tag = element.tag.rsplit('}', 1)[-1]
+        if tag == 'FITSKeyword' and element.get('name') in HEADER_KEYS:
+            value = _parse_fits_value(element.get('value') or '')
+            if value:
+                keywords.setdefault(element.get('name'), value)
+        elif tag == 'Property' and element.get('id') in XISF_PROPERTIES:
+            # String properties may hold their value as text rather than as an attribute.
+            value = (element.get('value') or element.text or '').strip()
+            if value:
+                properties.setdefault(XISF_PROPERTIES[element.get('id')], value)
+    return dict(properties, **keywords)
+
+
+def is_data_file(file_path: Path) -> bool:
+    return file_path.name.lower().endswith(DATA_FILE_SUFFIXES)
+
+
+def has_readable_header(file_path: Path) -> bool:
+    # Zip archives may hold anything, and cannot be read as a stream.
+    return is_data_file(file_path) and not file_path.name.lower().endswith('.zip')
+
+
+def read_file_metadata(file_path: Path) -> dict:
+    """Return the HEADER_KEYS found in a FITS or XISF file. Other files have no metadata."""
+    name = file_path.name.lower()
+    if not has_readable_header(file_path):
+        return {}
+    if name.endswith('.xisf') or '.xisf.' in name:
+        return read_xisf_header(file_path)
+    return read_fits_header(file_path)
+
+
+def _read_file_metadata_or_empty(file_path: Path) -> dict:
+    try:
+        return read_file_metadata(file_path)
+    except (OSError, EOFError, ValueError, ElementTree.ParseError, zlib.error, struct.error) as error:
+        # Corrupted or truncated files (gzip, bz2 or XISF) must not abort the walk.
+        logger.warning(f'[Headers] Unable to read header of {str(file_path)}: {str(error)}')
+        return {}
+
+
+class HeaderCache(object):
+    """Local, persistent cache of the metadata read from file headers, keyed by path, size and mtime.
+
+    Reruns over the same folder then only read the headers of new or modified files.
+    """
+
+    # SQLite limits the number of variables of a statement (to 999 in older versions).
+    LOOKUP_BATCH_SIZE = 500
+
+    def __init__(self, db_path: Optional[Path] = None):
+        self._db_path = db_path or get_oort_config_file_path('headers', 'sqlite')
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(str(self._db_path), check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('''CREATE TABLE IF NOT EXISTS headers (
+                path TEXT NOT NULL PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                metadata TEXT NOT NULL
+            )''')
+
+    @property
+    def db_path(self) -> Path:
+        return self._db_path
+
+    def read_many(self, scanned_files: list) -> dict:
+        """Return the cached metadata of the given files, by path, for those unchanged since cached."""
+        cached = {}
+        with self._lock:
+            for start in range(0, len(scanned_files), self.LOOKUP_BATCH_SIZE):
+                batch = {str(f.path): f for f in scanned_files[start:start + self.LOOKUP_BATCH_SIZE]}
+                placeholders = ', '.join('?' * len(batch))
+                cursor = self._connection.execute(
+                    f'SELECT path, size, mtime, metadata FROM headers WHERE path IN ({placeholders})',
+                    list(batch.keys())
+                )
+                for path, size, mtime, metadata in cursor:
+                    if batch[path].size == size and batch[path].mtime == mtime:
+                        cached[path] = json.loads(metadata)
+        return cached
+
+    def write_many(self, scanned_files: list):
+        values = [(str(f.path), f.size, f.mtime, json.dumps(f.metadata)) for f in scanned_files]
+        with self._lock, self._connection:
+            self._connection.executemany('INSERT OR REPLACE INTO headers VALUES (?, ?, ?, ?)', values)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def read_headers(scanned_files: list, cache: Optional[HeaderCache] = None, jobs: int = DEFAULT_HEADER_JOBS) -> list:
+    """Read the metadata of every scanned file in a pool of threads, and set it on the file record.
+
+    Files whose header cannot be read get empty metadata, and so do files that are not FITS or XISF.
+    """
+    cached = cache.read_many(scanned_files) if cache is not None else {}
+    unread_files = []
+    for scanned_file in scanned_files:
+        metadata = cached.get(str(scanned_file.path))
+        if metadata is not None:
+            scanned_file.metadata = metadata
+        elif is_data_file(scanned_file.path):
+            unread_files.append(scanned_file)
+        else:
+            scanned_file.metadata = {}
+
+    if len(unread_files) > 0:
+        with ThreadPoolExecutor(max_workers=min(jobs, len(unread_files))) as executor:
+            results = executor.map(_read_file_metadata_or_empty, [f.path for f in unread_files])
+            for scanned_file, metadata in zip(unread_files, results):
+                scanned_file.metadata = metadata
+        if cache is not None:
+            cache.write_many(unread_files)
+
+    return scanned_files
+
+
+def split_undated_files(scanned_files: list):
+    """Split files whose headers have been read into (dated, undated) lists, depending on their DATE-OBS.
+
+    Only FITS and XISF files with a readable header can be undated. Other files are kept with the dated ones.
+    """
+    dated, undated = [], []
+    for scanned_file in scanned_files:
+        is_undated = has_readable_header(scanned_file.path) and not (scanned_file.metadata or {}).get('DATE-OBS')
+        (undated if is_undated else dated).append(scanned_file)
+    return dated, undated
@@ -0,0 +1,273 @@
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from oort.common.utils import get_oort_config_file_path
+from .hasher import hash_files
+from .scanner import ScannedFile
+
+
+class UploadLedger(object):
+    """Local, persistent record of the files already uploaded.
+
+    A file is considered already synced if it has been uploaded from the same root folder, into
+    the same dataset, with the same size and modification time (and the same digest, when both
+    are known). Walks over a folder can then skip these files, and only pay for the new data.
+
+    A file whose modification time alone has changed (e.g. copied, or restored from a backup) is
+    also synced if its digest is the recorded one. See find_touched_files.
+    """
+
+    # SQLite limits the number of variables of a statement (to 999 in older versions).
+    LOOKUP_BATCH_SIZE = 500
+
+    def __init__(self, db_path: Optional[Path] = None):
+        self._db_path = db_path or get_oort_config_file_path('ledger', 'sqlite')
+        self._lock = threading.Lock()
+        # Uploaders record their files from worker threads. Access is serialised with the lock.
+        self._connection = sqlite3.connect(str(self._db_path), check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('''CREATE TABLE IF NOT EXISTS uploads (
+                root TEXT NOT NULL,
+                relative_path TEXT NOT NULL,
+                dataset TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                digest TEXT,
+                datafile TEXT,
+                uploaded_at TEXT NOT NULL,
+                PRIMARY KEY (root, dataset, relative_path)
+            )''')
+            self._connection.execute('''CREATE TABLE IF NOT EXISTS chunked_uploads (
+                root TEXT NOT NULL,
+                relative_path TEXT NOT NULL,
+                dataset TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                upload TEXT NOT NULL,
+                PRIMARY KEY (root, dataset, relative_path)
+            )''')
+            # Files uploaded inside a bundle are recorded in uploads too, with the datafile of the bundle.
+            self._connection.execute('''CREATE TABLE IF NOT EXISTS bundled_files (
+                root TEXT NOT NULL,
+                relative_path TEXT NOT NULL,
+                dataset TEXT NOT NULL,
+                bundle TEXT NOT NULL,
+                PRIMARY KEY (root, dataset, relative_path)
+            )''')
+            # Datafiles uploaded, but whose tags could not be updated. The next walk updates them.
+            self._connection.execute('''CREATE TABLE IF NOT EXISTS untagged_datafiles (
+                root TEXT NOT NULL,
+                dataset TEXT NOT NULL,
+                datafile TEXT NOT NULL,
+                tags TEXT NOT NULL,
+                PRIMARY KEY (root, dataset, datafile)
+            )''')
+
+    @property
+    def db_path(self) -> Path:
+        return self._db_path
+
+    def read_synced_files(self, root_path: Path, dataset_uuid: str, relative_paths: Optional[list] = None) -> dict:
+        """Return (size, mtime, digest) of the synced files, by relative path.
+
+        With relative_paths, only these files are looked up: the cost then depends on their number,
+        and not on the number of files uploaded from the root folder.
+        """
+        query = 'SELECT relative_path, size, mtime, digest FROM uploads WHERE root = ? AND dataset = ?'
+        with self._lock:
+            if relative_paths is None:
+                cursor = self._connection.execute(query, (str(root_path), dataset_uuid))
+                return {row[0]: row[1:] for row in cursor}
+
+            synced_files = {}
+            for start in range(0, len(relative_paths), self.LOOKUP_BATCH_SIZE):
+                batch = relative_paths[start:start + self.LOOKUP_BATCH_SIZE]
+                placeholders = ', '.join('?' * len(batch))
+                cursor = self._connection.execute(f'{query} AND relative_path IN ({placeholders})',
+                                                  [str(root_path), dataset_uuid] + batch)
+                synced_files.update({row[0]: row[1:] for row in cursor})
+            return synced_files
+
+    @staticmethod
+    def _is_unchanged(scanned_file: ScannedFile, synced_file: tuple) -> bool:
+        size, mtime, digest = synced_file
+        if scanned_file.size != size:
+            return False
+        if scanned_file.mtime != mtime:
+            # Only the content can tell.
+            return scanned_file.digest is not None and scanned_file.digest == digest
+        return scanned_file.digest is None or digest is None or scanned_file.digest == digest
+
+    def find_touched_files(self, root_path: Path, dataset_uuid: str, scanned_files: list, synced_files: dict) -> list:
+        """Return the files recorded with a digest and their current size, but another modification time.
+
+        Hashing them (and them only) tells whether their content has changed.
+        """
+        touched_files = []
+        for scanned_file in scanned_files:
+            synced_file = synced_files.get(str(scanned_file.path.relative_to(root_path)))
+            if synced_file is not None and synced_file[2] is not None and \
+                    scanned_file.size == synced_file[0] and scanned_file.mtime != synced_file[1]:
+                touched_files.append(scanned_file)
+        return touched_files
+
+    def update_mtimes(self, root_path: Path, dataset_uuid: str, scanned_files: list):
+        """Record the new modification time of files found unchanged by their digest, not to hash them again."""
+        values = [(f.mtime, str(root_path), dataset_uuid, str(f.path.relative_to(root_path))) for f in scanned_files]
+        with self._lock, self._connection:
+            self._connection.executemany('UPDATE uploads SET mtime = ? '
+                                         'WHERE root = ? AND dataset = ? AND relative_path = ?', values)
+
+    def split_synced_files(self,
+                           root_path: Path,
+                           dataset_uuid: str,
+                           scanned_files: list,
+                           synced_files: Optional[dict] = None,
+                           digest_algorithm: Optional[str] = None):
+        """Split scanned files into (pending, synced) lists, with a single lookup of the ledger.
+
+        When splitting a stream of files batch by batch, read the synced files once with
+        read_synced_files, and pass them along. With a digest_algorithm, the touched files are
+        hashed first (see find_touched_files), and those found unchanged get their new mtime recorded.
+        """
+        if not dataset_uuid:
+            # A dataset still to be created cannot contain anything yet.
+            return list(scanned_files), []
+
+        if synced_files is None:
+            synced_files = self.read_synced_files(root_path, dataset_uuid)
+        touched_files = []
+        if digest_algorithm is not None:
+            touched_files = self.find_touched_files(root_path, dataset_uuid, scanned_files, synced_files)
+            hash_files(touched_files, algorithm=digest_algorithm)
+
+        pending, synced = [], []
+        for scanned_file in scanned_files:
+            relative_path = str(scanned_file.path.relative_to(root_path))
+            synced_file = synced_files.get(relative_path)
+            if synced_file is not None and self._is_unchanged(scanned_file, synced_file):
+                synced.append(scanned_file)
+            else:
+                pending.append(scanned_file)
+
+        if len(touched_files) > 0:
+            synced_ids = set(id(scanned_file) for scanned_file in synced)
+            self.update_mtimes(root_path, dataset_uuid, [f for f in touched_files if id(f) in synced_ids])
+        return pending, synced
+
+    def record(self, root_path: Path, dataset_uuid: str, scanned_file: ScannedFile, datafile_pk=None):
+        values = (str(root_path),
+                  str(scanned_file.path.relative_to(root_path)),
+                  dataset_uuid,
+                  scanned_file.size,
+                  scanned_file.mtime,
+                  scanned_file.digest,
+                  str(datafile_pk) if datafile_pk is not None else None,
+                  datetime.now().isoformat())
+        with self._lock, self._connection:
+            self._connection.execute('INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?, ?, ?, ?, ?)', values)
+            # A file uploaded on its own is no longer found in a bundle.
+            self._connection.execute('DELETE FROM bundled_files WHERE root = ? AND relative_path = ? AND dataset = ?',
+                                     values[:3])
+
+    def record_bundle(self,
+                      root_path: Path,
+                      dataset_uuid: str,
+                      bundle_name: str,
+                      scanned_files: list,
+                      datafile_pk=None):
+        """Record all the files of an uploaded bundle at once, along with the name of the bundle."""
+        uploaded_at = datetime.now().isoformat()
+        uploads, bundled_files = [], []
+        for scanned_file in scanned_files:
+            relative_path = str(scanned_file.path.relative_to(root_path))
+            uploads.append((str(root_path),
+                            relative_path,
+                            dataset_uuid,
+                            scanned_file.size,
+                            scanned_file.mtime,
+                            scanned_file.digest,
+                            str(datafile_pk) if datafile_pk is not None else None,
+                            uploaded_at))
+            bundled_files.append((str(root_path), relative_path, dataset_uuid, bundle_name))
+        with self._lock, self._connection:
+            self._connection.executemany('INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?, ?, ?, ?, ?)', uploads)
+            self._connection.executemany('INSERT OR REPLACE INTO bundled_files VALUES (?, ?, ?, ?)', bundled_files)
+
+    def read_bundle_name(self, root_path: Path, dataset_uuid: str, file_path: Path) -> Optional[str]:
+        """Return the name of the bundle a file has been uploaded in, if any."""
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT bundle FROM bundled_files WHERE root = ? AND dataset = ? AND relative_path = ?',
+                (str(root_path), dataset_uuid, str(file_path.relative_to(root_path)))
+            ).fetchone()
+        return row[0] if row else None
+
+    def read_datafile_paths(self, root_path: Path, dataset_uuid: str, datafile_pks: list) -> list:
+        """Return the paths of the files uploaded as the given datafiles (many, for a bundle)."""
+        paths = []
+        with self._lock:
+            for start in range(0, len(datafile_pks), self.LOOKUP_BATCH_SIZE):
+                batch = [str(pk) for pk in datafile_pks[start:start + self.LOOKUP_BATCH_SIZE]]
+                placeholders = ', '.join('?' * len(batch))
+                cursor = self._connection.execute(
+                    'SELECT relative_path FROM uploads '
+                    f'WHERE root = ? AND dataset = ? AND datafile IN ({placeholders})',
+                    [str(root_path), dataset_uuid] + batch
+                )
+                paths.extend(str(root_path / row[0]) for row in cursor)
+        return sorted(paths)
+
+    def read_untagged_datafiles(self, root_path: Path, dataset_uuid: str) -> dict:
+        """Return the tags of the datafiles left untagged by previous walks, by datafile pk."""
+        with self._lock:
+            cursor = self._connection.execute(
+                'SELECT datafile, tags FROM untagged_datafiles WHERE root = ? AND dataset = ?',
+                (str(root_path), dataset_uuid)
+            )
+            return {row[0]: json.loads(row[1]) for row in cursor}
+
+    def replace_untagged_datafiles(self, root_path: Path, dataset_uuid: str, datafile_tags: dict):
+        """Record the datafiles still untagged (and their tags), in place of those recorded so far."""
+        values = [(str(root_path), dataset_uuid, str(pk), json.dumps(tags)) for pk, tags in datafile_tags.items()]
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM untagged_datafiles WHERE root = ? AND dataset = ?',
+                                     (str(root_path), dataset_uuid))
+            self._connection.executemany('INSERT OR REPLACE INTO untagged_datafiles VALUES (?, ?, ?, ?)', values)
+
+    def read_chunked_upload(self, root_path: Path, dataset_uuid: str, file_path: Path, size: int, mtime: float):
+        """Return the UUID of an interrupted chunked upload of this very file, if any."""
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT upload FROM chunked_uploads '
+                'WHERE root = ? AND dataset = ? AND relative_path = ? AND size = ? AND mtime = ?',
+                (str(root_path), dataset_uuid, str(file_path.relative_to(root_path)), size, mtime)
+            ).fetchone()
+        return row[0] if row else None
+
+    def save_chunked_upload(self,
+                            root_path: Path,
+                            dataset_uuid: str,
+                            file_path: Path,
+                            size: int,
+                            mtime: float,
+                            upload_uuid: str):
+        values = (str(root_path), str(file_path.relative_to(root_path)), dataset_uuid, size, mtime, upload_uuid)
+        with self._lock, self._connection:
+            self._connection.execute('INSERT OR REPLACE INTO chunked_uploads VALUES (?, ?, ?, ?, ?, ?)', values)
+
+    def delete_chunked_upload(self, root_path: Path, dataset_uuid: str, file_path: Path):
+        with self._lock, self._connection:
+            self._connection.execute(
+                'DELETE FROM chunked_uploads WHERE root = ? AND dataset = ? AND relative_path = ?',
+                (str(root_path), dataset_uuid, str(file_path.relative_to(root_path)))
+            )
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,163 @@
+import contextlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+# Checking is the resolution of the dataset, once per walk. Uploading is timed for each file, and tagging
+# for each batch of tag updates (or for each file whose tags are updated right away).
+PHASES = ['checking', 'uploading', 'tagging']
+
+# In seconds. From quick dataset checks to transfers of large files over slow uplinks.
+DEFAULT_BUCKETS = [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600]
+
+PROMETHEUS_FILE_NAME = 'oort_upload.prom'
+JSON_FILE_NAME = 'oort_upload.json'
+
+
+class Histogram(object):
+    def __init__(self, buckets: Optional[list] = None):
+        self.buckets = buckets or DEFAULT_BUCKETS
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def get_cumulative_counts(self) -> list:
+        cumulative, total = [], 0
+        for count in self.counts:
+            total += count
+            cumulative.append(total)
+        return cumulative
+
+    def to_dict(self) -> dict:
+        return {'count': self.count,
+                'sum': self.sum,
+                'mean': self.sum / self.count if self.count > 0 else None,
+                'buckets': {str(bound): count for bound, count in zip(self.buckets, self.get_cumulative_counts())}}
+
+
+def time_phase(metrics: Optional['UploadMetrics'], phase: str):
+    """Time a phase into metrics, if any."""
+    return metrics.time_phase(phase) if metrics is not None else contextlib.nullcontext()
+
+
+def _write_atomically(path: Path, content: str):
+    # Collectors (e.g. the textfile collector of node_exporter) must never read a partially written file.
+    temporary_path = path.with_name(f'.{path.name}.{os.getpid()}')
+    temporary_path.write_text(content)
+    os.replace(temporary_path, path)
+
+
+class UploadMetrics(object):
+    """Per-phase latencies, bytes, retries and errors of the uploads of a walk. Shared by all uploaders."""
+
+    def __init__(self, buckets: Optional[list] = None):
+        self._lock = threading.Lock()
+        self.phases = {phase: Histogram(buckets) for phase in PHASES}
+        self.bytes_sent = 0
+        self.retries = 0
+        self.errors = {'retryable': 0, 'fatal': 0}
+        self.files = {'ok': 0, 'error': 0}
+        self.started = time.time()
+        self.ended = None
+
+    @contextlib.contextmanager
+    def time_phase(self, phase: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_phase(phase, time.perf_counter() - started)
+
+    def observe_phase(self, phase: str, duration: float):
+        with self._lock:
+            self.phases[phase].observe(duration)
+
+    def add_bytes(self, amount: int):
+        with self._lock:
+            self.bytes_sent += amount
+
+    def count_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def count_error(self, retryable: bool):
+        with self._lock:
+            self.errors['retryable' if retryable else 'fatal'] += 1
+
+    def count_file(self, success: bool):
+        with self._lock:
+            self.files['ok' if success else 'error'] += 1
+
+    def finish(self):
+        self.ended = time.time()
+
+    @property
+    def duration(self) -> float:
+        return (self.ended or time.time()) - self.started
+
+    @property
+    def throughput(self) -> float:
+        return self.bytes_sent / max(self.duration, 1e-6)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {'started': self.started,
+                    'duration': self.duration,
+                    'bytes_sent': self.bytes_sent,
+                    'throughput': self.throughput,
+                    'files': dict(self.files),
+                    'retries': self.retries,
+                    'errors': dict(self.errors),
+                    'phases': {phase: histogram.to_dict() for phase, histogram in self.phases.items()}}
+
+    def to_prometheus(self) -> str:
+        lines = []
+
+        def add_metric(name, metric_type, description, samples):
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            for labels, value in samples:
+                lines.append(f'{name}{labels} {value}')
+
+        with self._lock:
+            histogram_samples = []
+            for phase, histogram in self.phases.items():
+                for bound, count in zip(histogram.buckets, histogram.get_cumulative_counts()):
+                    histogram_samples.append((f'_bucket{{phase="{phase}",le="{bound}"}}', count))
+                histogram_samples.append((f'_bucket{{phase="{phase}",le="+Inf"}}', histogram.count))
+                histogram_samples.append((f'_sum{{phase="{phase}"}}', histogram.sum))
+                histogram_samples.append((f'_count{{phase="{phase}"}}', histogram.count))
+            # Histogram samples are suffixed names: the suffix is part of the "labels" here.
+            add_metric('oort_upload_phase_duration_seconds', 'histogram',
+                       'Duration of the phases of file uploads.', histogram_samples)
+            add_metric('oort_upload_bytes_sent_total', 'counter',
+                       'Bytes sent by file uploads, framing and retries included.', [('', self.bytes_sent)])
+            add_metric('oort_upload_throughput_bytes_per_second', 'gauge',
+                       'Bytes sent per second over the whole walk.', [('', f'{self.throughput:.1f}')])
+            add_metric('oort_upload_files_total', 'counter', 'Files uploaded, by final status.',
+                       [(f'{{status="{status}"}}', count) for status, count in self.files.items()])
+            add_metric('oort_upload_retries_total', 'counter', 'Upload attempts retried.', [('', self.retries)])
+            add_metric('oort_upload_errors_total', 'counter', 'Failed upload attempts, by kind.',
+                       [(f'{{kind="{kind}"}}', count) for kind, count in self.errors.items()])
+            add_metric('oort_upload_walk_duration_seconds', 'gauge', 'Duration of the walk.',
+                       [('', f'{self.duration:.3f}')])
+            add_metric('oort_upload_walk_start_timestamp_seconds', 'gauge', 'Start time of the walk.',
+                       [('', f'{self.started:.3f}')])
+        return '\n'.join(lines) + '\n'
+
+    def write(self, directory: Path):
+        """Write the metrics as a Prometheus textfile and a JSON summary into the given directory."""
+        directory.mkdir(parents=True, exist_ok=True)
+        _write_atomically(directory / PROMETHEUS_FILE_NAME, self.to_prometheus())
+        _write_atomically(directory / JSON_FILE_NAME, json.dumps(self.to_dict(), indent=2))
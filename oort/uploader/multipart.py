@@ -0,0 +1,144 @@
+import os
+import uuid
+from pathlib import Path
+from typing import Callable, Optional
+
+# Blocks handed to the HTTP connection. Larger than the reads it asks for, to limit Python overhead per byte.
+STREAM_BLOCK_SIZE = 256 * 1024
+
+
+def build_boundary() -> str:
+    return uuid.uuid4().hex
+
+
+def get_content_type(boundary: str) -> str:
+    return f'multipart/form-data; boundary={boundary}'
+
+
+def encode_multipart_preamble(boundary: str, fields: list, file_name: str) -> bytes:
+    """Encode the form fields, and the headers of the file part that follows them."""
+    preamble = ''.join(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+                       for name, value in fields)
+    preamble += (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{file_name}"\r\n'
+                 f'Content-Type: application/octet-stream\r\n\r\n')
+    return preamble.encode()
+
+
+def encode_multipart_epilogue(boundary: str) -> bytes:
+    return f'\r\n--{boundary}--\r\n'.encode()
+
+
+class FileRangeBody(object):
+    """A request body made of a range of a file, between optional prefix and suffix bytes.
+
+    The file range is read into a single buffer of STREAM_BLOCK_SIZE bytes, handed to the connection as
+    views: each block is only valid until the next read, the connection sending it before asking for the
+    next one. A file truncated while being sent fails the upload with an OSError. Use it as a context
+    manager: the file is opened on enter, and always closed on exit.
+    """
+
+    def __init__(self,
+                 file_path: Path,
+                 offset: int = 0,
+                 length: Optional[int] = None,
+                 prefix: bytes = b'',
+                 suffix: bytes = b'',
+                 callback: Optional[Callable[[int], None]] = None):
+        self._file_path = file_path
+        self._offset = offset
+        self._length = length
+        self._prefix = prefix
+        self._suffix = suffix
+        self._callback = callback
+        self._file = None
+        self._buffer = None
+        self._block = None
+        self._blocks = None
+        self.bytes_read = 0
+
+    def open(self):
+        self._file = open(self._file_path, 'rb')
+        try:
+            # The length is fixed once opened, even if the file is being appended to meanwhile.
+            file_size = os.fstat(self._file.fileno()).st_size
+            available = max(file_size - self._offset, 0)
+            self._length = available if self._length is None else min(self._length, available)
+            self._file.seek(self._offset)
+        except OSError:
+            self.close()
+            raise
+        self._buffer = bytearray(min(STREAM_BLOCK_SIZE, self._length))
+        self._blocks = self._iter_blocks()
+        return self
+
+    def close(self):
+        # The view handed out last is released first, for nothing to refer to the buffer anymore.
+        self._release_block()
+        if self._blocks is not None:
+            self._blocks.close()
+            self._blocks = None
+        self._buffer = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return len(self._prefix) + (self._length or 0) + len(self._suffix)
+
+    def _release_block(self):
+        if isinstance(self._block, memoryview):
+            self._block.release()
+        self._block = None
+
+    def _iter_blocks(self):
+        if self._prefix:
+            yield self._prefix
+        remaining = self._length
+        with memoryview(self._buffer) as buffer:
+            while remaining > 0:
+                with buffer[:min(len(buffer), remaining)] as target:
+                    count = self._file.readinto(target)
+                if not count:
+                    raise OSError(f'{str(self._file_path)} was truncated while being sent.')
+                remaining -= count
+                yield buffer[:count]
+        if self._suffix:
+            yield self._suffix
+
+    def read(self, size: int = -1):
+        # The size asked for is ignored: blocks are views on a buffer of fixed size.
+        self._release_block()
+        self._block = next(self._blocks, b'') if self._blocks is not None else b''
+        self.bytes_read += len(self._block)
+        if self._callback is not None and len(self._block) > 0:
+            self._callback(len(self._block))
+        return self._block
+
+
+class MultipartFileBody(FileRangeBody):
+    """A multipart/form-data body made of form fields and a whole file.
+
+    The framing is encoded upfront, so that the length of the body is known before sending it.
+    """
+
+    def __init__(self,
+                 fields: list,
+                 file_path: Path,
+                 file_name: Optional[str] = None,
+                 boundary: Optional[str] = None,
+                 callback: Optional[Callable[[int], None]] = None):
+        self.boundary = boundary or build_boundary()
+        super().__init__(file_path,
+                         prefix=encode_multipart_preamble(self.boundary, fields, file_name or file_path.name),
+                         suffix=encode_multipart_epilogue(self.boundary),
+                         callback=callback)
+
+    @property
+    def content_type(self) -> str:
+        return get_content_type(self.boundary)
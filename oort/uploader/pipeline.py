@@ -0,0 +1,298 @@
+import asyncio
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+from oort.common.constants import Status, Substatus
+from oort.common.context import Context
+from oort.common.logger import get_oort_logger
+from .bundles import Bundler, get_item_paths
+from .datasets import DatasetCache
+from .errors import UploadRemoteDatasetCheckError
+from .filters import PathFilter
+from .hasher import BackgroundHasher
+from .headers import HeaderCache, read_headers, split_undated_files
+from .ledger import UploadLedger
+from .progress import ProgressRenderer, ThroughputHistory
+from .retry import RetryPolicy
+from .scanner import Manifest, get_root_path, scan_folder
+from .scheduling import DEFAULT_SCHEDULING_POLICY, schedule
+from .tags import TagBatcher, build_walk_tags
+from .walker import resolve_dataset, update_deferred_tags, upload_scanned_file
+
+logger = get_oort_logger('pipeline')
+
+# Sentinel telling a stage that its upstream stage is done.
+_END_OF_STREAM = None
+
+SCAN_BATCH_SIZE = 1000
+
+
+class UploadPipeline(object):
+    """Asyncio execution mode of the upload walk.
+
+    Scanning, dataset resolution, uploading and tagging run as coroutines connected by bounded
+    queues, which provide backpressure: the scanner never runs far ahead of the uploads. The HTTP
+    client being blocking, each upload streams its file body from disk in a worker thread, so that
+    the event loop itself never blocks and can keep `in_flight` uploads going at once.
+    """
+
+    def __init__(self,
+                 context: Context,
+                 root_path: Path,
+                 in_flight: int = 100,
+                 manifest: Optional[Manifest] = None,
+                 ledger: Optional[UploadLedger] = None,
+                 force: bool = False,
+                 digest_algorithm: Optional[str] = None,
+                 dataset_cache: Optional[DatasetCache] = None,
+                 uploader_options: Optional[dict] = None,
+                 retry_policy: Optional[RetryPolicy] = None,
+                 path_filter: Optional[PathFilter] = None,
+                 read_headers: bool = False,
+                 skip_undated: bool = False,
+                 header_cache: Optional[HeaderCache] = None,
+                 bundler: Optional[Bundler] = None,
+                 scheduling_policy: str = DEFAULT_SCHEDULING_POLICY,
+                 throughput_history: Optional[ThroughputHistory] = None,
+                 requeue_rounds: int = 1):
+        self._context = context
+        self._root_path = root_path
+        self._in_flight = in_flight
+        self._manifest = manifest
+        self._path_filter = path_filter
+        self._ledger = ledger
+        self._force = force
+        self._digest_algorithm = digest_algorithm
+        self._hasher = None
+        self._dataset_cache = dataset_cache or DatasetCache()
+        self._uploader_options = uploader_options or {}
+        self._retry_policy = retry_policy or RetryPolicy()
+        # Headers are read batch by batch, after the ledger lookup, so that synced files are not read.
+        self._read_headers = read_headers or skip_undated
+        self._skip_undated = skip_undated
+        self._header_cache = header_cache
+        self._bundler = bundler
+        self._scheduling_policy = scheduling_policy
+        # As in walks, files that failed for transient reasons get another chance once all the others are done.
+        self._requeue_rounds = requeue_rounds
+        self._requeued_files = []
+        self._progress = ProgressRenderer(history=throughput_history)
+        self._executor = None
+        self._dataset_error = None
+        self._dataset_resolved = None
+
+        self.success_uploads = []
+        self.failed_uploads = []
+
+    async def _run_blocking(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _scan_batches(self):
+        if self._manifest is not None:
+            # The whole folder being known, it is scheduled at once. Otherwise, each batch is.
+            source = iter(schedule(list(self._manifest), self._scheduling_policy))
+        else:
+            source = scan_folder(self._root_path, self._path_filter)
+        batch = []
+        for scanned_file in source:
+            batch.append(scanned_file)
+            if len(batch) == SCAN_BATCH_SIZE:
+                yield batch
+                batch = []
+        if len(batch) > 0:
+            yield batch
+
+    def _next_pending_batch(self, batches, synced_files: Optional[dict]):
+        # Scanning and ledger lookups are blocking, hence run in a worker thread, one batch at a time.
+        for batch in batches:
+            if synced_files is not None:
+                batch, _ = self._ledger.split_synced_files(self._root_path,
+                                                           self._context.dataset_uuid,
+                                                           batch,
+                                                           synced_files=synced_files,
+                                                           digest_algorithm=self._digest_algorithm)
+            if self._read_headers and len(batch) > 0:
+                read_headers(batch, cache=self._header_cache)
+                if self._skip_undated:
+                    batch, undated_files = split_undated_files(batch)
+                    if len(undated_files) > 0:
+                        logger.info(f"[Pipeline] Skipping {len(undated_files)} files "
+                                    f"{Substatus.SKIPPED_NO_DATE_OBS.value}.")
+            if self._bundler is not None and len(batch) > 0:
+                # Bundles are planned batch by batch: the last bundle of a batch may be smaller than the target.
+                bundles, batch = self._bundler.plan(self._root_path, batch)
+                batch = schedule(bundles + batch, self._scheduling_policy)
+            elif self._manifest is None:
+                batch = schedule(batch, self._scheduling_policy)
+            if len(batch) > 0:
+                if self._hasher is not None:
+                    self._hasher.submit(batch)
+                return batch
+        return None
+
+    async def _scan_stage(self, upload_queue: asyncio.Queue):
+        synced_files = None
+        if self._ledger is not None and not self._force:
+            synced_files = await self._run_blocking(self._ledger.read_synced_files,
+                                                    self._root_path,
+                                                    self._context.dataset_uuid)
+
+        batches = self._scan_batches()
+        while True:
+            batch = await self._run_blocking(self._next_pending_batch, batches, synced_files)
+            if batch is None:
+                break
+            # Totals grow as the folder is scanned: the ETA is only an estimate until the scan is done.
+            self._progress.add_total(len(batch), sum(scanned_file.size for scanned_file in batch))
+            for scanned_file in batch:
+                await upload_queue.put(scanned_file)
+
+        for _ in range(self._in_flight):
+            await upload_queue.put(_END_OF_STREAM)
+
+    async def _resolve_dataset(self):
+        # Resolved once, and only when there is something to upload, so that no empty dataset is created.
+        if self._dataset_resolved is None:
+            self._dataset_resolved = asyncio.ensure_future(
+                self._run_blocking(resolve_dataset, self._context, self._dataset_cache,
+                                   self._uploader_options.get('metrics'), self._retry_policy)
+            )
+        try:
+            await self._dataset_resolved
+        except UploadRemoteDatasetCheckError as error:
+            self._dataset_error = error
+
+    async def _upload_stage(self, upload_queue: asyncio.Queue, result_queue: asyncio.Queue):
+        while True:
+            scanned_file = await upload_queue.get()
+            if scanned_file is _END_OF_STREAM:
+                await result_queue.put(_END_OF_STREAM)
+                break
+
+            await self._resolve_dataset()
+            if self._dataset_error is not None:
+                result = Status.ERROR, Substatus.ERROR, str(self._dataset_error), False
+            else:
+                result = await self._run_blocking(upload_scanned_file,
+                                                  self._context,
+                                                  self._root_path,
+                                                  scanned_file,
+                                                  self._ledger,
+                                                  self._uploader_options,
+                                                  self._retry_policy,
+                                                  self._hasher)
+            await result_queue.put((scanned_file, result))
+
+    async def _requeue_stage(self, upload_queue: asyncio.Queue, scanned_files: list):
+        for scanned_file in scanned_files:
+            await upload_queue.put(scanned_file)
+        for _ in range(self._in_flight):
+            await upload_queue.put(_END_OF_STREAM)
+
+    async def _result_stage(self, result_queue: asyncio.Queue, requeue: bool):
+        remaining_upload_workers = self._in_flight
+        while remaining_upload_workers > 0:
+            item = await result_queue.get()
+            if item is _END_OF_STREAM:
+                remaining_upload_workers -= 1
+                continue
+
+            scanned_file, (status, substatus, error, retryable) = item
+            if status == Status.OK:
+                self.success_uploads.extend(get_item_paths(scanned_file))
+            elif retryable and requeue:
+                self._requeued_files.append(scanned_file)
+                continue
+            else:
+                self.failed_uploads.extend((path, substatus, error) for path in get_item_paths(scanned_file))
+            self._progress.finish_file(success=status == Status.OK)
+            if self._uploader_options.get('metrics') is not None:
+                self._uploader_options['metrics'].count_file(success=status == Status.OK)
+
+    async def _run_stages(self, source_stage, upload_queue: asyncio.Queue, result_queue: asyncio.Queue, requeue: bool):
+        await asyncio.gather(source_stage,
+                             self._result_stage(result_queue, requeue),
+                             *[self._upload_stage(upload_queue, result_queue) for _ in range(self._in_flight)])
+
+    async def run(self):
+        tag_batcher = TagBatcher(self._context.api, build_walk_tags(self._context, self._root_path))
+        self._uploader_options = dict(self._uploader_options,
+                                      progress=self._progress,
+                                      tags=tag_batcher.tags,
+                                      tag_batcher=tag_batcher)
+
+        upload_queue = asyncio.Queue(maxsize=2 * self._in_flight)
+        result_queue = asyncio.Queue(maxsize=2 * self._in_flight)
+
+        # Files are hashed by a pool of processes as soon as scanned, while the first ones are uploaded.
+        self._hasher = BackgroundHasher(self._digest_algorithm) if self._digest_algorithm is not None else None
+        # One extra thread for the scanning, dataset and tagging stages.
+        with self._hasher or contextlib.nullcontext(), \
+                ThreadPoolExecutor(max_workers=self._in_flight + 1) as self._executor:
+            await self._run_stages(self._scan_stage(upload_queue), upload_queue, result_queue,
+                                   requeue=self._requeue_rounds > 0)
+            for round_index in range(1, 1 + self._requeue_rounds):
+                if len(self._requeued_files) == 0:
+                    break
+                requeued_files, self._requeued_files = self._requeued_files, []
+                logger.info(f"[Pipeline] Requeuing {len(requeued_files)} files that failed with transient errors...")
+                await self._run_stages(self._requeue_stage(upload_queue, requeued_files), upload_queue, result_queue,
+                                       requeue=round_index < self._requeue_rounds)
+
+            # Datafiles whose tags were not applied at creation are updated once all uploads are done.
+            await self._run_blocking(update_deferred_tags, self._context, self._root_path, tag_batcher, self._ledger,
+                                     self.success_uploads, self.failed_uploads, self._uploader_options.get('metrics'))
+        self._progress.close()
+
+        return self.success_uploads, self.failed_uploads
+
+
+def walk_async(context: Context,
+               folder_string: str,
+               in_flight: int = 100,
+               manifest: Optional[Manifest] = None,
+               ledger: Optional[UploadLedger] = None,
+               force: bool = False,
+               digest_algorithm: Optional[str] = None,
+               dataset_cache: Optional[DatasetCache] = None,
+               uploader_options: Optional[dict] = None,
+               retry_policy: Optional[RetryPolicy] = None,
+               path_filter: Optional[PathFilter] = None,
+               read_headers: bool = False,
+               skip_undated: bool = False,
+               header_cache: Optional[HeaderCache] = None,
+               bundler: Optional[Bundler] = None,
+               scheduling_policy: str = DEFAULT_SCHEDULING_POLICY,
+               throughput_history: Optional[ThroughputHistory] = None):
+    log_prefix = '[Pipeline]'
+    root_path = get_root_path(folder_string)
+    logger.info(f"{log_prefix} Starting upload pipeline through {root_path} ({in_flight} uploads in flight)...")
+
+    pipeline = UploadPipeline(context,
+                              root_path,
+                              in_flight=in_flight,
+                              manifest=manifest,
+                              ledger=ledger,
+                              force=force,
+                              digest_algorithm=digest_algorithm,
+                              dataset_cache=dataset_cache,
+                              uploader_options=uploader_options,
+                              retry_policy=retry_policy,
+                              path_filter=path_filter,
+                              read_headers=read_headers,
+                              skip_undated=skip_undated,
+                              header_cache=header_cache,
+                              bundler=bundler,
+                              scheduling_policy=scheduling_policy,
+                              throughput_history=throughput_history)
+    success_uploads, failed_uploads = asyncio.run(pipeline.run())
+
+    logger.info(f"{log_prefix} {len(success_uploads)} successful uploads and {len(failed_uploads)} failed.\n\n")
+    if len(failed_uploads) > 0:
+        logger.error(f'{log_prefix} Here are the failed uploads:')
+        for path, substatus, error in failed_uploads:
+            logger.error(f'{path} ({substatus}) {error}')
+
+    return success_uploads, failed_uploads
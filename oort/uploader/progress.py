@@ -0,0 +1,203 @@
+import collections
+import json
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+from oort.common.utils import get_oort_config_file_path
+
+DEFAULT_REFRESH_INTERVAL = 0.25
+# Throughput is measured over a sliding window, so that it follows changes of the uplink.
+THROUGHPUT_WINDOW = 10.0
+BAR_LENGTH = 30
+
+# The runs kept to estimate the throughput of the next ones. Short runs say more about latency than bandwidth.
+THROUGHPUT_HISTORY_LENGTH = 10
+THROUGHPUT_HISTORY_MIN_BYTES = 1000 * 1000
+THROUGHPUT_HISTORY_MIN_DURATION = 1.0
+
+
+# Sizes are formatted in decimal (SI) units, as network rates are: 1 kB is 1000 bytes.
+def format_size(size: float) -> str:
+    for unit in ['B', 'kB', 'MB', 'GB', 'TB']:
+        if size < 1000 or unit == 'TB':
+            return f'{size:.1f} {unit}' if unit != 'B' else f'{int(size)} B'
+        size /= 1000
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds >= 86400:
+        return f'{seconds // 86400}d{seconds % 86400 // 3600:02d}h'
+    if seconds >= 3600:
+        return f'{seconds // 3600}h{seconds % 3600 // 60:02d}m'
+    if seconds >= 60:
+        return f'{seconds // 60}m{seconds % 60:02d}s'
+    return f'{seconds}s'
+
+
+class ThroughputHistory(object):
+    """The throughput measured by past uploads, kept locally to estimate the duration of the next ones."""
+
+    def __init__(self, file_path: Optional[Path] = None, length: int = THROUGHPUT_HISTORY_LENGTH):
+        self._file_path = file_path or get_oort_config_file_path('throughput', 'json')
+        self._length = length
+        self._lock = threading.Lock()
+        self.runs = self._read()
+
+    def _read(self) -> list:
+        try:
+            return json.loads(self._file_path.read_text()).get('runs', [])
+        except (OSError, ValueError, AttributeError):
+            # A missing or corrupted history only means there is no estimate yet.
+            return []
+
+    def record(self, bytes_sent: int, duration: float):
+        if bytes_sent < THROUGHPUT_HISTORY_MIN_BYTES or duration < THROUGHPUT_HISTORY_MIN_DURATION:
+            return
+        with self._lock:
+            run = {'timestamp': time.time(), 'bytes': bytes_sent, 'duration': duration}
+            self.runs = (self.runs + [run])[-self._length:]
+            temporary_path = self._file_path.with_name(f'.{self._file_path.name}.{os.getpid()}')
+            try:
+                temporary_path.write_text(json.dumps({'runs': self.runs}))
+                os.replace(temporary_path, self._file_path)
+            except OSError:
+                pass
+
+    def estimate(self) -> Optional[float]:
+        """Return the bytes per second of past runs, weighted by their size, if any."""
+        with self._lock:
+            total_duration = sum(run['duration'] for run in self.runs)
+            return sum(run['bytes'] for run in self.runs) / total_duration if total_duration > 0 else None
+
+
+class ProgressRenderer(object):
+    """A single progress line aggregating all the uploads of a walk, redrawn at most every refresh_interval.
+
+    Uploaders report bytes as they are sent, and walkers report files as they are done. Both can be
+    called from any thread. The bytes of failed upload attempts are rolled back from the progress
+    (not from the throughput), for the retries not to count them twice. When the output is not a
+    terminal, the progress line is not drawn: only a summary is written when the renderer is closed.
+
+    The ETA uses the throughput measured over the last seconds. Until a whole window has been
+    measured, it is blended with the throughput of past runs, if known, which is then recorded.
+    """
+
+    def __init__(self,
+                 total_files: int = 0,
+                 total_bytes: int = 0,
+                 refresh_interval: float = DEFAULT_REFRESH_INTERVAL,
+                 stream=None,
+                 quiet: Optional[bool] = None,
+                 history: Optional[ThroughputHistory] = None):
+        self._history = history
+        self._prior_throughput = history.estimate() if history is not None else None
+        self._stream = stream or sys.stdout
+        self._quiet = quiet if quiet is not None else not self._stream.isatty()
+        self._refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._last_render = 0.0
+        self._samples = collections.deque([(self._started, 0)])
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.bytes_sent = 0
+        # The bytes of the files towards completion, as opposed to the bytes transferred.
+        self.bytes_done = 0
+        self.done_files = 0
+        self.failed_files = 0
+
+    def add_total(self, file_count: int, size: int):
+        """Grow the totals, for walks discovering their files while uploading."""
+        with self._lock:
+            self.total_files += file_count
+            self.total_bytes += size
+
+    def add_bytes(self, amount: int, sent: bool = True):
+        """Report bytes of files as done. Bytes received by the server in a previous run are not sent again."""
+        with self._lock:
+            if sent:
+                self.bytes_sent += amount
+            self.bytes_done += amount
+            should_render = self._should_render()
+        if should_render:
+            self._render()
+
+    def roll_back_bytes(self, amount: int):
+        """Withdraw bytes reported by a failed upload attempt."""
+        with self._lock:
+            self.bytes_done = max(self.bytes_done - amount, 0)
+
+    def finish_file(self, success: bool = True):
+        with self._lock:
+            self.done_files += 1
+            if not success:
+                self.failed_files += 1
+            should_render = self._should_render()
+        if should_render:
+            self._render()
+
+    def get_throughput(self) -> float:
+        """Return the bytes sent per second over the last THROUGHPUT_WINDOW seconds."""
+        now = time.monotonic()
+        with self._lock:
+            self._samples.append((now, self.bytes_sent))
+            while len(self._samples) > 2 and now - self._samples[1][0] > THROUGHPUT_WINDOW:
+                self._samples.popleft()
+            first_time, first_bytes = self._samples[0]
+            return (self.bytes_sent - first_bytes) / max(now - first_time, 1e-6)
+
+    def get_expected_throughput(self, throughput: Optional[float] = None) -> float:
+        """Return the measured throughput, blended with that of past runs while the measure is short."""
+        throughput = throughput if throughput is not None else self.get_throughput()
+        if self._prior_throughput is None:
+            return throughput
+        weight = min((time.monotonic() - self._started) / THROUGHPUT_WINDOW, 1.0)
+        return weight * throughput + (1 - weight) * self._prior_throughput
+
+    def get_eta(self, throughput: Optional[float] = None) -> Optional[float]:
+        throughput = self.get_expected_throughput(throughput)
+        if throughput <= 0 or self.total_bytes <= 0:
+            return None
+        return max(self.total_bytes - self.bytes_done, 0) / throughput
+
+    def _should_render(self) -> bool:
+        # Called with the lock held. Skipped renderings are not deferred: the next report draws the latest state.
+        now = time.monotonic()
+        if self._quiet or now - self._last_render < self._refresh_interval:
+            return False
+        self._last_render = now
+        return True
+
+    def _render(self):
+        self._stream.write('\r' + self.render_line())
+        self._stream.flush()
+
+    def render_line(self) -> str:
+        throughput = self.get_throughput()
+        eta = self.get_eta(throughput)
+        fraction = min(self.bytes_done / self.total_bytes, 1.0) if self.total_bytes > 0 else 0.0
+        hashes = '#' * int(round(fraction * BAR_LENGTH))
+        line = f'[{hashes.ljust(BAR_LENGTH)}] {fraction * 100:5.1f}%'
+        line += f' | {self.done_files}/{self.total_files} files'
+        if self.failed_files > 0:
+            line += f' ({self.failed_files} failed)'
+        line += f' | {format_size(throughput)}/s'
+        line += f' | ETA {format_duration(eta)}' if eta is not None else ' | ETA --'
+        return line
+
+    def close(self):
+        duration = time.monotonic() - self._started
+        with self._lock:
+            summary = (f'{self.done_files}/{self.total_files} files, {format_size(self.bytes_sent)} sent '
+                       f'in {format_duration(duration)} ({format_size(self.bytes_sent / max(duration, 1e-6))}/s)')
+            if self.failed_files > 0:
+                summary += f', {self.failed_files} failed'
+        self._stream.write(('\n' if not self._quiet else '') + summary + '\n')
+        self._stream.flush()
+        if self._history is not None:
+            self._history.record(self.bytes_sent, duration)
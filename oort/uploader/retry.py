@@ -0,0 +1,74 @@
+import random
+import threading
+from typing import Optional
+
+from requests import ConnectionError, ConnectTimeout, Timeout
+from requests.exceptions import ChunkedEncodingError
+from urllib3.exceptions import NewConnectionError
+
+from oort.common.constants import DEFAULT_MAX_ATTEMPTS
+
+# Timeouts, rate limiting, and server-side or gateway errors are worth retrying. Others are not:
+# an invalid request or a missing permission will fail the same way again.
+RETRYABLE_STATUS_CODES = [408, 425, 429, 500, 502, 503, 504]
+
+# Requests refused with these status codes have not been processed by the server. Others, such as a
+# gateway error, may have been.
+UNPROCESSED_STATUS_CODES = [408, 425, 429, 503]
+
+DEFAULT_BASE_DELAY = 1.0
+DEFAULT_MAX_DELAY = 60.0
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (ConnectionError, Timeout, ChunkedEncodingError)):
+        return True
+    return getattr(error, 'status_code', None) in RETRYABLE_STATUS_CODES
+
+
+def is_unprocessed(error: Exception) -> bool:
+    """Tell whether a failed request surely had no effect on the server, so that even a create can be retried."""
+    if isinstance(error, ConnectTimeout):
+        return True
+    if isinstance(error, ConnectionError):
+        # No connection could be opened. A connection dropped while sending or waiting for the response is not that.
+        reason = getattr(error.args[0], 'reason', None) if len(error.args) > 0 else None
+        return isinstance(reason, NewConnectionError)
+    return getattr(error, 'status_code', None) in UNPROCESSED_STATUS_CODES
+
+
+class RetryPolicy(object):
+    """Per-file retries with exponential backoff and full jitter, within a retry budget shared by a walk.
+
+    The budget caps the total number of retries of a walk, so that a server down for good does not
+    make every file wait through all of its attempts.
+    """
+
+    def __init__(self,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+                 base_delay: float = DEFAULT_BASE_DELAY,
+                 max_delay: float = DEFAULT_MAX_DELAY,
+                 budget: Optional[int] = None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._budget = budget
+        self._retry_count = 0
+        self._lock = threading.Lock()
+
+    @property
+    def retry_count(self) -> int:
+        return self._retry_count
+
+    def get_backoff_delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def acquire_retry(self, attempt: int) -> bool:
+        """Return whether a file that failed at the given attempt (starting at 0) can be retried."""
+        if attempt + 1 >= self.max_attempts:
+            return False
+        with self._lock:
+            if self._budget is not None and self._retry_count >= self._budget:
+                return False
+            self._retry_count += 1
+            return True
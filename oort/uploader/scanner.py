@@ -0,0 +1,191 @@
+import gzip
+import hashlib
+import json
+import os
+import zlib
+from datetime import datetime
+from pathlib import Path, PurePosixPath
+from typing import Iterable, Iterator, Optional
+
+from oort.common.logger import get_oort_logger
+from .filters import PathFilter
+
+logger = get_oort_logger('scanner')
+
+MANIFEST_FORMAT = 'oort-manifest'
+MANIFEST_VERSION = 1
+
+
+class ScannedFile(object):
+    """A regular file found during a scan, with the stat info collected on the way.
+
+    The digest and the metadata read from the file header are only set when asked for.
+    """
+    __slots__ = ('path', 'size', 'mtime', 'digest', 'metadata')
+
+    def __init__(self,
+                 path: Path,
+                 size: int,
+                 mtime: float,
+                 digest: Optional[str] = None,
+                 metadata: Optional[dict] = None):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.digest = digest
+        self.metadata = metadata
+
+    def __repr__(self):
+        return f'ScannedFile({str(self.path)!r}, size={self.size}, mtime={self.mtime})'
+
+
+class Manifest(object):
+    """The list of files found below a root folder, built once and shared by the summary and the walker."""
+
+    def __init__(self, root_path: Path, files: list):
+        self.root_path = root_path
+        self.files = files
+
+    def __len__(self):
+        return len(self.files)
+
+    def __iter__(self):
+        return iter(self.files)
+
+    @property
+    def total_size(self) -> int:
+        return sum(f.size for f in self.files)
+
+
+def get_root_path(folder_string: str) -> Path:
+    root_path = Path(folder_string).expanduser().resolve()
+    if root_path.is_file():  # Just in case we pass a file...
+        root_path = root_path.parent
+    return root_path
+
+
+def is_hidden(relative_path: str) -> bool:
+    """Hidden files, and the files of hidden folders, are never uploaded."""
+    return any(part.startswith('.') for part in relative_path.split('/'))
+
+
+def scan_folder(root_path: Path, path_filter: Optional[PathFilter] = None) -> Iterator[ScannedFile]:
+    """Yield the non-hidden regular files below root_path, accepted by the filter if any.
+
+    Hidden directories, and those excluded by the filter, are pruned: they are never descended
+    into. Symbolic links to directories are not followed, to avoid walking the same subtree twice
+    (or forever).
+    """
+    path_filter = path_filter or None  # An empty filter accepts everything: skip it altogether.
+    # Pairs of (absolute, relative) paths. Relative ones are only needed by the filter.
+    pending_dir_paths = [(str(root_path), '')]
+    while pending_dir_paths:
+        dir_path, relative_dir_path = pending_dir_paths.pop()
+        try:
+            with os.scandir(dir_path) as entries:
+                for entry in entries:
+                    # Skipping both hidden files and hidden directories.
+                    if is_hidden(entry.name):
+                        continue
+                    relative_path = f'{relative_dir_path}/{entry.name}' if relative_dir_path else entry.name
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if path_filter is None or path_filter.accepts_dir(relative_path, entry.name):
+                                pending_dir_paths.append((entry.path, relative_path))
+                        elif entry.is_file():
+                            if path_filter is not None and not path_filter.accepts_file(relative_path, entry.name):
+                                continue
+                            stat = entry.stat()
+                            yield ScannedFile(Path(entry.path), stat.st_size, stat.st_mtime)
+                    except OSError as error:
+                        logger.warning(f'[Scanner] Skipping {entry.path}: {str(error)}')
+        except OSError as error:
+            logger.warning(f'[Scanner] Skipping folder {dir_path}: {str(error)}')
+
+
+def build_manifest(root_path: Path, path_filter: Optional[PathFilter] = None) -> Manifest:
+    return Manifest(root_path, list(scan_folder(root_path, path_filter)))
+
+
+class Shard(object):
+    """The slice i/N of a manifest, selected by hashing relative paths. Numbers go from 1 to N.
+
+    The partition only depends on the relative paths: hosts mounting the same storage at different
+    places, and sharding the same manifest, upload disjoint slices covering the whole of it.
+    """
+
+    def __init__(self, number: int, count: int):
+        if count < 1 or not 1 <= number <= count:
+            raise ValueError(f'Invalid shard {number}/{count}.')
+        self.number = number
+        self.count = count
+
+    def __str__(self):
+        return f'{self.number}/{self.count}'
+
+    def contains(self, relative_path: str) -> bool:
+        digest = hashlib.blake2b(relative_path.encode('utf-8', errors='surrogateescape'), digest_size=8).digest()
+        return int.from_bytes(digest, 'big') % self.count == self.number - 1
+
+
+def write_manifest_file(file_path: Path, root_path: Path, scanned_files: Iterable[ScannedFile]) -> int:
+    """Write scanned files into a manifest file, as they come. Return the number of files written.
+
+    Manifests are gzipped JSON lines: a header, then one [relative path, size, mtime] list per file.
+    """
+    count = 0
+    with gzip.open(file_path, 'wt', encoding='utf-8', errors='surrogateescape') as f:
+        header = {'format': MANIFEST_FORMAT,
+                  'version': MANIFEST_VERSION,
+                  'root': str(root_path),
+                  'created': datetime.now().isoformat()}
+        f.write(json.dumps(header) + '\n')
+        for scanned_file in scanned_files:
+            relative_path = scanned_file.path.relative_to(root_path).as_posix()
+            f.write(json.dumps([relative_path, scanned_file.size, scanned_file.mtime], ensure_ascii=False) + '\n')
+            count += 1
+    return count
+
+
+def _parse_manifest_line(line: str) -> tuple:
+    try:
+        relative_path, size, mtime = json.loads(line)
+    except (TypeError, ValueError):
+        raise ValueError(f'Malformed manifest line: {line.strip()[:200]}') from None
+    if not isinstance(relative_path, str) or not isinstance(size, int) or not isinstance(mtime, (int, float)):
+        raise ValueError(f'Malformed manifest line: {line.strip()[:200]}')
+    # Manifests may come from elsewhere: they must not point outside of the root folder.
+    posix_path = PurePosixPath(relative_path)
+    if posix_path.is_absolute() or '..' in posix_path.parts:
+        raise ValueError(f'Manifest path outside of the root folder: {relative_path}')
+    return relative_path, size, mtime
+
+
+def read_manifest_file(file_path: Path,
+                       root_path: Path,
+                       shard: Optional[Shard] = None,
+                       path_filter: Optional[PathFilter] = None) -> Manifest:
+    """Read the files of a manifest file (of a shard of it, if any), located below root_path.
+
+    The root folder recorded in the manifest is not used: the same storage may be mounted elsewhere.
+    Raise ValueError on invalid, truncated or corrupted manifests.
+    """
+    path_filter = path_filter or None
+    files = []
+    try:
+        with gzip.open(file_path, 'rt', encoding='utf-8', errors='surrogateescape') as f:
+            header = json.loads(f.readline() or 'null')
+            if not isinstance(header, dict) or header.get('format') != MANIFEST_FORMAT:
+                raise ValueError(f'{str(file_path)} is not an Oort manifest.')
+            if header.get('version') != MANIFEST_VERSION:
+                raise ValueError(f'Unsupported manifest version: {header.get("version")}.')
+            for line in f:
+                relative_path, size, mtime = _parse_manifest_line(line)
+                if shard is not None and not shard.contains(relative_path):
+                    continue
+                if path_filter is not None and not path_filter.accepts_path(relative_path):
+                    continue
+                files.append(ScannedFile(root_path / relative_path, size, mtime))
+    except (EOFError, zlib.error) as error:
+        raise ValueError(f'{str(file_path)} is truncated or corrupted ({str(error)}).') from error
+    return Manifest(root_path, files)
@@ -0,0 +1,53 @@
+import itertools
+from collections import OrderedDict
+
+# Walk items are scanned files or bundles: both have a path, a size and an mtime.
+
+DEFAULT_SCHEDULING_POLICY = 'scan'
+
+
+def _in_scan_order(items: list) -> list:
+    return list(items)
+
+
+def _newest_first(items: list) -> list:
+    return sorted(items, key=lambda item: item.mtime, reverse=True)
+
+
+def _oldest_first(items: list) -> list:
+    return sorted(items, key=lambda item: item.mtime)
+
+
+def _smallest_first(items: list) -> list:
+    return sorted(items, key=lambda item: item.size)
+
+
+def _largest_first(items: list) -> list:
+    return sorted(items, key=lambda item: item.size, reverse=True)
+
+
+def _round_robin(items: list) -> list:
+    # One file of each folder in turn, so that every night (or target, or filter) gets its first frames early.
+    folders = OrderedDict()
+    for item in sorted(items, key=lambda item: item.path):
+        folders.setdefault(item.path.parent, []).append(item)
+    interleaved = itertools.zip_longest(*folders.values())
+    return [item for items_of_round in interleaved for item in items_of_round if item is not None]
+
+
+# Sorts are stable: items of equal keys stay in scan order.
+SCHEDULING_POLICIES = OrderedDict([
+    ('scan', _in_scan_order),
+    ('newest-first', _newest_first),
+    ('oldest-first', _oldest_first),
+    ('smallest-first', _smallest_first),
+    ('largest-first', _largest_first),
+    ('round-robin', _round_robin),
+])
+
+
+def schedule(items: list, policy: str = DEFAULT_SCHEDULING_POLICY) -> list:
+    """Return the walk items in the order they should be uploaded, according to the scheduling policy."""
+    if policy not in SCHEDULING_POLICIES:
+        raise ValueError(f'Unknown scheduling policy: {policy}')
+    return SCHEDULING_POLICIES[policy](items)
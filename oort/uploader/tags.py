@@ -0,0 +1,133 @@
+import random
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional
+
+from oort import __version__
+from oort.common.api import OortAPI
+from oort.common.context import Context
+from oort.common.logger import get_oort_logger
+from .ledger import UploadLedger
+
+logger = get_oort_logger('tags')
+
+TAG_BATCH_SIZE = 50
+TAG_MAX_ATTEMPTS = 3
+
+
+@lru_cache(maxsize=1)
+def _get_hostname() -> str:
+    return socket.gethostname()
+
+
+def build_walk_tags(context: Context, root_path: Path) -> list:
+    """Build the tags shared by every datafile uploaded during a walk. Compute them once per walk."""
+    tag_root = f'oort|root|{str(root_path)}'
+    tag_origin = f'oort|origin|{_get_hostname()}'
+    tag_uploader = f'oort|uploader|{context.config.username}'
+    tag_oort = f'oort|version|{__version__}'
+    return [tag_root, tag_origin, tag_uploader, tag_oort]
+
+
+def build_metadata_tags(metadata: dict) -> list:
+    """Build the tags of a datafile from the metadata read from its header."""
+    return [f'fits|{key}|{value}' for key, value in sorted((metadata or {}).items())]
+
+
+def _get_tag_name(tag) -> Optional[str]:
+    # Tags may come back as objects rather than plain strings.
+    if isinstance(tag, dict):
+        tag = tag.get('name')
+    return tag if isinstance(tag, str) else None
+
+
+def has_tags(datafile: dict, tags: list) -> bool:
+    return set(tags).issubset({_get_tag_name(tag) for tag in (datafile or {}).get('tags') or []})
+
+
+class TagBatcher(object):
+    """Collect the datafiles whose tags could not be set at creation, and tag them in batches.
+
+    Tags are normally sent along with the datafile creation request. Should the server ignore them,
+    the datafile is deferred here, and its tags are updated at the end of the walk, with retries.
+    """
+
+    def __init__(self,
+                 api: OortAPI,
+                 tags: list,
+                 batch_size: int = TAG_BATCH_SIZE,
+                 max_attempts: int = TAG_MAX_ATTEMPTS):
+        self._api = api
+        self._tags = tags
+        self._batch_size = batch_size
+        self._max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._pending_pks = []
+        # The tags of datafiles having more than the shared ones (e.g. metadata tags).
+        self._datafile_tags = {}
+
+    @property
+    def tags(self) -> list:
+        return self._tags
+
+    def defer(self, datafile_pk, tags: Optional[list] = None):
+        with self._lock:
+            self._pending_pks.append(datafile_pk)
+            if tags is not None and tags != self._tags:
+                self._datafile_tags[datafile_pk] = tags
+
+    def _update_tags(self, datafile_pk, tags: list) -> bool:
+        _, error = self._api.datafiles.update(datafile_pk, json={'tags': tags})
+        return error is None
+
+    def flush(self, ledger: Optional[UploadLedger] = None, root_path: Optional[Path] = None,
+              dataset_uuid: str = '') -> list:
+        """Update the tags of all deferred datafiles. Return the pks of those that could not be tagged.
+
+        With a ledger, the datafiles left untagged by previous walks of root_path are updated too, and
+        those still untagged are recorded, so that the next walk updates them (their files being
+        recorded as synced, they are not uploaded again).
+        """
+        recorded_tags = ledger.read_untagged_datafiles(root_path, dataset_uuid) if ledger is not None else {}
+        with self._lock:
+            pending_pks, self._pending_pks = self._pending_pks, []
+            datafile_tags, self._datafile_tags = self._datafile_tags, {}
+        # Ledger pks are strings.
+        deferred_pks = {str(pk) for pk in pending_pks}
+        for pk, tags in recorded_tags.items():
+            if pk not in deferred_pks:
+                pending_pks.append(pk)
+                datafile_tags[pk] = tags
+
+        failed_pks = self._update_all_tags(pending_pks, datafile_tags)
+        if ledger is not None and (len(recorded_tags) > 0 or len(failed_pks) > 0):
+            ledger.replace_untagged_datafiles(root_path, dataset_uuid,
+                                              {pk: datafile_tags.get(pk, self._tags) for pk in failed_pks})
+        return failed_pks
+
+    def _update_all_tags(self, pending_pks: list, datafile_tags: dict) -> list:
+        if len(pending_pks) == 0:
+            return []
+
+        logger.info(f'[TagBatcher] Updating tags of {len(pending_pks)} datafiles...')
+        failed_pks = []
+        with ThreadPoolExecutor(max_workers=min(self._batch_size, len(pending_pks))) as executor:
+            for start in range(0, len(pending_pks), self._batch_size):
+                batch_pks = pending_pks[start:start + self._batch_size]
+                for attempt in range(self._max_attempts):
+                    if attempt > 0:
+                        time.sleep(random.uniform(0, 2 ** attempt))
+                    batch_tags = [datafile_tags.get(pk, self._tags) for pk in batch_pks]
+                    results = list(executor.map(self._update_tags, batch_pks, batch_tags))
+                    batch_pks = [pk for pk, ok in zip(batch_pks, results) if not ok]
+                    if len(batch_pks) == 0:
+                        break
+                failed_pks.extend(batch_pks)
+
+        if len(failed_pks) > 0:
+            logger.error(f'[TagBatcher] Unable to update tags of {len(failed_pks)} datafiles: {failed_pks}')
+        return failed_pks
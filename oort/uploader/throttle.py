@@ -0,0 +1,109 @@
+import threading
+import time
+from typing import Optional
+
+from oort.common.logger import get_oort_logger
+
+logger = get_oort_logger('throttle')
+
+
+class TokenBucket(object):
+    """Thread-safe token bucket, limiting the bandwidth (in bytes per second) shared by all uploads.
+
+    Uploads consume tokens as their bodies are read. When tokens are missing, the reading thread
+    sleeps until the bucket has been refilled, which throttles the socket writes behind it.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self._rate = float(rate)
+        # By default, allow bursts of a quarter of a second worth of bytes.
+        self._capacity = float(burst or rate / 4)
+        self._tokens = self._capacity
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    def consume(self, amount: int):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._capacity, self._tokens + (now - self._last_refill) * self._rate)
+            self._last_refill = now
+            # Tokens can go negative. The debt is paid by sleeping, outside the lock.
+            self._tokens -= amount
+            deficit = -self._tokens
+        if deficit > 0:
+            time.sleep(deficit / self._rate)
+
+
+class AdaptiveConcurrencyLimiter(object):
+    """Limit the number of parallel uploads, and adjust the limit AIMD-style.
+
+    Throughput and errors are measured over windows of `window` seconds. After a window without
+    errors, and with a throughput not lower than the previous one, the limit is increased by one.
+    Errors halve the limit, and a throughput drop (a sign of congestion) reduces it by a quarter.
+    """
+
+    def __init__(self, max_limit: int, min_limit: int = 1, initial_limit: Optional[int] = None, window: float = 5.0):
+        self._max_limit = max_limit
+        self._min_limit = min_limit
+        self._limit = max(min_limit, min(max_limit, initial_limit or min_limit))
+        self._window = window
+        self._in_flight = 0
+        self._condition = threading.Condition()
+
+        self._window_started = time.monotonic()
+        self._window_bytes = 0
+        self._window_errors = 0
+        self._last_throughput = None
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    def acquire(self):
+        with self._condition:
+            while self._in_flight >= self._limit:
+                self._condition.wait()
+            self._in_flight += 1
+
+    def release(self, success: bool = True):
+        with self._condition:
+            self._in_flight -= 1
+            if not success:
+                self._window_errors += 1
+            self._maybe_adjust()
+            self._condition.notify_all()
+
+    def record_bytes(self, amount: int):
+        with self._condition:
+            self._window_bytes += amount
+            if self._maybe_adjust():
+                self._condition.notify_all()
+
+    def _maybe_adjust(self) -> bool:
+        now = time.monotonic()
+        elapsed = now - self._window_started
+        if elapsed < self._window:
+            return False
+
+        throughput = self._window_bytes / max(elapsed, 1e-6)
+        previous_limit = self._limit
+        if self._window_errors > 0:
+            self._limit = max(self._min_limit, self._limit // 2)
+        elif self._last_throughput is not None and throughput < 0.9 * self._last_throughput:
+            self._limit = max(self._min_limit, (self._limit * 3) // 4)
+        else:
+            self._limit = min(self._max_limit, self._limit + 1)
+
+        if self._limit != previous_limit:
+            logger.debug(f'[Throttle] {throughput / 1e6:.2f} MB/s, {self._window_errors} errors. '
+                         f'Parallel uploads: {previous_limit} -> {self._limit}.')
+
+        self._last_throughput = throughput
+        self._window_started = now
+        self._window_bytes = 0
+        self._window_errors = 0
+        return True
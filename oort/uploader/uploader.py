@@ -1,111 +1,345 @@
 import os
-import socket
 from datetime import datetime
 from pathlib import Path
+from typing import Optional
 
-from arcsecond import ArcsecondAPI
-from requests_toolbelt import MultipartEncoder, MultipartEncoderMonitor
+from requests import RequestException
 
-from oort import __version__
 from oort.common.constants import Status, Substatus
 from oort.common.context import Context
 from oort.common.logger import get_oort_logger
+from .compression import Codec, CompressedFileStream, is_compressible
 from .errors import UploadRemoteDatasetCheckError, UploadRemoteFileCheckError
+from .ledger import UploadLedger
+from .metrics import UploadMetrics, time_phase
+from .multipart import (FileRangeBody, MultipartFileBody, build_boundary, encode_multipart_epilogue,
+                        encode_multipart_preamble, get_content_type)
+from .progress import ProgressRenderer
+from .retry import is_unprocessed
+from .tags import TagBatcher, build_metadata_tags, build_walk_tags, has_tags
+from .throttle import AdaptiveConcurrencyLimiter, TokenBucket
+
+logger = get_oort_logger('uploader')
+
+DEFAULT_CHUNK_SIZE = 64 * 1024 * 1024
+
+# Chunked uploads need the datafiles/uploads/ endpoint, which not every Arcsecond server provides.
+# Servers answering 404 or 405 get all their files in single requests, without being asked again.
+CHUNKED_UPLOAD_UNSUPPORTED_STATUS_CODES = [404, 405]
+_servers_without_chunked_uploads = set()
 
 
 class FileUploader(object):
-    def __init__(self, context: Context, root_path: Path, file_path: Path, display_progress: bool = False):
+    def __init__(self,
+                 context: Context,
+                 root_path: Path,
+                 file_path: Path,
+                 ledger: Optional[UploadLedger] = None,
+                 chunk_threshold: Optional[int] = None,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 tags: Optional[list] = None,
+                 tag_batcher: Optional[TagBatcher] = None,
+                 rate_limiter: Optional[TokenBucket] = None,
+                 concurrency_limiter: Optional[AdaptiveConcurrencyLimiter] = None,
+                 codec: Optional[Codec] = None,
+                 progress: Optional[ProgressRenderer] = None,
+                 metrics: Optional[UploadMetrics] = None,
+                 metadata: Optional[dict] = None):
         self._context = context
         self._root_path = root_path
         self._file_path = file_path
-        self._display_progress = display_progress
+        # Files larger than chunk_threshold bytes are uploaded in resumable chunks. The ledger
+        # keeps track of the acknowledged offsets, should the upload be interrupted.
+        self._ledger = ledger
+        self._chunk_threshold = chunk_threshold
+        self._chunk_size = chunk_size
+        # Tags are sent along with the upload. Datafiles whose tags were not applied are handed to the
+        # tag batcher of the walk when there is one, or updated right away otherwise.
+        self._tags = tags if tags is not None else build_walk_tags(context, root_path)
+        # Metadata read from the file header during the walk, if any, is attached as tags too.
+        self._tags = self._tags + build_metadata_tags(metadata)
+        self._tag_batcher = tag_batcher
+        # Both limiters are shared by all the uploaders of a walk.
+        self._rate_limiter = rate_limiter
+        self._concurrency_limiter = concurrency_limiter
+        # Uncompressed data files are compressed on the fly with the codec, if any.
+        self._codec = codec
+        # The progress of all the uploads of a walk is drawn by a single renderer.
+        self._progress = progress
+        self._reported_bytes = 0
+        self._metrics = metrics
 
-        self._logger = get_oort_logger(debug=True)
+        self._logger = logger
         self._started = None
-        self._progress = 0
         self._is_test_context = bool(os.environ.get('OORT_TESTS') == '1')
         self._status = [Status.NEW, Substatus.PENDING, None]
+        self._datafile = None
+        self._create_sent = False
+        self._created_file = None
+
+        # All uploaders share the connection pool of the context API.
+        self._api = self._context.api
+
+    @property
+    def status(self) -> list:
+        return self._status
 
-        self._api = ArcsecondAPI(self._context.config, self._context.organisation_subdomain)
+    @property
+    def datafile(self) -> dict:
+        return self._datafile
 
     @property
     def log_prefix(self) -> str:
         return f'[FileUploader: {str(self._file_path.relative_to(self._root_path))}]'
 
-    def _prepare_dataset(self):
-        if self._context.dataset_uuid:
-            response, error = self._api.datasets.read(self._context.dataset_uuid)
-            if error:
-                raise UploadRemoteDatasetCheckError(str(error))
-            self._context.update_dataset(response)
+    def _check_dataset(self):
+        # Datasets are resolved once per walk, before the uploads start. See DatasetCache.
+        if not self._context.dataset_uuid:
+            raise UploadRemoteDatasetCheckError('Dataset has not been resolved before upload.')
 
-        elif self._context.dataset_name:
-            # Dataset UUID is empty, and CLI validators have already checked this dataset doesn't exist.
-            # Simply create dataset.
-            response, error = self._api.datasets.create({'name': self._context.dataset_name})
-            if error:
-                raise UploadRemoteDatasetCheckError(str(error))
-            self._context.update_dataset(response)
+    @property
+    def metrics(self) -> Optional[UploadMetrics]:
+        return self._metrics
+
+    def _on_bytes_sent(self, amount: int):
+        if self._metrics is not None:
+            self._metrics.add_bytes(amount)
+        if self._rate_limiter is not None:
+            self._rate_limiter.consume(amount)
+        if self._concurrency_limiter is not None:
+            self._concurrency_limiter.record_bytes(amount)
 
-        else:
-            raise UploadRemoteDatasetCheckError('No dataset specified.')
+    @property
+    def may_have_created_datafile(self) -> bool:
+        """Whether a request creating the datafile may have been processed, making a retry a possible duplicate.
+
+        See recover_datafile.
+        """
+        return self._create_sent
+
+    def _report_progress(self, amount: int, sent: bool = True):
+        if self._progress is not None:
+            self._progress.add_bytes(amount, sent=sent)
+            self._reported_bytes += amount
+
+    def roll_back_progress(self):
+        """Withdraw the bytes reported by this upload from the progress, once it has failed."""
+        if self._progress is not None:
+            self._progress.roll_back_bytes(self._reported_bytes)
+            self._reported_bytes = 0
+
+    def _on_body_read(self, amount: int):
+        # Called after each read of a body by the connection: throttling here throttles the transfer.
+        self._on_bytes_sent(amount)
+        self._report_progress(amount)
+
+    def _get_file_size(self) -> int:
+        return self._file_path.stat().st_size
 
     def _perform_upload(self):
         self._started = datetime.now()
-        file_size = self._file_path.stat().st_size
-        self._logger.info(f'{self.log_prefix} Starting upload to Arcsecond ({file_size} bytes)')
+        file_size = self._get_file_size()
+        self._logger.debug(f'{self.log_prefix} Starting upload to Arcsecond ({file_size} bytes)')
+
+        if self._concurrency_limiter is not None:
+            self._concurrency_limiter.acquire()
+        success = False
+        try:
+            # Resuming needs the size of what is sent to be known upfront: chunks are never compressed.
+            # Files are sent in a single request when the server does not support chunked uploads.
+            is_chunked = self._chunk_threshold is not None and file_size > self._chunk_threshold
+            if not (is_chunked and self._perform_chunked_upload(file_size)):
+                if self._codec is not None and is_compressible(self._file_path):
+                    self._perform_compressed_upload(file_size)
+                else:
+                    self._perform_single_request_upload(file_size)
+            success = True
+        finally:
+            if self._concurrency_limiter is not None:
+                self._concurrency_limiter.release(success)
+
+        ended = datetime.now()
+        duration = (ended - self._started).total_seconds()
+        self._logger.debug(f'{self.log_prefix} Uploaded finished in {duration} seconds.')
+
+    def _perform_single_request_upload(self, file_size: int):
+        # Tags being a list, they are sent as repeated fields. A dict would interpret them as a file tuple.
+        fields = [('dataset', self._context.dataset_uuid)]
+        fields += [('tags', tag) for tag in self._tags]
+
+        with MultipartFileBody(fields, self._file_path, callback=self._on_body_read) as body:
+            self._create_datafile(body, {'Content-Type': body.content_type}, self._file_path.name, file_size)
 
-        e = MultipartEncoder(
-            fields={'dataset': self._context.dataset_uuid,
-                    'file': (self._file_path.name, open(self._file_path, 'rb'))}
-        )
+    def _perform_compressed_upload(self, file_size: int):
+        # The compressed size is unknown until the end: the body is sent with chunked transfer encoding.
+        fields = [('dataset', self._context.dataset_uuid)]
+        fields += [('tags', tag) for tag in self._tags]
+        file_name = self._file_path.name + self._codec.extension
+        boundary = build_boundary()
 
-        def percent_printer(monitor):
-            bar_length = 40
-            self.__bytes_read = monitor.bytes_read
-            fraction = min(float(monitor.bytes_read) / float(file_size), 1.0)
-            hashes = '#' * int(round(fraction * bar_length))
-            spaces = ' ' * (bar_length - len(hashes))
-            print(f'[{hashes}{spaces}] {(fraction * 100):.1f}%', end='\r')
+        with CompressedFileStream(self._file_path, self._codec) as stream:
+            def body():
+                yield encode_multipart_preamble(boundary, fields, file_name)
+                raw_bytes_read = 0
+                for block in stream:
+                    self._on_bytes_sent(len(block))
+                    # Progress is measured on the raw file, whose size is the one known upfront.
+                    self._report_progress(stream.raw_bytes_read - raw_bytes_read)
+                    raw_bytes_read = stream.raw_bytes_read
+                    yield block
+                yield encode_multipart_epilogue(boundary)
 
-        m = MultipartEncoderMonitor(e, percent_printer)
+            self._create_datafile(body(), {'Content-Type': get_content_type(boundary)}, file_name)
 
-        self._datafile, error = self._api.datafiles.create(data=m, headers={"Content-Type": m.content_type})
+        ratio = file_size / stream.compressed_bytes if stream.compressed_bytes > 0 else 0
+        self._logger.debug(f'{self.log_prefix} Sent as {file_name} '
+                           f'({stream.compressed_bytes} bytes, ratio {ratio:.2f}).')
+
+    def _create_datafile(self, data, headers: dict, file_name: str, file_size: Optional[int] = None):
+        # A create is not idempotent: once its request may have reached the server, the datafile is looked up
+        # before retrying (see recover_datafile).
+        self._create_sent = True
+        self._created_file = (file_name, file_size)
+        try:
+            self._datafile, error = self._api.datafiles.create(data=data, headers=headers)
+            if error:
+                self._status = [Status.ERROR, Substatus.ERROR, None]
+                raise UploadRemoteFileCheckError(str(error), getattr(error, 'status_code', None))
+        except (UploadRemoteFileCheckError, RequestException) as error:
+            self._create_sent = not is_unprocessed(error)
+            raise
+
+    def _open_chunked_upload(self, file_size: int, file_mtime: float) -> Optional[dict]:
+        """Open a chunked upload, or resume an interrupted one. Return None if the server has no chunked uploads."""
+        api_server = self._context.config.api_server
+        if api_server in _servers_without_chunked_uploads:
+            return None
+
+        # Resume a previous, interrupted upload of the very same file, if any.
+        upload_uuid = None
+        if self._ledger is not None:
+            upload_uuid = self._ledger.read_chunked_upload(self._root_path,
+                                                           self._context.dataset_uuid,
+                                                           self._file_path,
+                                                           file_size,
+                                                           file_mtime)
+        if upload_uuid:
+            upload, error = self._api.datafile_uploads.read(upload_uuid)
+            if not error:
+                self._logger.info(f'{self.log_prefix} Resuming upload at offset {upload.get("offset", 0)}.')
+                return upload
+            self._logger.info(f'{self.log_prefix} Previous upload cannot be resumed ({str(error)}). Restarting.')
+
+        payload = {'dataset': self._context.dataset_uuid, 'file_name': self._file_path.name, 'size': file_size}
+        upload, error = self._api.datafile_uploads.create(json=payload)
+        if error and getattr(error, 'status_code', None) in CHUNKED_UPLOAD_UNSUPPORTED_STATUS_CODES:
+            self._logger.warning(f'{self.log_prefix} {api_server} does not support chunked uploads. '
+                                 f'Files are uploaded in single requests.')
+            _servers_without_chunked_uploads.add(api_server)
+            return None
+        if error:
+            raise UploadRemoteFileCheckError(str(error), getattr(error, 'status_code', None))
+
+        if self._ledger is not None:
+            self._ledger.save_chunked_upload(self._root_path,
+                                             self._context.dataset_uuid,
+                                             self._file_path,
+                                             file_size,
+                                             file_mtime,
+                                             upload.get('uuid'))
+        return upload
+
+    def _perform_chunked_upload(self, file_size: int) -> bool:
+        # Chunk protocol (experimental, server-dependent): an upload is opened with a POST to
+        # datafiles/uploads/, each chunk is sent with a PATCH carrying a Content-Range header, and the
+        # server acknowledges the new offset. A final PATCH with {'completed': True} closes the upload
+        # and returns the datafile. Return False if the server does not support it.
+        file_mtime = self._file_path.stat().st_mtime
+        upload = self._open_chunked_upload(file_size, file_mtime)
+        if upload is None:
+            return False
+        upload_uuid = upload.get('uuid')
+        offset = int(upload.get('offset', 0))
+        # Bytes received before are done, but not sent by this attempt (those of a failed attempt were rolled back).
+        self._report_progress(offset, sent=False)
+
+        while offset < file_size:
+            chunk_length = min(self._chunk_size, file_size - offset)
+            headers = {'Content-Type': 'application/octet-stream',
+                       'Content-Range': f'bytes {offset}-{offset + chunk_length - 1}/{file_size}'}
+            with FileRangeBody(self._file_path, offset, chunk_length, callback=self._on_body_read) as data:
+                response, error = self._api.datafile_uploads.update(upload_uuid, data=data, headers=headers)
+            if error:
+                self._status = [Status.ERROR, Substatus.ERROR, None]
+                raise UploadRemoteFileCheckError(str(error), getattr(error, 'status_code', None))
+            # The server is the authority on what has been received.
+            offset = int(response.get('offset', offset + chunk_length))
+
+        payload = {'completed': True, 'tags': self._tags}
+        self._datafile, error = self._api.datafile_uploads.update(upload_uuid, json=payload)
         if error:
             self._status = [Status.ERROR, Substatus.ERROR, None]
-            raise UploadRemoteFileCheckError(str(error))
+            raise UploadRemoteFileCheckError(str(error), getattr(error, 'status_code', None))
 
-        ended = datetime.now()
-        duration = (ended - self._started).total_seconds()
-        self._logger.info(f'{self.log_prefix} Uploaded finished in {duration} seconds.')
+        if self._ledger is not None:
+            self._ledger.delete_chunked_upload(self._root_path, self._context.dataset_uuid, self._file_path)
+        return True
 
     def _update_tags(self):
-        tag_root = f'oort|root|{str(self._root_path)}'
-        tag_origin = f'oort|origin|{socket.gethostname()}'
-        tag_uploader = f'oort|uploader|{self._context.config.username}'
-        tag_oort = f'oort|version|{__version__}'
-
-        # Tags being a list, they cannot be part of the MultipartEncoder.fields because they will
-        # be interpreted as a file field tuple/list.
-        tags = [tag_root, tag_origin, tag_uploader, tag_oort]
-        response, error = self._api.datafiles.update(self._datafile.get('pk'), json={'tags': tags})
+        if has_tags(self._datafile, self._tags):
+            return
+
+        if self._tag_batcher is not None:
+            self._tag_batcher.defer(self._datafile.get('pk'), self._tags)
+            return
+
+        with time_phase(self._metrics, 'tagging'):
+            response, error = self._api.datafiles.update(self._datafile.get('pk'), json={'tags': self._tags})
         if error:
             self._status = [Status.ERROR, Substatus.ERROR, None]
-            raise UploadRemoteFileCheckError(str(error))
+            raise UploadRemoteFileCheckError(str(error), getattr(error, 'status_code', None))
+
+    def _find_created_datafile(self) -> Optional[dict]:
+        file_name, file_size = self._created_file
+        datafiles, error = self._api.datafiles.list(dataset=self._context.dataset_uuid, file_name=file_name)
+        if error:
+            raise UploadRemoteFileCheckError(str(error), getattr(error, 'status_code', None))
+        if isinstance(datafiles, dict):
+            # Paginated response.
+            datafiles = datafiles.get('results', [])
+        # A file of the same name, but of another size, is another file (e.g. from another folder).
+        matches = [d for d in datafiles or [] if file_size is None or d.get('size') in (None, file_size)]
+        return matches[-1] if len(matches) > 0 else None
+
+    def recover_datafile(self) -> Optional[list]:
+        """Once the upload has failed after its datafile may have been created, look the datafile up.
+
+        Return the status of the upload if the datafile exists (and its tags are updated), or None if it does
+        not, in which case the upload can safely be retried.
+        """
+        if self._datafile is None:
+            self._datafile = self._find_created_datafile()
+            if self._datafile is None:
+                self._create_sent = False
+                return None
+
+        self._status = [Status.FINISHING, Substatus.TAGGING, None]
+        self._update_tags()
+        self._status = [Status.OK, Substatus.DONE, None]
+        return self._status
 
     def upload_file(self):
         self._status = [Status.PREPARING, Substatus.CHECKING, None]
-        self._logger.info(f'{self.log_prefix} Preparing Dataset...')
-        self._prepare_dataset()
-        self._logger.info(f'{self.log_prefix} Dataset preparation done.')
+        self._check_dataset()
 
         self._status = [Status.UPLOADING, Substatus.UPLOADING, None]
-        self._logger.info(f'{self.log_prefix} Opening upload sequence.')
-        self._perform_upload()
-        self._logger.info(f'{self.log_prefix} Closing upload sequence.')
+        self._logger.debug(f'{self.log_prefix} Opening upload sequence.')
+        with time_phase(self._metrics, 'uploading'):
+            self._perform_upload()
+        self._logger.debug(f'{self.log_prefix} Closing upload sequence.')
 
         self._status = [Status.FINISHING, Substatus.TAGGING, None]
-        self._logger.info(f'{self.log_prefix} Updating file tags....')
+        self._logger.debug(f'{self.log_prefix} Updating file tags....')
         self._update_tags()
 
         self._status = [Status.OK, Substatus.DONE, None]
@@ -1,62 +1,296 @@
+import contextlib
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+from typing import Optional
 
-import click
+from requests import RequestException
 
-from oort.common.constants import Status
+from oort.common.constants import Status, Substatus
 from oort.common.context import Context
+from oort.common.errors import OortCloudError
 from oort.common.logger import get_oort_logger
-from oort.common.utils import is_file_hidden
+from .bundles import Bundle, BundleUploader, Bundler, get_item_paths
+from .datasets import DatasetCache
+from .errors import UploadRemoteDatasetCheckError
+from .filters import PathFilter
+from .hasher import BackgroundHasher
+from .headers import HeaderCache, read_headers, split_undated_files
+from .ledger import UploadLedger
+from .metrics import UploadMetrics, time_phase
+from .progress import ProgressRenderer, ThroughputHistory
+from .retry import RetryPolicy, is_retryable, is_unprocessed
+from .scanner import Manifest, ScannedFile, build_manifest, get_root_path
+from .scheduling import DEFAULT_SCHEDULING_POLICY, schedule
+from .tags import TagBatcher, build_walk_tags
 from .uploader import FileUploader
 
 logger = get_oort_logger('walker')
 
 
-def __walk_first_pass(context: Context, root_path: Path):
+def __walk_first_pass(context: Context,
+                      root_path: Path,
+                      manifest: Optional[Manifest] = None,
+                      ledger: Optional[UploadLedger] = None,
+                      force: bool = False,
+                      digest_algorithm: Optional[str] = None,
+                      path_filter: Optional[PathFilter] = None,
+                      read_headers: bool = False,
+                      skip_undated: bool = False,
+                      header_cache: Optional[HeaderCache] = None):
     log_prefix = '[Walker - 1/2]'
     logger.info(f"{log_prefix} Making a first pass to collect info on files...")
     if context.config.api_name != 'dev':
         # For user experience, and let him/her read the above message.
         time.sleep(3)
 
-    total_file_count = sum(1 for f in root_path.glob('**/*') if f.is_file() and not is_file_hidden(f))
+    # The manifest is usually already built for the command summary. No need to scan the tree again.
+    if manifest is None:
+        manifest = build_manifest(root_path, path_filter)
 
-    index = 0
-    file_paths = []
-    for file_path in root_path.glob('**/*'):
-        # Skipping both hidden files and hidden directories.
-        if is_file_hidden(file_path) or not file_path.is_file():
-            continue
+    scanned_files = list(manifest)
+    if ledger is not None and not force:
+        # Files whose modification time alone has changed are hashed now: their digests tell whether to upload them.
+        scanned_files, synced_files = ledger.split_synced_files(root_path, context.dataset_uuid, scanned_files,
+                                                                digest_algorithm=digest_algorithm)
+        if len(synced_files) > 0:
+            logger.info(f"{log_prefix} Skipping {len(synced_files)} files {Substatus.ALREADY_SYNCED.value}.")
 
-        index += 1
-        click.echo(f"\n{log_prefix} File {index} / {total_file_count} ({index / total_file_count * 100:.2f}%)")
-        file_paths.append(file_path)
+    if read_headers or skip_undated:
+        logger.info(f"{log_prefix} Reading headers of {len(scanned_files)} files...")
+        scanned_files = __read_file_headers(scanned_files, skip_undated, header_cache, log_prefix)
 
-    logger.info(f"{log_prefix} Finished collecting file info inside folder {str(root_path)}.")
-    return file_paths
+    logger.info(f"{log_prefix} Finished collecting file info inside folder {str(root_path)} ({len(manifest)} files).")
+    return scanned_files
 
 
-def __walk_second_pass(context: Context, root_path: Path, file_paths: list):
+def __read_file_headers(scanned_files: list,
+                        skip_undated: bool,
+                        header_cache: Optional[HeaderCache],
+                        log_prefix: str) -> list:
+    read_headers(scanned_files, cache=header_cache)
+    if skip_undated:
+        scanned_files, undated_files = split_undated_files(scanned_files)
+        if len(undated_files) > 0:
+            logger.info(f"{log_prefix} Skipping {len(undated_files)} files {Substatus.SKIPPED_NO_DATE_OBS.value}.")
+    return scanned_files
+
+
+def resolve_dataset(context: Context,
+                    dataset_cache: DatasetCache,
+                    metrics: Optional[UploadMetrics] = None,
+                    retry_policy: Optional[RetryPolicy] = None):
+    """Read (or create) the dataset of the context, retrying transient failures.
+
+    Raise UploadRemoteDatasetCheckError once it cannot be resolved.
+    """
+    log_prefix = '[Walker]'
+    logger.info(f"{log_prefix} Preparing Dataset...")
+    attempt = 0
+    while True:
+        try:
+            with time_phase(metrics, 'checking'):
+                dataset = dataset_cache.resolve(context, context.api)
+            break
+        except (UploadRemoteDatasetCheckError, RequestException) as error:
+            # Creating a dataset is not idempotent: it is only retried if surely not processed.
+            retryable = is_retryable(error) and (bool(context.dataset_uuid) or is_unprocessed(error))
+            if retryable and retry_policy is not None and retry_policy.acquire_retry(attempt):
+                delay = retry_policy.get_backoff_delay(attempt)
+                logger.warning(f'{log_prefix} Dataset preparation failed: {str(error)}. Retrying in {delay:.1f}s...')
+                time.sleep(delay)
+                attempt += 1
+                continue
+            if isinstance(error, UploadRemoteDatasetCheckError):
+                raise
+            raise UploadRemoteDatasetCheckError(str(error)) from error
+    logger.info(f"{log_prefix} Dataset preparation done ({dataset.get('name')}, {dataset.get('uuid')}).")
+
+
+def __recover_datafile(uploader: FileUploader) -> tuple:
+    """Look up the datafile whose creation failed on our side, but may have been processed by the server.
+
+    Return (status, retryable): the status of the upload if the datafile exists, and whether the upload
+    can be retried, which is only the case once sure the datafile does not exist.
+    """
+    try:
+        status = uploader.recover_datafile()
+    except (OortCloudError, RequestException) as error:
+        logger.warning(f'{uploader.log_prefix} Not retrying, unable to tell whether the datafile was created: '
+                       f'{str(error)}')
+        return None, False
+    if status is not None:
+        logger.info(f'{uploader.log_prefix} The datafile was created despite the error.')
+    return status, status is None
+
+
+def upload_scanned_file(context: Context,
+                        root_path: Path,
+                        scanned_file: ScannedFile,
+                        ledger: Optional[UploadLedger] = None,
+                        uploader_options: Optional[dict] = None,
+                        retry_policy: Optional[RetryPolicy] = None,
+                        hasher: Optional[BackgroundHasher] = None):
+    """Upload a file (or a bundle of files), retrying transient failures.
+
+    With a hasher the files have been submitted to, their digests are waited for once uploaded, for the
+    ledger to record them.
+
+    Return (status, substatus, error, retryable), where retryable tells whether a failed upload
+    could succeed later (its retries or the retry budget being exhausted). Once the request creating
+    the datafile may have been processed by the server, the upload is only retried if no datafile of
+    the same name is found in the dataset.
+    """
+    metrics = (uploader_options or {}).get('metrics')
+    attempt = 0
+    recovered_status = None
+    while True:
+        if isinstance(scanned_file, Bundle):
+            uploader = BundleUploader(context, root_path, scanned_file, ledger=ledger, **(uploader_options or {}))
+        else:
+            uploader = FileUploader(context,
+                                    root_path,
+                                    scanned_file.path,
+                                    ledger=ledger,
+                                    metadata=scanned_file.metadata,
+                                    **(uploader_options or {}))
+        try:
+            status, substatus, error = uploader.upload_file()
+            break
+        except (OortCloudError, RequestException, OSError) as error:
+            # One failing file must not abort the whole walk, nor the other uploads running alongside.
+            retryable = is_retryable(error)
+            if retryable and uploader.may_have_created_datafile:
+                # Sending the file again could create a duplicate datafile: only once sure it does not exist.
+                recovered_status, retryable = __recover_datafile(uploader)
+                if recovered_status is not None:
+                    break
+            # A retry, a requeue or the failure of the file: either way, the bytes of this attempt are not done.
+            uploader.roll_back_progress()
+            if metrics is not None:
+                metrics.count_error(retryable)
+            if retryable and retry_policy is not None and retry_policy.acquire_retry(attempt):
+                delay = retry_policy.get_backoff_delay(attempt)
+                logger.warning(f'{uploader.log_prefix} Upload failed: {str(error)}. Retrying in {delay:.1f}s...')
+                if metrics is not None:
+                    metrics.count_retry()
+                time.sleep(delay)
+                attempt += 1
+                continue
+            logger.error(f'{uploader.log_prefix} Upload failed: {str(error)}')
+            return Status.ERROR, Substatus.ERROR, str(error), retryable
+
+    if recovered_status is not None:
+        status, substatus, error = recovered_status
+    if status == Status.OK and ledger is not None:
+        if hasher is not None:
+            hasher.wait(scanned_file)
+        datafile_pk = uploader.datafile.get('pk') if uploader.datafile else None
+        if isinstance(scanned_file, Bundle):
+            ledger.record_bundle(root_path, context.dataset_uuid, scanned_file.name, scanned_file.files, datafile_pk)
+        else:
+            ledger.record(root_path, context.dataset_uuid, scanned_file, datafile_pk)
+
+    return status, substatus, error, False
+
+
+def update_deferred_tags(context: Context,
+                         root_path: Path,
+                         tag_batcher: TagBatcher,
+                         ledger: Optional[UploadLedger],
+                         success_uploads: list,
+                         failed_uploads: list,
+                         metrics: Optional[UploadMetrics] = None):
+    """Update the tags deferred during a walk, and move the files whose datafiles are left untagged from
+    success_uploads to failed_uploads (in place).
+
+    Their files are already recorded as synced in the ledger, which also records them as untagged:
+    the next walk updates their tags, without uploading them again.
+    """
+    with time_phase(metrics, 'tagging'):
+        failed_pks = tag_batcher.flush(ledger, root_path, context.dataset_uuid)
+    if len(failed_pks) == 0 or ledger is None:
+        return
+
+    untagged_paths = ledger.read_datafile_paths(root_path, context.dataset_uuid, failed_pks)
+    untagged_path_set = set(untagged_paths)
+    success_uploads[:] = [path for path in success_uploads if path not in untagged_path_set]
+    failed_uploads.extend((path, Substatus.ERROR, 'Unable to update the tags of its datafile.')
+                          for path in untagged_paths)
+
+
+def __walk_second_pass(context: Context,
+                       root_path: Path,
+                       scanned_files: list,
+                       jobs: int = 1,
+                       ledger: Optional[UploadLedger] = None,
+                       uploader_options: Optional[dict] = None,
+                       retry_policy: Optional[RetryPolicy] = None,
+                       digest_algorithm: Optional[str] = None,
+                       requeue_rounds: int = 1,
+                       throughput_history: Optional[ThroughputHistory] = None):
     log_prefix = '[Walker - 2/2]'
-    logger.info(f"{log_prefix} Starting second pass to upload files...")
+    logger.info(f"{log_prefix} Starting second pass to upload files ({jobs} at a time)...")
     if context.config.api_name != 'dev':
         time.sleep(3)
 
     failed_uploads = []
     success_uploads = []
-    total_file_count = len(file_paths)
 
-    index = 0
-    for file_path in file_paths:
-        index += 1
-        click.echo(f"\n{log_prefix} File {index} / {total_file_count} ({index / total_file_count * 100:.2f}%)\n")
+    # One progress line for all the uploads, whatever their number and concurrency.
+    progress = ProgressRenderer(total_files=len(scanned_files),
+                                total_bytes=sum(scanned_file.size for scanned_file in scanned_files),
+                                history=throughput_history)
+    uploader_options = dict(uploader_options or {}, progress=progress)
+    metrics = uploader_options.get('metrics')
 
-        uploader = FileUploader(context, root_path, file_path, display_progress=True)
-        status, substatus, error = uploader.upload_file()
-        if status == Status.OK:
-            success_uploads.append(str(file_path))
-        else:
-            failed_uploads.append((str(file_path), substatus, error))
+    # Files are hashed by a pool of processes in upload order, while the first ones are uploaded.
+    hasher = BackgroundHasher(digest_algorithm) if digest_algorithm is not None else None
+    with hasher or contextlib.nullcontext():
+        if hasher is not None:
+            hasher.submit(scanned_files)
+
+        pending_files = scanned_files
+        for round_index in range(1 + requeue_rounds):
+            if round_index > 0:
+                # Files that failed for transient reasons get another chance once all the others are done.
+                logger.info(f"{log_prefix} Requeuing {len(pending_files)} files that failed with transient errors...")
+
+            requeued_files = []
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                futures = {}
+                for scanned_file in pending_files:
+                    future = executor.submit(upload_scanned_file,
+                                             context,
+                                             root_path,
+                                             scanned_file,
+                                             ledger,
+                                             uploader_options,
+                                             retry_policy,
+                                             hasher)
+                    futures[future] = scanned_file
+
+                for future in as_completed(futures):
+                    scanned_file = futures[future]
+                    status, substatus, error, retryable = future.result()
+
+                    if status == Status.OK:
+                        success_uploads.extend(get_item_paths(scanned_file))
+                    elif retryable and round_index < requeue_rounds:
+                        requeued_files.append(scanned_file)
+                        continue
+                    else:
+                        failed_uploads.extend((path, substatus, error) for path in get_item_paths(scanned_file))
+
+                    progress.finish_file(success=status == Status.OK)
+                    if metrics is not None:
+                        metrics.count_file(success=status == Status.OK)
+
+            pending_files = requeued_files
+            if len(pending_files) == 0:
+                break
+
+    progress.close()
 
     msg = f"{log_prefix}\n\nFinished upload walk inside folder {root_path} "
     logger.info(msg)
@@ -64,17 +298,73 @@ def __walk_second_pass(context: Context, root_path: Path, file_paths: list):
     return success_uploads, failed_uploads
 
 
-def walk(context: Context, folder_string: str):
+def walk(context: Context,
+         folder_string: str,
+         jobs: int = 1,
+         manifest: Optional[Manifest] = None,
+         ledger: Optional[UploadLedger] = None,
+         force: bool = False,
+         digest_algorithm: Optional[str] = None,
+         dataset_cache: Optional[DatasetCache] = None,
+         uploader_options: Optional[dict] = None,
+         retry_policy: Optional[RetryPolicy] = None,
+         path_filter: Optional[PathFilter] = None,
+         read_headers: bool = False,
+         skip_undated: bool = False,
+         header_cache: Optional[HeaderCache] = None,
+         bundler: Optional[Bundler] = None,
+         scheduling_policy: str = DEFAULT_SCHEDULING_POLICY,
+         throughput_history: Optional[ThroughputHistory] = None):
     log_prefix = '[Walker]'
-    root_path = Path(folder_string).resolve()
-    if root_path.is_file():  # Just in case we pass a file...
-        root_path = root_path.parent
+    root_path = get_root_path(folder_string)
 
     logger.info(f"{log_prefix} Starting upload walk through {root_path} and its subfolders...")
 
-    file_paths = __walk_first_pass(context, root_path)
-    if len(file_paths) > 0:
-        success_uploads, failed_uploads = __walk_second_pass(context, root_path, file_paths)
+    success_uploads, failed_uploads = [], []
+    scanned_files = __walk_first_pass(context,
+                                      root_path,
+                                      manifest,
+                                      ledger=ledger,
+                                      force=force,
+                                      digest_algorithm=digest_algorithm,
+                                      path_filter=path_filter,
+                                      read_headers=read_headers,
+                                      skip_undated=skip_undated,
+                                      header_cache=header_cache)
+    if len(scanned_files) > 0:
+        retry_policy = retry_policy or RetryPolicy()
+        try:
+            resolve_dataset(context, dataset_cache or DatasetCache(), (uploader_options or {}).get('metrics'),
+                            retry_policy)
+        except UploadRemoteDatasetCheckError as error:
+            logger.error(f"{log_prefix} Unable to resolve the dataset: {str(error)}")
+            return [], [(str(scanned_file.path), Substatus.ERROR, str(error)) for scanned_file in scanned_files]
+
+        if bundler is not None:
+            # Small files are sent as tar bundles, saving the per-request overhead that dominates their upload.
+            bundles, scanned_files = bundler.plan(root_path, scanned_files)
+            if len(bundles) > 0:
+                logger.info(f"{log_prefix} Bundling {sum(len(b) for b in bundles)} small files "
+                            f"into {len(bundles)} archives.")
+            scanned_files = bundles + scanned_files
+
+        # Uploads start in the order of the list: the executor queue is first in, first out.
+        scanned_files = schedule(scanned_files, scheduling_policy)
+
+        # Tags are the same for every file of the walk. Those not applied at upload are updated in batches.
+        tag_batcher = TagBatcher(context.api, build_walk_tags(context, root_path))
+        uploader_options = dict(uploader_options or {}, tags=tag_batcher.tags, tag_batcher=tag_batcher)
+        success_uploads, failed_uploads = __walk_second_pass(context,
+                                                             root_path,
+                                                             scanned_files,
+                                                             jobs=jobs,
+                                                             ledger=ledger,
+                                                             uploader_options=uploader_options,
+                                                             retry_policy=retry_policy,
+                                                             digest_algorithm=digest_algorithm,
+                                                             throughput_history=throughput_history)
+        update_deferred_tags(context, root_path, tag_batcher, ledger, success_uploads, failed_uploads,
+                             uploader_options.get('metrics'))
         msg = f"{log_prefix} {len(success_uploads)} successful uploads and {len(failed_uploads)} failed.\n\n"
         logger.info(msg)
 
@@ -86,6 +376,8 @@ def walk(context: Context, folder_string: str):
         msg = f"{log_prefix} No new file paths to upload.\n\n"
         logger.info(msg)
 
+    return success_uploads, failed_uploads
+
 # if __name__ == '__main__':
 #     root_path = sys.argv[1]
 #     username, upload_key, subdomain, role, telescope, debug_str = sys.argv[2].split(",")
@@ -0,0 +1,338 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+from oort.common.constants import DEFAULT_POLL_INTERVAL, DEFAULT_SETTLE_DELAY, Status
+from oort.common.context import Context
+from oort.common.logger import get_oort_logger
+from .datasets import DatasetCache
+from .errors import UploadRemoteDatasetCheckError
+from .filters import PathFilter
+from .ledger import UploadLedger
+from .retry import RetryPolicy
+from .scanner import ScannedFile, get_root_path, is_hidden, scan_folder
+from .tags import TagBatcher, build_walk_tags
+from .walker import resolve_dataset, update_deferred_tags, upload_scanned_file
+
+logger = get_oort_logger('watcher')
+
+# See inotify(7).
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+INOTIFY_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+INOTIFY_EVENT_STRUCT = struct.Struct('iIII')
+
+TAGS_FLUSH_INTERVAL = 30.0
+# Events are waited for at least this long, even with a zero settle delay, so that watching never busy-loops.
+MIN_EVENTS_TIMEOUT = 0.05
+
+
+def is_inotify_available() -> bool:
+    if not sys.platform.startswith('linux'):
+        return False
+    libc_name = ctypes.util.find_library('c')
+    return libc_name is not None and hasattr(ctypes.CDLL(libc_name), 'inotify_init1')
+
+
+class InotifyEventSource(object):
+    """Report the files written below a root folder, using Linux inotify (through ctypes)."""
+
+    def __init__(self, root_path: Path, path_filter: Optional[PathFilter] = None):
+        self._root_path = root_path
+        self._path_filter = path_filter or PathFilter()
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._watched_dir_paths = {}
+        self._add_watches(root_path)
+
+    def _add_watch(self, dir_path: Path):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(str(dir_path)), INOTIFY_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f'inotify_add_watch failed on {str(dir_path)}')
+        self._watched_dir_paths[wd] = dir_path
+
+    def _add_watches(self, dir_path: Path):
+        # Hidden and excluded folders are pruned, as when scanning. A folder removed (or unreadable)
+        # before it could be watched is skipped: only the root folder must be watched.
+        try:
+            self._add_watch(dir_path)
+            subdir_paths = []
+            with os.scandir(dir_path) as entries:
+                for entry in entries:
+                    if is_hidden(entry.name) or not entry.is_dir(follow_symlinks=False):
+                        continue
+                    relative_path = Path(entry.path).relative_to(self._root_path).as_posix()
+                    if self._path_filter.accepts_dir(relative_path, entry.name):
+                        subdir_paths.append(Path(entry.path))
+        except (FileNotFoundError, PermissionError) as error:
+            if dir_path == self._root_path:
+                raise
+            logger.warning(f'[Watcher] Unable to watch {str(dir_path)}: {str(error)}')
+            return
+
+        for subdir_path in subdir_paths:
+            self._add_watches(subdir_path)
+
+    def read_changed_paths(self, timeout: float) -> list:
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+
+        try:
+            buffer = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        changed_paths = []
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _, name_length = INOTIFY_EVENT_STRUCT.unpack_from(buffer, offset)
+            offset += INOTIFY_EVENT_STRUCT.size
+            name = os.fsdecode(buffer[offset:offset + name_length].rstrip(b'\0'))
+            offset += name_length
+
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost. Fall back to looking at every file.
+                logger.warning('[Watcher] inotify queue overflow. Rescanning the whole folder.')
+                changed_paths.extend(f.path for f in scan_folder(self._root_path, self._path_filter))
+                continue
+
+            dir_path = self._watched_dir_paths.get(wd)
+            if dir_path is None or not name or is_hidden(name):
+                continue
+
+            path = dir_path / name
+            if mask & IN_ISDIR:
+                relative_path = path.relative_to(self._root_path).as_posix()
+                if mask & (IN_CREATE | IN_MOVED_TO) and self._path_filter.accepts_path(relative_path, is_dir=True):
+                    # Files may have been written in the new folder before it is watched.
+                    self._add_watches(path)
+                    changed_paths.extend(scanned_file.path for scanned_file in scan_folder(path))
+            else:
+                changed_paths.append(path)
+
+        return changed_paths
+
+    def close(self):
+        os.close(self._fd)
+
+
+class PollingEventSource(object):
+    """Report the files written below a root folder, by comparing successive scans."""
+
+    def __init__(self,
+                 root_path: Path,
+                 interval: float = DEFAULT_POLL_INTERVAL,
+                 path_filter: Optional[PathFilter] = None):
+        self._root_path = root_path
+        self._interval = interval
+        self._path_filter = path_filter
+        self._snapshot = {f.path: (f.size, f.mtime) for f in scan_folder(root_path, path_filter)}
+        self._next_scan = time.monotonic() + interval
+
+    def read_changed_paths(self, timeout: float) -> list:
+        time.sleep(max(0.0, min(timeout, self._next_scan - time.monotonic())))
+        if time.monotonic() < self._next_scan:
+            return []
+
+        self._next_scan = time.monotonic() + self._interval
+        snapshot = {f.path: (f.size, f.mtime) for f in scan_folder(self._root_path, self._path_filter)}
+        changed_paths = [path for path, stat in snapshot.items() if self._snapshot.get(path) != stat]
+        self._snapshot = snapshot
+        return changed_paths
+
+    def close(self):
+        pass
+
+
+class FolderWatcher(object):
+    """Upload the files of a folder incrementally, as soon as they have been written.
+
+    A file is uploaded once it has not changed for `settle_delay` seconds, so that files still
+    being written by the camera are left alone. Files already recorded in the ledger are skipped.
+    The cost of each new frame does not depend on the size of the watched tree.
+    """
+
+    def __init__(self,
+                 context: Context,
+                 root_path: Path,
+                 ledger: UploadLedger,
+                 jobs: int = 1,
+                 settle_delay: float = DEFAULT_SETTLE_DELAY,
+                 use_polling: bool = False,
+                 poll_interval: float = DEFAULT_POLL_INTERVAL,
+                 dataset_cache: Optional[DatasetCache] = None,
+                 uploader_options: Optional[dict] = None,
+                 retry_policy: Optional[RetryPolicy] = None,
+                 path_filter: Optional[PathFilter] = None):
+        self._context = context
+        self._root_path = root_path
+        self._ledger = ledger
+        self._jobs = jobs
+        self._settle_delay = settle_delay
+        self._use_polling = use_polling or not is_inotify_available()
+        self._poll_interval = poll_interval
+        self._dataset_cache = dataset_cache or DatasetCache()
+        self._uploader_options = uploader_options or {}
+        # Files failing despite retries are not requeued: they are uploaded again when they change,
+        # or when the watch is restarted.
+        self._retry_policy = retry_policy or RetryPolicy()
+        self._path_filter = path_filter or PathFilter()
+        self._stop_event = threading.Event()
+
+        # Path -> monotonic time of the last change seen.
+        self._unsettled_paths = {}
+        self._uploading_paths = set()
+        self._uploading_lock = threading.Lock()
+
+        self.success_uploads = []
+        self.failed_uploads = []
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _build_event_source(self):
+        if not self._use_polling:
+            try:
+                return InotifyEventSource(self._root_path, self._path_filter)
+            except OSError as error:
+                logger.warning(f'[Watcher] inotify unavailable ({str(error)}). Falling back to polling.')
+        return PollingEventSource(self._root_path, self._poll_interval, self._path_filter)
+
+    def _is_accepted(self, path: Path) -> bool:
+        relative_path = path.relative_to(self._root_path).as_posix()
+        return not is_hidden(relative_path) and self._path_filter.accepts_path(relative_path)
+
+    def _pop_settled_paths(self) -> list:
+        now = time.monotonic()
+        settled_paths = [p for p, changed in self._unsettled_paths.items() if now - changed >= self._settle_delay]
+        for path in settled_paths:
+            del self._unsettled_paths[path]
+        return settled_paths
+
+    def _upload(self, scanned_file: ScannedFile):
+        try:
+            status, substatus, error, _ = upload_scanned_file(self._context,
+                                                              self._root_path,
+                                                              scanned_file,
+                                                              self._ledger,
+                                                              self._uploader_options,
+                                                              self._retry_policy)
+            if status == Status.OK:
+                self.success_uploads.append(str(scanned_file.path))
+            else:
+                self.failed_uploads.append((str(scanned_file.path), substatus, error))
+        finally:
+            with self._uploading_lock:
+                self._uploading_paths.discard(scanned_file.path)
+
+    def _submit_uploads(self, executor: ThreadPoolExecutor, paths: list):
+        scanned_files = []
+        for path in paths:
+            try:
+                stat = path.stat()
+            except OSError:
+                continue  # Deleted or moved away in the meantime.
+            scanned_files.append(ScannedFile(path, stat.st_size, stat.st_mtime))
+
+        # Only the settled files are looked up in the ledger, whatever the number of files already uploaded.
+        dataset_uuid = self._context.dataset_uuid
+        relative_paths = [str(f.path.relative_to(self._root_path)) for f in scanned_files]
+        synced_files = self._ledger.read_synced_files(self._root_path, dataset_uuid, relative_paths)
+        pending_files, _ = self._ledger.split_synced_files(self._root_path, dataset_uuid, scanned_files, synced_files)
+        for scanned_file in pending_files:
+            with self._uploading_lock:
+                if scanned_file.path in self._uploading_paths:
+                    # Changed again while uploading. It will be seen again once settled.
+                    self._unsettled_paths[scanned_file.path] = time.monotonic()
+                    continue
+                self._uploading_paths.add(scanned_file.path)
+            logger.info(f'[Watcher] Uploading {str(scanned_file.path.relative_to(self._root_path))}...')
+            executor.submit(self._upload, scanned_file)
+
+    def _update_deferred_tags(self, tag_batcher: TagBatcher):
+        update_deferred_tags(self._context, self._root_path, tag_batcher, self._ledger,
+                             self.success_uploads, self.failed_uploads, self._uploader_options.get('metrics'))
+
+    def run(self):
+        log_prefix = '[Watcher]'
+        resolve_dataset(self._context, self._dataset_cache, self._uploader_options.get('metrics'), self._retry_policy)
+        tag_batcher = TagBatcher(self._context.api, build_walk_tags(self._context, self._root_path))
+        self._uploader_options = dict(self._uploader_options,
+                                      tags=tag_batcher.tags,
+                                      tag_batcher=tag_batcher)
+
+        event_source = self._build_event_source()
+        if isinstance(event_source, PollingEventSource):
+            # Polling cannot see a file being closed. Make sure it is seen unchanged by one more scan.
+            self._settle_delay = max(self._settle_delay, 1.5 * self._poll_interval)
+        logger.info(f'{log_prefix} Watching {str(self._root_path)} ({type(event_source).__name__})...')
+
+        events_timeout = max(MIN_EVENTS_TIMEOUT, min(1.0, self._settle_delay))
+        next_tags_flush = time.monotonic() + TAGS_FLUSH_INTERVAL
+        with ThreadPoolExecutor(max_workers=self._jobs) as executor:
+            # Catch up with the files written while Oort was not watching. They may still be being written:
+            # they settle like the others, the changes seen meanwhile postponing their upload.
+            now = time.monotonic()
+            for scanned_file in scan_folder(self._root_path, self._path_filter):
+                self._unsettled_paths[scanned_file.path] = now
+            try:
+                while not self._stop_event.is_set():
+                    now = time.monotonic()
+                    for path in event_source.read_changed_paths(timeout=events_timeout):
+                        if self._is_accepted(path):
+                            self._unsettled_paths[path] = now
+                    self._submit_uploads(executor, self._pop_settled_paths())
+
+                    if time.monotonic() > next_tags_flush:
+                        self._update_deferred_tags(tag_batcher)
+                        next_tags_flush = time.monotonic() + TAGS_FLUSH_INTERVAL
+            except KeyboardInterrupt:
+                logger.info(f'{log_prefix} Interrupted. Waiting for the current uploads to finish...')
+                executor.shutdown(wait=True, cancel_futures=True)
+            finally:
+                event_source.close()
+
+        self._update_deferred_tags(tag_batcher)
+        logger.info(f'{log_prefix} {len(self.success_uploads)} successful uploads '
+                    f'and {len(self.failed_uploads)} failed.')
+        return self.success_uploads, self.failed_uploads
+
+
+def watch(context: Context,
+          folder_string: str,
+          ledger: UploadLedger,
+          jobs: int = 1,
+          settle_delay: float = DEFAULT_SETTLE_DELAY,
+          use_polling: bool = False,
+          poll_interval: float = DEFAULT_POLL_INTERVAL,
+          uploader_options: Optional[dict] = None,
+          path_filter: Optional[PathFilter] = None):
+    watcher = FolderWatcher(context,
+                            get_root_path(folder_string),
+                            ledger,
+                            jobs=jobs,
+                            settle_delay=settle_delay,
+                            use_polling=use_polling,
+                            poll_interval=poll_interval,
+                            uploader_options=uploader_options,
+                            path_filter=path_filter)
+    try:
+        return watcher.run()
+    except UploadRemoteDatasetCheckError as error:
+        logger.error(f'[Watcher] Unable to resolve the dataset: {str(error)}')
+        return [], []
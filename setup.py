@@ -30,7 +30,6 @@ setup(
     zip_safe=False,
     platforms='any',
     install_requires=[
-        'requests-toolbelt==1.0.0',
         'arcsecond>=2.0.4',
         'python-dotenv'
     ],
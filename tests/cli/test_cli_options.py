@@ -17,3 +17,21 @@ def test_cli_global_help():
     result = runner.invoke(main, ['--help'])
     assert result.exit_code == 0 and not result.exception
     assert 'Usage: main [OPTIONS] COMMAND [ARGS]' in result.output
+
+
+def test_cli_scan_writes_a_manifest(tmp_path):
+    (tmp_path / 'data').mkdir()
+    (tmp_path / 'data' / 'a.fits').write_bytes(b'a')
+    (tmp_path / 'data' / 'b.log').write_bytes(b'b')
+    runner = CliRunner()
+    result = runner.invoke(main, ['scan', str(tmp_path / 'data'), '-o', str(tmp_path / 'manifest.gz'), '--only-data'])
+    assert result.exit_code == 0 and not result.exception
+    assert '1 files of' in result.output
+    assert (tmp_path / 'manifest.gz').exists()
+
+
+def test_cli_upload_rejects_invalid_shards():
+    runner = CliRunner()
+    result = runner.invoke(main, ['upload', '.', '-d', 'dataset', '--shard', '3/2'])
+    assert result.exit_code != 0
+    assert 'is not a valid shard' in result.output
@@ -0,0 +1,25 @@
+from benchmarks.startup import CLI_MODULE, HEAVY_MODULES, get_loaded_modules, measure_import, parse_import_times
+
+# Importing oort.cli.cli took about 250 ms with the uploader stack and arcsecond loaded eagerly, and takes
+# less than 50 ms without. The budget leaves room for slow machines, and still catches an eager import of
+# arcsecond (and requests) alone.
+STARTUP_IMPORT_BUDGET_MS = 150
+
+
+def test_parse_import_times():
+    output = ('import time: self [us] | cumulative | imported package\n'
+              'import time:       120 |        120 |   click.types\n'
+              'import time:      5899 |      32451 | oort.cli.cli\n')
+    assert parse_import_times(output) == {'click.types': (120, 120), 'oort.cli.cli': (5899, 32451)}
+
+
+def test_cli_does_not_import_heavy_modules():
+    loaded_modules = get_loaded_modules()
+    assert CLI_MODULE in loaded_modules
+    assert sorted(set(HEAVY_MODULES) & loaded_modules) == []
+
+
+def test_cli_import_time_is_within_budget():
+    # The best of a few runs, to ignore the noise of a busy machine.
+    import_time_us = min(measure_import()[CLI_MODULE][1] for _ in range(3))
+    assert import_time_us / 1000 < STARTUP_IMPORT_BUDGET_MS
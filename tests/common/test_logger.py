@@ -0,0 +1,80 @@
+import json
+import os
+import threading
+from logging.handlers import RotatingFileHandler
+
+import pytest
+
+from oort.common.logger import configure_oort_logging, get_oort_logger, shutdown_oort_logging
+
+
+@pytest.fixture
+def file_logging(monkeypatch):
+    # Log files are only written outside of tests.
+    monkeypatch.delenv('OORT_TESTS', raising=False)
+    yield
+    shutdown_oort_logging()
+    monkeypatch.setenv('OORT_TESTS', '1')
+    configure_oort_logging()
+
+
+def test_json_lines_are_written_in_background_and_rotated(file_logging, tmp_path):
+    configure_oort_logging(log_dir=tmp_path, log_format='json', max_bytes=4000, backup_count=2)
+    logger = get_oort_logger('uploader')
+    for index in range(200):
+        logger.info(f'line {index}')
+    shutdown_oort_logging()
+
+    log_file_name = f'oort-{os.getpid()}.jsonl'
+    log_file_names = [log_file_name, f'{log_file_name}.1', f'{log_file_name}.2']
+    assert sorted(path.name for path in tmp_path.iterdir()) == log_file_names
+    entry = json.loads((tmp_path / log_file_name).read_text().splitlines()[-1])
+    assert entry['message'] == 'line 199'
+    assert entry['level'] == 'INFO'
+    assert entry['logger'] == 'oort-cloud.uploader'
+
+
+def test_logging_does_not_write_in_the_calling_thread(file_logging, tmp_path, monkeypatch):
+    configure_oort_logging(log_dir=tmp_path)
+    writing_threads = set()
+    emit = RotatingFileHandler.emit
+
+    def recording_emit(handler, record):
+        writing_threads.add(threading.current_thread().name)
+        emit(handler, record)
+
+    monkeypatch.setattr(RotatingFileHandler, 'emit', recording_emit)
+    get_oort_logger('walker').info('hello')
+    shutdown_oort_logging()
+
+    assert 'hello' in (tmp_path / f'oort-{os.getpid()}.log').read_text()
+    assert threading.current_thread().name not in writing_threads
+
+
+def test_logging_starts_on_the_first_record(file_logging, tmp_path):
+    log_dir = tmp_path / 'logs'
+    configure_oort_logging(log_dir=log_dir)
+    logger = get_oort_logger('hasher')
+    assert not log_dir.exists()
+
+    logger.info('hello')
+    shutdown_oort_logging()
+    assert 'hello' in (log_dir / f'oort-{os.getpid()}.log').read_text()
+
+
+def test_forked_children_log_into_their_own_file(file_logging, tmp_path):
+    configure_oort_logging(log_dir=tmp_path)
+    logger = get_oort_logger('hasher')
+    logger.info('parent')
+
+    child_pid = os.fork()
+    if child_pid == 0:
+        logger.info('child')
+        shutdown_oort_logging()
+        os._exit(0)
+    os.waitpid(child_pid, 0)
+    shutdown_oort_logging()
+
+    parent_log = (tmp_path / f'oort-{os.getpid()}.log').read_text()
+    assert 'parent' in parent_log and 'child' not in parent_log
+    assert 'child' in (tmp_path / f'oort-{child_pid}.log').read_text()
@@ -0,0 +1,103 @@
+import time
+
+import pytest
+
+from oort.cli.errors import InvalidDatasetOortCloudError
+from oort.common.api import OortAPI
+from oort.common.context import Context
+from oort.common.validation import ValidationCache
+from oort.uploader.datasets import DatasetCache
+from oort.uploader.errors import UploadRemoteDatasetCheckError
+from tests.standin import StandInArcsecond, StandInConfig
+
+DATASET = {'uuid': '3f2a1b0c-9d8e-4f7a-b6c5-d4e3f2a1b0c9', 'name': 'Nightly'}
+ORGANISATION = {'subdomain': 'saao', 'name': 'South African Astronomical Observatory'}
+
+
+@pytest.fixture
+def standin():
+    with StandInArcsecond() as standin:
+        standin.datasets[DATASET['uuid']] = dict(DATASET)
+        standin.organisations[ORGANISATION['subdomain']] = ORGANISATION
+        yield standin
+
+
+def make_context(standin, cache, dataset='Nightly', subdomain=''):
+    config = StandInConfig(standin.url)
+    config.memberships[ORGANISATION['subdomain']] = 'member'
+    return Context(config, dataset, subdomain, api=OortAPI(config, subdomain), validation_cache=cache)
+
+
+def test_validation_cache_expires_and_merges_writers(tmp_path):
+    cache = ValidationCache(tmp_path / 'validation.json', ttl=0.2)
+    ValidationCache(tmp_path / 'validation.json').set('b', {'name': 'B'})
+    cache.set('a', {'name': 'A'})
+    assert cache.get('a') == {'name': 'A'} and cache.get('b') == {'name': 'B'}
+
+    cache.invalidate('b')
+    assert cache.get('b') is None
+    time.sleep(0.3)
+    assert cache.get('a') is None
+
+    (tmp_path / 'validation.json').write_text('not json')
+    assert cache.get('a') is None
+
+
+def test_validated_lookups_are_reused_by_next_runs(standin, tmp_path):
+    cache = ValidationCache(tmp_path / 'validation.json')
+    context = make_context(standin, cache, subdomain='saao')
+    context.validate()
+    assert standin.request_counts == {'GET': 2}
+    assert context.dataset_uuid == DATASET['uuid'] and context.organisation_subdomain == 'saao'
+
+    context = make_context(standin, cache, subdomain='saao')
+    context.validate()
+    assert standin.request_counts == {'GET': 2}
+    assert context.dataset_uuid == DATASET['uuid'] and context.organisation_subdomain == 'saao'
+
+    make_context(standin, cache, subdomain='saao').validate(refresh=True)
+    assert standin.request_counts == {'GET': 4}
+
+
+def test_datasets_to_be_created_are_not_cached(standin, tmp_path):
+    cache = ValidationCache(tmp_path / 'validation.json')
+    for _ in range(2):
+        context = make_context(standin, cache, dataset='Not Yet')
+        context.validate()
+        assert context.dataset_uuid == '' and context.dataset_name == 'Not Yet'
+    assert standin.request_counts == {'GET': 2}
+
+
+def test_dataset_and_organisation_are_looked_up_concurrently(standin, tmp_path):
+    standin.latency = 0.5
+    context = make_context(standin, ValidationCache(tmp_path / 'validation.json'), subdomain='saao')
+
+    started = time.monotonic()
+    context.validate()
+    assert time.monotonic() - started < 0.9
+    assert standin.request_counts == {'GET': 2}
+
+
+def test_unknown_dataset_is_not_cached(standin, tmp_path):
+    cache = ValidationCache(tmp_path / 'validation.json')
+    for _ in range(2):
+        with pytest.raises(InvalidDatasetOortCloudError):
+            make_context(standin, cache, dataset='00000000-0000-4000-8000-000000000000').validate()
+    assert standin.request_counts == {'GET': 2}
+
+
+def test_deleted_dataset_is_forgotten_by_the_cache(standin, tmp_path):
+    cache = ValidationCache(tmp_path / 'validation.json')
+    make_context(standin, cache).validate()
+    del standin.datasets[DATASET['uuid']]
+
+    context = make_context(standin, cache)
+    context.validate()
+    with pytest.raises(UploadRemoteDatasetCheckError):
+        DatasetCache().resolve(context, context.api)
+
+    # Looked up again by the next run, which creates it again.
+    context = make_context(standin, cache)
+    context.validate()
+    assert context.dataset_uuid == '' and context.dataset_name == 'Nightly'
+    assert standin.request_counts == {'GET': 3}
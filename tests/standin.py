@@ -0,0 +1,261 @@
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+UPLOAD_DETAIL_PATH_RE = re.compile(r'^/datafiles/uploads/(?P<uuid>[0-9a-f-]+)/$')
+DATASET_DETAIL_PATH_RE = re.compile(r'^(?:/[a-z0-9-]+)?/datasets/(?P<uuid>[0-9a-f-]+)/$')
+DATASET_LIST_PATH_RE = re.compile(r'^(?:/[a-z0-9-]+)?/datasets/$')
+ORGANISATION_DETAIL_PATH_RE = re.compile(r'^/organisations/(?P<subdomain>[a-z0-9-]+)/$')
+DATAFILE_DETAIL_PATH_RE = re.compile(r'^/datafiles/(?P<pk>[0-9]+)/$')
+READ_BLOCK_SIZE = 64 * 1024
+CONTENT_RANGE_RE = re.compile(r'^bytes (?P<start>[0-9]+)-(?P<end>[0-9]+)/(?P<total>[0-9]+)$')
+
+
+class StandInConfig(object):
+    """The subset of ArcsecondConfig used by Oort, pointing to the stand-in server."""
+
+    def __init__(self, api_server, username='robot1', upload_key='935e2b9e24c44581b4ef5f4c8e53213e'):
+        self.api_server = api_server
+        self.username = username
+        self.upload_key = upload_key
+        self.access_key = None
+        self.api_name = 'dev'
+        self.verbose = False
+        # Roles in organisations, by subdomain.
+        self.memberships = {}
+
+    def read_key(self, key_name):
+        return self.memberships.get(key_name)
+
+
+class StandInArcsecondHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately: without this, Nagle's algorithm delays each response by ~40ms.
+    disable_nagle_algorithm = True
+
+    @property
+    def standin(self):
+        return self.server.standin
+
+    def setup(self):
+        super().setup()
+        # One handler is created per TCP connection. Counting them tells whether connections are reused.
+        with self.standin.lock:
+            self.standin.connection_count += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_exactly(self, length):
+        bandwidth = self.standin.bandwidth
+        if not bandwidth:
+            return self.rfile.read(length)
+        # Reading slowly fills the TCP window, which throttles the client as a slow uplink would.
+        blocks = []
+        while length > 0:
+            block = self.rfile.read(min(length, READ_BLOCK_SIZE))
+            if not block:
+                break
+            blocks.append(block)
+            length -= len(block)
+            time.sleep(len(block) / bandwidth)
+        return b''.join(blocks)
+
+    def _read_body(self):
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            body = b''
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                chunk = self._read_exactly(size + 2)[:-2]
+                if size == 0:
+                    return body
+                body += chunk
+        length = int(self.headers.get('Content-Length', 0))
+        return self._read_exactly(length) if length > 0 else b''
+
+    def _respond(self, status, payload=None):
+        body = json.dumps(payload).encode() if payload is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _dispatch(self, method):
+        with self.standin.lock:
+            self.standin.request_counts[method] = self.standin.request_counts.get(method, 0) + 1
+        path, _, query = self.path.partition('?')
+        body = self._read_body()
+        if self.standin.latency:
+            time.sleep(self.standin.latency)
+        status, payload = self.standin.handle(method, path, self.headers, body, parse_qs(query))
+        self._respond(status, payload)
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_PATCH(self):
+        self._dispatch('PATCH')
+
+
+class StandInArcsecond(object):
+    """A local, in-memory stand-in for the datasets and datafiles endpoints of the Arcsecond API."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.request_counts = {}
+        self.connection_count = 0
+        self.organisations = {}
+        self.datasets = {}
+        self.datafiles = {}
+        self.uploads = {}
+        # Whether tags sent along with datafile creation are ignored, as older servers do.
+        self.ignore_creation_tags = False
+        # Whether the chunked uploads endpoint exists, which is not the case of every server.
+        self.supports_chunked_uploads = True
+        # Whether updates of datafiles fail, as when the server is unavailable at the end of a walk.
+        self.reject_datafile_updates = False
+        # Number of chunks to accept before failing one with a 502, to simulate a broken connection.
+        self.chunks_before_failure = None
+        # Seconds added to each response, and bytes per second read from each connection (None for unlimited).
+        self.latency = 0.0
+        self.bandwidth = None
+        # Whether uploaded content is kept. Benchmarks only need its size.
+        self.store_content = True
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f'http://{host}:{port}/'
+
+    def start(self):
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), StandInArcsecondHandler)
+        self._server.daemon_threads = True
+        self._server.standin = self
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _create_datafile(self, dataset_uuid, file_name, content, tags=None, size=None):
+        pk = len(self.datafiles) + 1
+        tags = [] if self.ignore_creation_tags else list(tags or [])
+        size = len(content) if size is None else size
+        self.datafiles[pk] = {'pk': pk, 'dataset': dataset_uuid, 'file': file_name, 'size': size,
+                              'content': content if self.store_content else b'', 'tags': tags}
+        return {k: v for k, v in self.datafiles[pk].items() if k != 'content'}
+
+    def handle(self, method, path, headers, body, query=None):
+        with self.lock:
+            match = ORGANISATION_DETAIL_PATH_RE.match(path)
+            if match and method == 'GET':
+                organisation = self.organisations.get(match.group('subdomain'))
+                return (200, organisation) if organisation else (404, {'detail': 'Not found.'})
+
+            if DATASET_LIST_PATH_RE.match(path) and method == 'GET':
+                names = (query or {}).get('name')
+                return 200, [d for d in self.datasets.values() if names is None or d.get('name') in names]
+
+            if path == '/datasets/' and method == 'POST':
+                dataset = dict(json.loads(body), uuid=str(uuid.uuid4()))
+                self.datasets[dataset['uuid']] = dataset
+                return 201, dataset
+
+            match = DATASET_DETAIL_PATH_RE.match(path)
+            if match and method == 'GET':
+                dataset = self.datasets.get(match.group('uuid'))
+                return (200, dataset) if dataset else (404, {'detail': 'Not found.'})
+
+            if path == '/datafiles/' and method == 'GET':
+                query = query or {}
+                datafiles = [{k: v for k, v in d.items() if k != 'content'} for d in self.datafiles.values()
+                             if d['dataset'] in query.get('dataset', [d['dataset']])
+                             and d['file'] in query.get('file_name', [d['file']])]
+                return 200, {'count': len(datafiles), 'results': datafiles}
+
+            if path == '/datafiles/' and method == 'POST':
+                return self._handle_multipart_datafile(headers, body)
+
+            match = DATAFILE_DETAIL_PATH_RE.match(path)
+            if match and method == 'PATCH':
+                if self.reject_datafile_updates:
+                    return 503, {'detail': 'Service Unavailable'}
+                datafile = self.datafiles.get(int(match.group('pk')))
+                if datafile is None:
+                    return 404, {'detail': 'Not found.'}
+                datafile.update(json.loads(body))
+                return 200, {k: v for k, v in datafile.items() if k != 'content'}
+
+            if path == '/datafiles/uploads/' and method == 'POST' and self.supports_chunked_uploads:
+                upload = dict(json.loads(body), uuid=str(uuid.uuid4()), offset=0, content=b'')
+                self.uploads[upload['uuid']] = upload
+                return 201, {'uuid': upload['uuid'], 'offset': 0}
+
+            match = UPLOAD_DETAIL_PATH_RE.match(path)
+            if match:
+                return self._handle_chunked_upload(method, match.group('uuid'), headers, body)
+
+            return 404, {'detail': 'Not found.'}
+
+    def _handle_multipart_datafile(self, headers, body):
+        boundary = headers.get('Content-Type', '').split('boundary=')[-1].encode()
+        fields = {'tags': []}
+        for part in body.split(b'--' + boundary)[1:-1]:
+            part_headers, _, content = part[2:-2].partition(b'\r\n\r\n')
+            name = re.search(rb'name="([^"]*)"', part_headers).group(1).decode()
+            file_name = re.search(rb'filename="([^"]*)"', part_headers)
+            if name == 'tags':
+                fields['tags'].append(content.decode())
+            else:
+                fields[name] = (file_name.group(1).decode(), content) if file_name else content.decode()
+        file_name, content = fields['file']
+        return 201, self._create_datafile(fields.get('dataset'), file_name, content, fields['tags'])
+
+    def _handle_chunked_upload(self, method, upload_uuid, headers, body):
+        upload = self.uploads.get(upload_uuid)
+        if upload is None:
+            return 404, {'detail': 'Not found.'}
+
+        if method == 'GET':
+            return 200, {'uuid': upload_uuid, 'offset': upload['offset']}
+
+        if headers.get('Content-Type') == 'application/json':
+            tags = json.loads(body).get('tags')
+            datafile = self._create_datafile(upload['dataset'], upload['file_name'], upload['content'], tags,
+                                             size=upload['offset'])
+            del self.uploads[upload_uuid]
+            return 200, datafile
+
+        if self.chunks_before_failure is not None:
+            if self.chunks_before_failure == 0:
+                self.chunks_before_failure = None
+                return 502, {'detail': 'Bad Gateway'}
+            self.chunks_before_failure -= 1
+
+        content_range = CONTENT_RANGE_RE.match(headers.get('Content-Range', ''))
+        if content_range is None or int(content_range.group('start')) != upload['offset']:
+            return 416, {'detail': 'Invalid Content-Range.', 'offset': upload['offset']}
+
+        if self.store_content:
+            upload['content'] += body
+        upload['offset'] += len(body)
+        return 200, {'uuid': upload_uuid, 'offset': upload['offset']}
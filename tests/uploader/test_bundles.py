@@ -0,0 +1,110 @@
+import io
+import json
+import tarfile
+from pathlib import Path
+
+import pytest
+
+from oort.common.context import Context
+from oort.uploader.bundles import BUNDLE_MANIFEST_NAME, Bundle, Bundler, TarBundleBody
+from oort.uploader.datasets import DatasetCache
+from oort.uploader.ledger import UploadLedger
+from oort.uploader.scanner import ScannedFile, build_manifest
+from oort.uploader.walker import walk
+from tests.standin import StandInArcsecond, StandInConfig
+
+DATASET = {'uuid': '9b1e4c2a-6d3f-4a8e-b7c5-1f0e2d3c4b5a', 'name': 'Bundles'}
+
+
+@pytest.fixture
+def standin():
+    with StandInArcsecond() as standin:
+        standin.datasets[DATASET['uuid']] = DATASET
+        yield standin
+
+
+def make_context(standin):
+    context = Context(StandInConfig(standin.url), DATASET['uuid'], '')
+    context.update_dataset(DATASET)
+    return context
+
+
+def make_tree(root_path: Path) -> dict:
+    contents = {'night1/a.json': b'{"a": 1}',
+                'night1/logs/b.log': b'b' * 700,
+                'night2/thumbnails/ç-é.jpg': b'c' * 513,
+                'night2/' + 'd' * 120 + '.txt': b'',
+                'night2/image.fits': b'i' * 5000}
+    for relative_path, content in contents.items():
+        (root_path / relative_path).parent.mkdir(parents=True, exist_ok=True)
+        (root_path / relative_path).write_bytes(content)
+    return contents
+
+
+def read_tar(content: bytes) -> dict:
+    with tarfile.open(fileobj=io.BytesIO(content)) as archive:
+        return {member.name: archive.extractfile(member).read() for member in archive.getmembers()}
+
+
+def test_bundler_groups_small_files_by_target_size(tmp_path):
+    scanned_files = [ScannedFile(tmp_path / f'{index:02d}.txt', size, 0) for index, size in enumerate([400] * 5)]
+    scanned_files.append(ScannedFile(tmp_path / 'large.fits', 5000, 0))
+
+    bundles, remaining_files = Bundler(threshold=1000, target_size=1000).plan(tmp_path, scanned_files)
+
+    assert [b.relative_paths for b in bundles] == [['00.txt', '01.txt'], ['02.txt', '03.txt']]
+    # A lone small file is not worth a bundle.
+    assert [f.path.name for f in remaining_files] == ['large.fits', '04.txt']
+    assert bundles[0].name == Bundle(tmp_path, scanned_files[:2]).name != bundles[1].name
+
+
+def test_tar_bundle_body_is_a_valid_archive_with_its_manifest(tmp_path):
+    contents = make_tree(tmp_path)
+    bundle = Bundle(tmp_path, [f for f in build_manifest(tmp_path) if f.size < 1000])
+
+    with TarBundleBody([('dataset', 'abc')], bundle) as body:
+        content = b''.join(iter(lambda: bytes(body.read()), b''))
+
+    assert len(content) == len(body)
+    archive = content.split(b'application/octet-stream\r\n\r\n', 1)[1].rsplit(f'\r\n--{body.boundary}'.encode(), 1)[0]
+    members = read_tar(archive)
+    assert list(members.keys())[0] == BUNDLE_MANIFEST_NAME
+    manifest = json.loads(members.pop(BUNDLE_MANIFEST_NAME))
+    assert [f['path'] for f in manifest['files']] == bundle.relative_paths
+    assert members == {path: data for path, data in contents.items() if len(data) < 1000}
+
+
+def test_tar_bundle_body_fails_on_files_changed_since_scanned(tmp_path):
+    make_tree(tmp_path)
+    bundle = Bundle(tmp_path, [f for f in build_manifest(tmp_path) if f.size < 1000])
+    (tmp_path / 'night1' / 'logs' / 'b.log').write_bytes(b'b')
+
+    with TarBundleBody([], bundle) as body, pytest.raises(OSError):
+        while body.read():
+            pass
+
+
+def test_walk_uploads_bundles_and_records_them(standin, tmp_path):
+    contents = make_tree(tmp_path / 'root')
+    root_path = tmp_path / 'root'
+    ledger = UploadLedger(tmp_path / 'ledger.sqlite')
+    dataset_cache = DatasetCache()
+    dataset_cache.add(DATASET)
+
+    success_uploads, failed_uploads = walk(make_context(standin), str(root_path), jobs=2, ledger=ledger,
+                                           dataset_cache=dataset_cache, bundler=Bundler(threshold=1000))
+
+    assert sorted(success_uploads) == sorted(str(root_path / path) for path in contents)
+    assert failed_uploads == []
+    assert standin.request_counts == {'POST': 2}
+    datafiles = {datafile['file']: datafile for datafile in standin.datafiles.values()}
+    bundle_name = next(name for name in datafiles if name.endswith('.tar'))
+    members = read_tar(datafiles[bundle_name]['content'])
+    assert len(members) == len(contents)
+    assert ledger.read_bundle_name(root_path, DATASET['uuid'], root_path / 'night1' / 'a.json') == bundle_name
+
+    # Bundled files are recorded in the ledger: nothing is uploaded again.
+    walk(make_context(standin), str(root_path), ledger=ledger, dataset_cache=dataset_cache,
+         bundler=Bundler(threshold=1000))
+    assert standin.request_counts == {'POST': 2}
+    ledger.close()
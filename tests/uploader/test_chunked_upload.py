@@ -0,0 +1,124 @@
+import io
+
+import pytest
+
+from oort.common.constants import Status
+from oort.common.context import Context
+from oort.uploader.errors import UploadRemoteFileCheckError
+from oort.uploader.ledger import UploadLedger
+from oort.uploader.progress import ProgressRenderer
+from oort.uploader.retry import RetryPolicy
+from oort.uploader.scanner import build_manifest
+from oort.uploader.uploader import FileUploader
+from oort.uploader.walker import upload_scanned_file
+from tests.standin import StandInArcsecond, StandInConfig
+
+CHUNK_SIZE = 1000
+
+
+@pytest.fixture
+def standin():
+    with StandInArcsecond() as standin:
+        yield standin
+
+
+def make_context(standin):
+    dataset = {'uuid': '6c1e6d1c-34d4-4bd6-a0a2-2cdb8a7c4a3b', 'name': 'Chunks'}
+    standin.datasets[dataset['uuid']] = dataset
+    context = Context(StandInConfig(standin.url), dataset['uuid'], '')
+    context.update_dataset(dataset)
+    return context
+
+
+def test_chunked_upload_of_large_file(standin, tmp_path):
+    data = bytes(range(256)) * 20
+    (tmp_path / 'cube.fits').write_bytes(data)
+
+    uploader = FileUploader(make_context(standin), tmp_path, tmp_path / 'cube.fits',
+                            chunk_threshold=CHUNK_SIZE, chunk_size=CHUNK_SIZE)
+    uploader.upload_file()
+
+    assert standin.datafiles[uploader.datafile['pk']]['content'] == data
+    assert standin.request_counts['PATCH'] == 6 + 1  # chunks and completion, with tags.
+    assert len(standin.datafiles[uploader.datafile['pk']]['tags']) == 4
+
+
+def test_interrupted_chunked_upload_resumes_from_last_offset(standin, tmp_path):
+    data = bytes(range(256)) * 20
+    (tmp_path / 'cube.fits').write_bytes(data)
+    ledger = UploadLedger(tmp_path / '.ledger.sqlite')
+    context = make_context(standin)
+
+    uploader = FileUploader(context, tmp_path, tmp_path / 'cube.fits', ledger=ledger,
+                            chunk_threshold=CHUNK_SIZE, chunk_size=CHUNK_SIZE)
+    standin.chunks_before_failure = 3
+    with pytest.raises(UploadRemoteFileCheckError):
+        uploader.upload_file()
+
+    upload = list(standin.uploads.values())[0]
+    assert upload['offset'] == 3 * CHUNK_SIZE
+
+    uploader = FileUploader(context, tmp_path, tmp_path / 'cube.fits', ledger=ledger,
+                            chunk_threshold=CHUNK_SIZE, chunk_size=CHUNK_SIZE)
+    uploader.upload_file()
+
+    assert len(standin.uploads) == 0
+    assert standin.datafiles[uploader.datafile['pk']]['content'] == data
+    assert ledger.read_chunked_upload(tmp_path, context.dataset_uuid, tmp_path / 'cube.fits', 0, 0) is None
+    ledger.close()
+
+
+def test_retried_chunked_upload_reports_each_byte_once(standin, tmp_path):
+    data = bytes(range(256)) * 20
+    (tmp_path / 'cube.fits').write_bytes(data)
+    ledger = UploadLedger(tmp_path / '.ledger.sqlite')
+    progress = ProgressRenderer(total_files=1, total_bytes=len(data), stream=io.StringIO(), quiet=True)
+
+    uploader_options = {'chunk_threshold': CHUNK_SIZE, 'chunk_size': CHUNK_SIZE, 'progress': progress}
+    standin.chunks_before_failure = 3
+    status, _, _, _ = upload_scanned_file(make_context(standin), tmp_path, build_manifest(tmp_path).files[0], ledger,
+                                          uploader_options, RetryPolicy(base_delay=0))
+
+    assert status == Status.OK
+    # The failed attempt sent 4 chunks, the resumed one the last 3 of them.
+    assert progress.bytes_done == len(data)
+    assert progress.bytes_sent == len(data) + CHUNK_SIZE
+    ledger.close()
+
+
+def test_small_file_is_uploaded_in_a_single_request(standin, tmp_path):
+    (tmp_path / 'small.fits').write_bytes(b'small')
+
+    uploader = FileUploader(make_context(standin), tmp_path, tmp_path / 'small.fits',
+                            chunk_threshold=CHUNK_SIZE, chunk_size=CHUNK_SIZE)
+    uploader.upload_file()
+
+    assert standin.datafiles[uploader.datafile['pk']]['content'] == b'small'
+    assert standin.datafiles[uploader.datafile['pk']]['file'] == 'small.fits'
+    assert len(standin.datafiles[uploader.datafile['pk']]['tags']) == 4
+
+
+def test_uploads_reuse_pooled_connections(standin, tmp_path):
+    context = make_context(standin)
+    for index in range(5):
+        (tmp_path / f'small_{index}.fits').write_bytes(b'small')
+        FileUploader(context, tmp_path, tmp_path / f'small_{index}.fits').upload_file()
+
+    assert len(standin.datafiles) == 5
+    assert standin.connection_count == 1
+
+
+def test_large_file_is_uploaded_in_a_single_request_when_server_has_no_chunked_uploads(standin, tmp_path):
+    standin.supports_chunked_uploads = False
+    data = bytes(range(256)) * 20
+    for name in ['a.fits', 'b.fits']:
+        (tmp_path / name).write_bytes(data)
+
+    context = make_context(standin)
+    for name in ['a.fits', 'b.fits']:
+        uploader = FileUploader(context, tmp_path, tmp_path / name, chunk_threshold=CHUNK_SIZE, chunk_size=CHUNK_SIZE)
+        uploader.upload_file()
+        assert standin.datafiles[uploader.datafile['pk']]['content'] == data
+
+    # The server is only asked once.
+    assert standin.request_counts == {'POST': 3}
@@ -0,0 +1,110 @@
+import bz2
+import gzip
+from pathlib import Path
+
+import pytest
+
+from oort.common.context import Context
+from oort.uploader.compression import (Bzip2Codec, Codec, CompressedFileStream, CompressionWorkerPool, GzipCodec,
+                                      is_compressible)
+from oort.uploader.uploader import FileUploader
+from tests.standin import StandInArcsecond, StandInConfig
+
+# Compressible, and large enough to span several blocks of compression.
+DATA = b''.join(i.to_bytes(4, 'big') for i in range(1024 * 1024))
+
+
+@pytest.fixture
+def standin():
+    with StandInArcsecond() as standin:
+        yield standin
+
+
+def make_context(standin):
+    dataset = {'uuid': '0e0a1f4c-8a49-4b7d-9a36-5d1b0e2a9c11', 'name': 'Compression'}
+    standin.datasets[dataset['uuid']] = dataset
+    context = Context(StandInConfig(standin.url), dataset['uuid'], '')
+    context.update_dataset(dataset)
+    return context
+
+
+def test_is_compressible():
+    assert is_compressible(Path('image.fits'))
+    assert is_compressible(Path('image.FIT'))
+    assert is_compressible(Path('image.xisf'))
+    assert not is_compressible(Path('image.fits.gz'))
+    assert not is_compressible(Path('image.xisf.bz2'))
+    assert not is_compressible(Path('notes.txt'))
+
+
+@pytest.mark.parametrize('codec, decompress', [(GzipCodec(), gzip.decompress), (Bzip2Codec(), bz2.decompress)])
+def test_compressed_file_stream(tmp_path, codec, decompress):
+    (tmp_path / 'image.fits').write_bytes(DATA)
+    with CompressedFileStream(tmp_path / 'image.fits', codec) as stream:
+        compressed = b''.join(stream)
+
+    assert decompress(compressed) == DATA
+    assert stream.raw_bytes_read == len(DATA)
+    assert stream.compressed_bytes == len(compressed) < len(DATA)
+
+
+def test_compressed_file_stream_of_missing_file_fails(tmp_path):
+    with pytest.raises(OSError):
+        with CompressedFileStream(tmp_path / 'missing.fits', GzipCodec()) as stream:
+            list(stream)
+
+
+def test_codecs_must_implement_a_compressor():
+    class IncompleteCodec(Codec):
+        name = 'incomplete'
+
+    with pytest.raises(TypeError):
+        IncompleteCodec()
+
+
+def test_compression_workers_are_bounded_and_reused(tmp_path):
+    (tmp_path / 'image.fits').write_bytes(DATA)
+    worker_pool = CompressionWorkerPool(size=1)
+    try:
+        workers = set()
+        for _ in range(3):
+            with CompressedFileStream(tmp_path / 'image.fits', GzipCodec(), worker_pool) as stream:
+                workers.add(id(stream._worker))
+                assert gzip.decompress(b''.join(stream)) == DATA
+        # A failure does not take the worker down with it.
+        with pytest.raises(OSError):
+            with CompressedFileStream(tmp_path / 'missing.fits', GzipCodec(), worker_pool) as stream:
+                workers.add(id(stream._worker))
+                list(stream)
+        assert len(workers) == 1
+
+        # A stream abandoned in the middle of a file does not leave its worker behind.
+        with CompressedFileStream(tmp_path / 'image.fits', Bzip2Codec(), worker_pool) as stream:
+            next(iter(stream))
+        assert worker_pool._idle_workers == []
+    finally:
+        worker_pool.close()
+
+
+def test_compressed_upload(standin, tmp_path):
+    (tmp_path / 'image.fits').write_bytes(DATA)
+
+    uploader = FileUploader(make_context(standin), tmp_path, tmp_path / 'image.fits', codec=GzipCodec())
+    uploader.upload_file()
+
+    datafile = standin.datafiles[uploader.datafile['pk']]
+    assert datafile['file'] == 'image.fits.gz'
+    assert gzip.decompress(datafile['content']) == DATA
+    assert len(datafile['tags']) == 4
+
+
+def test_compressed_files_are_uploaded_as_is(standin, tmp_path):
+    compressed = gzip.compress(DATA)
+    (tmp_path / 'image.fits.gz').write_bytes(compressed)
+
+    uploader = FileUploader(make_context(standin), tmp_path, tmp_path / 'image.fits.gz', codec=GzipCodec())
+    uploader.upload_file()
+
+    datafile = standin.datafiles[uploader.datafile['pk']]
+    assert datafile['file'] == 'image.fits.gz'
+    assert datafile['content'] == compressed
@@ -0,0 +1,53 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from oort.common.api import OortAPI
+from oort.common.context import Context
+from oort.uploader.datasets import DatasetCache
+from oort.uploader.errors import UploadRemoteDatasetCheckError
+from tests.standin import StandInArcsecond, StandInConfig
+
+
+@pytest.fixture
+def standin():
+    with StandInArcsecond() as standin:
+        yield standin
+
+
+def test_dataset_known_by_name_is_created_once(standin):
+    config = StandInConfig(standin.url)
+    context = Context(config, 'New Dataset', '')
+    context.update_dataset({'name': 'New Dataset'})
+    api = OortAPI(config)
+    dataset_cache = DatasetCache()
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        datasets = list(executor.map(lambda _: dataset_cache.resolve(context, api), range(16)))
+
+    assert len(standin.datasets) == 1
+    assert standin.request_counts == {'POST': 1}
+    assert all(dataset['uuid'] == context.dataset_uuid for dataset in datasets)
+
+
+def test_dataset_known_by_uuid_is_read_once(standin):
+    dataset = {'uuid': 'c9b7a0c4-5d1e-4b1a-8f6c-2d0e9f3b7a61', 'name': 'Existing'}
+    standin.datasets[dataset['uuid']] = dataset
+    config = StandInConfig(standin.url)
+    context = Context(config, dataset['uuid'], '')
+    context.update_dataset({'uuid': dataset['uuid']})
+    dataset_cache = DatasetCache()
+
+    for _ in range(3):
+        dataset_cache.resolve(context, OortAPI(config))
+
+    assert standin.request_counts == {'GET': 1}
+    assert context.dataset_name == 'Existing'
+
+
+def test_unknown_dataset_uuid_raises(standin):
+    config = StandInConfig(standin.url)
+    context = Context(config, 'c9b7a0c4-5d1e-4b1a-8f6c-2d0e9f3b7a61', '')
+    context.update_dataset({'uuid': 'c9b7a0c4-5d1e-4b1a-8f6c-2d0e9f3b7a61'})
+    with pytest.raises(UploadRemoteDatasetCheckError):
+        DatasetCache().resolve(context, OortAPI(config))
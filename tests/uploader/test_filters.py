@@ -0,0 +1,68 @@
+import os
+
+from oort.uploader.filters import PathFilter
+from oort.uploader.scanner import build_manifest
+
+
+def test_empty_filter_accepts_everything():
+    path_filter = PathFilter()
+    assert not path_filter
+    assert path_filter.accepts_path('night1/reduced/a.log')
+
+
+def test_name_and_path_excludes():
+    path_filter = PathFilter(excludes=['*.log', 'night1/*.tmp'])
+    assert not path_filter.accepts_path('a.log')
+    assert not path_filter.accepts_path('night2/deep/a.log')
+    assert not path_filter.accepts_path('night1/a.tmp')
+    assert path_filter.accepts_path('night2/a.tmp')
+    assert path_filter.accepts_path('night1/a.fits')
+
+
+def test_trailing_slash_excludes_folders_only_at_any_depth():
+    path_filter = PathFilter(excludes=['reduced/', 'tmp/'])
+    assert not path_filter.accepts_dir('night1/reduced', 'reduced')
+    assert not path_filter.accepts_path('night1/deep/tmp/a.fits')
+    assert not path_filter.accepts_path('reduced', is_dir=True)
+    # A file named as an excluded folder is kept.
+    assert path_filter.accepts_path('night1/reduced')
+
+
+def test_includes_only_apply_to_files():
+    path_filter = PathFilter(includes=['*.fits', 'logs/*.txt'])
+    assert path_filter.accepts_path('night1/deep/a.fits')
+    assert path_filter.accepts_path('logs/a.txt')
+    assert not path_filter.accepts_path('night1/a.txt')
+    assert path_filter.accepts_dir('night1', 'night1')
+
+
+def test_only_data_is_case_insensitive_and_accepts_compressed_files():
+    path_filter = PathFilter(only_data=True)
+    assert path_filter.accepts_path('a.fits')
+    assert path_filter.accepts_path('a.FITS')
+    assert path_filter.accepts_path('a.fits.gz')
+    assert path_filter.accepts_path('a.xisf')
+    assert not path_filter.accepts_path('a.jpg')
+    assert not path_filter.accepts_path('a.fits.txt')
+
+
+def test_scan_folder_never_enters_excluded_folders(tmp_path, monkeypatch):
+    for folder in ['night1/reduced/deep', 'night1/raw', 'tmp']:
+        (tmp_path / folder).mkdir(parents=True)
+    (tmp_path / 'night1' / 'reduced' / 'deep' / 'a.fits').write_bytes(b'a')
+    (tmp_path / 'night1' / 'raw' / 'b.fits').write_bytes(b'b')
+    (tmp_path / 'night1' / 'raw' / 'b.log').write_bytes(b'b')
+    (tmp_path / 'tmp' / 'c.fits').write_bytes(b'c')
+
+    scanned_folders = []
+    scandir = os.scandir
+
+    def recording_scandir(path):
+        scanned_folders.append(os.path.relpath(path, tmp_path))
+        return scandir(path)
+
+    monkeypatch.setattr(os, 'scandir', recording_scandir)
+    manifest = build_manifest(tmp_path, PathFilter(excludes=['reduced/', 'tmp/', '*.log']))
+
+    assert [f.path for f in manifest] == [tmp_path / 'night1' / 'raw' / 'b.fits']
+    assert sorted(scanned_folders) == ['.', 'night1', 'night1/raw']
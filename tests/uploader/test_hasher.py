@@ -0,0 +1,42 @@
+import hashlib
+from pathlib import Path
+
+import pytest
+
+from oort.uploader.hasher import BackgroundHasher, compute_file_digest, hash_files
+from oort.uploader.scanner import ScannedFile, build_manifest
+
+FIXTURES_PATH = Path(__file__).parent.parent / 'fixtures'
+
+
+@pytest.mark.parametrize('algorithm', ['sha256', 'blake2b'])
+def test_compute_file_digest_with_small_chunks(tmp_path, algorithm):
+    file_path = tmp_path / 'cube.fits'
+    data = bytes(range(256)) * 1000
+    file_path.write_bytes(data)
+    assert compute_file_digest(file_path, algorithm, chunk_size=1000) == hashlib.new(algorithm, data).hexdigest()
+
+
+def test_compute_file_digest_of_empty_file(tmp_path):
+    file_path = tmp_path / 'empty.fits'
+    file_path.touch()
+    assert compute_file_digest(file_path) == hashlib.sha256().hexdigest()
+
+
+def test_hash_files_sets_digests_on_records(tmp_path):
+    scanned_files = build_manifest(FIXTURES_PATH).files + [ScannedFile(tmp_path / 'missing.fits', 0, 0)]
+    hash_files(scanned_files, jobs=2)
+    for scanned_file in scanned_files[:-1]:
+        assert scanned_file.digest == hashlib.sha256(scanned_file.path.read_bytes()).hexdigest()
+    assert scanned_files[-1].digest is None
+
+
+def test_background_hasher_sets_digests_when_waited_for(tmp_path):
+    scanned_files = build_manifest(FIXTURES_PATH).files + [ScannedFile(tmp_path / 'missing.fits', 0, 0)]
+    with BackgroundHasher(jobs=2, batch_size=3) as hasher:
+        hasher.submit(scanned_files)
+        for scanned_file in scanned_files:
+            hasher.wait(scanned_file)
+    for scanned_file in scanned_files[:-1]:
+        assert scanned_file.digest == hashlib.sha256(scanned_file.path.read_bytes()).hexdigest()
+    assert scanned_files[-1].digest is None
@@ -0,0 +1,103 @@
+import bz2
+import gzip
+import struct
+from pathlib import Path
+from unittest.mock import patch
+
+from oort.uploader import headers
+from oort.uploader.headers import (HeaderCache, read_file_metadata, read_fits_header, read_headers,
+                                   read_xisf_header, split_undated_files)
+from oort.uploader.scanner import build_manifest
+
+FIXTURES_PATH = Path(__file__).parent.parent / 'fixtures'
+
+
+def make_header(cards: list) -> bytes:
+    header = ''.join(card.ljust(80) for card in cards + ['END'])
+    header = header.ljust((len(header) + 2879) // 2880 * 2880)
+    return header.encode('ascii')
+
+
+def make_card(keyword: str, value: str) -> str:
+    return f'{keyword:<8}= {value}'
+
+
+def test_read_fits_header_of_fixtures():
+    metadata = read_fits_header(FIXTURES_PATH / 'very_simple.fits')
+    assert metadata['DATE-OBS'] == '2002-01-28T02:45:1.875'
+    assert metadata['TELESCOP'] == 'CTIO 1.5 meter telescope'
+    assert read_fits_header(FIXTURES_PATH / 'data_zipped_no_clear.fits.gz') == metadata
+    assert read_fits_header(FIXTURES_PATH / 'data_zipped_no_clear.fits.bz2') == metadata
+
+
+def test_read_fits_header_spanning_blocks_without_reading_data(tmp_path):
+    cards = ['SIMPLE  =                    T', 'BITPIX  =                   16', 'NAXIS   =                    0']
+    cards += [make_card(f'COMMENT{index}', str(index)) for index in range(40)]
+    cards += [make_card('OBJECT', "'O''Neil  '  / quoted"), make_card('EXPTIME', '30.0 / seconds')]
+    file_path = tmp_path / 'long.fits'
+    file_path.write_bytes(make_header(cards) + b'\xff' * 2880)
+
+    with patch.object(Path, 'read_bytes', side_effect=AssertionError):
+        metadata = read_fits_header(file_path)
+    assert metadata == {'OBJECT': "O'Neil", 'EXPTIME': '30.0'}
+
+
+def test_read_fits_header_looks_into_first_extension_when_primary_has_no_data(tmp_path):
+    primary = make_header(['SIMPLE  =                    T', 'NAXIS   =                    0',
+                           make_card('TELESCOP', "'T80'")])
+    extension = make_header(["XTENSION= 'BINTABLE'", make_card('DATE-OBS', "'2024-03-01T22:10:00'"),
+                             make_card('TELESCOP', "'ignored'")])
+    file_path = tmp_path / 'compressed.fits.gz'
+    with gzip.open(file_path, 'wb') as f:
+        f.write(primary + extension)
+
+    assert read_fits_header(file_path) == {'TELESCOP': 'T80', 'DATE-OBS': '2024-03-01T22:10:00'}
+
+
+def test_read_xisf_header(tmp_path):
+    xml = ('<?xml version="1.0" encoding="UTF-8"?>'
+           '<xisf version="1.0" xmlns="http://www.pixinsight.com/xisf">'
+           '<Image geometry="8:8:1" sampleFormat="UInt16" location="attachment:4096:128">'
+           '<Property id="Observation:Time:Start" type="TimePoint" value="2024-03-01T22:10:00Z"/>'
+           '<Property id="Observation:Object:Name" type="String">M 42</Property>'
+           '<FITSKeyword name="OBJECT" value="\'Orion Nebula\'" comment=""/>'
+           '</Image></xisf>').encode()
+    file_path = tmp_path / 'image.xisf'
+    file_path.write_bytes(b'XISF0100' + struct.pack('<I', len(xml)) + b'\0' * 4 + xml)
+
+    assert read_xisf_header(file_path) == {'DATE-OBS': '2024-03-01T22:10:00Z', 'OBJECT': 'Orion Nebula'}
+    assert read_file_metadata(file_path) == read_xisf_header(file_path)
+
+
+def test_read_headers_uses_cache_and_tolerates_broken_files(tmp_path):
+    (tmp_path / 'a.fits').write_bytes((FIXTURES_PATH / 'very_simple.fits').read_bytes())
+    (tmp_path / 'broken.fits').write_bytes(b'not a fits file')
+    # Valid gzip framing around corrupted deflate data, a truncated bz2 stream, and a truncated XISF header.
+    (tmp_path / 'corrupted.fits.gz').write_bytes(gzip.compress(b'SIMPLE  = T' * 100)[:10] + b'\xff' * 50)
+    (tmp_path / 'truncated.fits.bz2').write_bytes(bz2.compress(b'SIMPLE  = T' * 100)[:20])
+    (tmp_path / 'truncated.xisf').write_bytes(b'XISF0100' + struct.pack('<I', 1000) + b'\0' * 4 + b'<xisf')
+    (tmp_path / 'notes.txt').write_bytes(b'notes')
+    cache = HeaderCache(tmp_path / 'headers.sqlite')
+
+    scanned_files = {f.path.name: f for f in read_headers(list(build_manifest(tmp_path)), cache=cache)}
+    assert scanned_files['a.fits'].metadata['OBJECT'] == '320'
+    for name in ['broken.fits', 'corrupted.fits.gz', 'truncated.fits.bz2', 'truncated.xisf', 'notes.txt']:
+        assert scanned_files[name].metadata == {}
+
+    with patch.object(headers, 'read_file_metadata', side_effect=AssertionError):
+        cached_files = read_headers(list(build_manifest(tmp_path)), cache=cache)
+    assert {f.path.name: f.metadata for f in cached_files} == {n: f.metadata for n, f in scanned_files.items()}
+    cache.close()
+
+
+def test_split_undated_files(tmp_path):
+    (tmp_path / 'dated.fits').write_bytes((FIXTURES_PATH / 'very_simple.fits').read_bytes())
+    (tmp_path / 'undated.fits').write_bytes(make_header([make_card('SIMPLE', 'T'), make_card('OBJECT', "'M42'")]))
+    (tmp_path / 'broken.xisf').write_bytes(b'not a xisf file')
+    (tmp_path / 'archive.fits.zip').write_bytes(b'zipped')
+    (tmp_path / 'notes.txt').write_bytes(b'notes')
+
+    dated, undated = split_undated_files(read_headers(list(build_manifest(tmp_path))))
+    assert sorted(f.path.name for f in undated) == ['broken.xisf', 'undated.fits']
+    # Only FITS and XISF files with a readable header can be undated.
+    assert sorted(f.path.name for f in dated) == ['archive.fits.zip', 'dated.fits', 'notes.txt']
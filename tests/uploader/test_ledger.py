@@ -0,0 +1,95 @@
+from oort.uploader.ledger import UploadLedger
+from oort.uploader.scanner import build_manifest
+
+DATASET_UUID = '0b6f3a3e-7a0c-4d5e-8f46-6a1c3e2f9d10'
+
+
+def test_ledger_skips_unchanged_files_only(tmp_path):
+    root_path = tmp_path / 'root'
+    root_path.mkdir()
+    (root_path / 'a.fits').write_bytes(b'a')
+    (root_path / 'b.fits').write_bytes(b'b')
+
+    ledger = UploadLedger(tmp_path / 'ledger.sqlite')
+    for scanned_file in build_manifest(root_path):
+        ledger.record(root_path, DATASET_UUID, scanned_file, datafile_pk=1)
+
+    (root_path / 'b.fits').write_bytes(b'bb')
+    (root_path / 'c.fits').write_bytes(b'c')
+    pending, synced = ledger.split_synced_files(root_path, DATASET_UUID, build_manifest(root_path).files)
+    assert sorted(f.path.name for f in pending) == ['b.fits', 'c.fits']
+    assert [f.path.name for f in synced] == ['a.fits']
+
+    pending, synced = ledger.split_synced_files(root_path, 'another-dataset', build_manifest(root_path).files)
+    assert len(pending) == 3 and len(synced) == 0
+    ledger.close()
+
+
+def test_ledger_persists_across_instances(tmp_path):
+    (tmp_path / 'a.fits').write_bytes(b'a')
+    manifest = build_manifest(tmp_path)
+
+    ledger = UploadLedger(tmp_path / '.ledger.sqlite')
+    ledger.record(tmp_path, DATASET_UUID, manifest.files[0])
+    ledger.close()
+
+    ledger = UploadLedger(tmp_path / '.ledger.sqlite')
+    pending, synced = ledger.split_synced_files(tmp_path, DATASET_UUID, manifest.files)
+    assert len(pending) == 0 and len(synced) == 1
+    ledger.close()
+
+
+def test_ledger_compares_digests_when_known(tmp_path):
+    (tmp_path / 'a.fits').write_bytes(b'a')
+    scanned_file = build_manifest(tmp_path).files[0]
+    scanned_file.digest = 'abc'
+
+    ledger = UploadLedger(tmp_path / '.ledger.sqlite')
+    ledger.record(tmp_path, DATASET_UUID, scanned_file)
+    scanned_file.digest = 'def'
+    pending, synced = ledger.split_synced_files(tmp_path, DATASET_UUID, [scanned_file])
+    assert len(pending) == 1 and len(synced) == 0
+    ledger.close()
+
+
+def test_ledger_looks_up_given_files_only(tmp_path):
+    for index in range(1200):
+        (tmp_path / f'{index:04d}.fits').write_bytes(b'a')
+    manifest = build_manifest(tmp_path)
+
+    ledger = UploadLedger(tmp_path / '.ledger.sqlite')
+    for scanned_file in manifest.files:
+        ledger.record(tmp_path, DATASET_UUID, scanned_file)
+    # More paths than a single statement can take.
+    relative_paths = [f'{index:04d}.fits' for index in range(0, 1200, 2)] + ['missing.fits'] * 300
+    synced_files = ledger.read_synced_files(tmp_path, DATASET_UUID, relative_paths)
+    assert sorted(synced_files.keys()) == sorted(set(relative_paths) - {'missing.fits'})
+    assert ledger.read_synced_files(tmp_path, DATASET_UUID, []) == {}
+    ledger.close()
+
+
+def test_ledger_compares_digests_of_touched_files(tmp_path):
+    (tmp_path / 'a.fits').write_bytes(b'a')
+    (tmp_path / 'b.fits').write_bytes(b'b')
+    ledger = UploadLedger(tmp_path / '.ledger.sqlite')
+    for scanned_file in build_manifest(tmp_path).files:
+        scanned_file.digest = scanned_file.path.name
+        ledger.record(tmp_path, DATASET_UUID, scanned_file)
+
+    scanned_files = build_manifest(tmp_path).files
+    for scanned_file in scanned_files:
+        scanned_file.mtime += 10
+    synced_files = ledger.read_synced_files(tmp_path, DATASET_UUID)
+    touched_files = ledger.find_touched_files(tmp_path, DATASET_UUID, scanned_files, synced_files)
+    assert sorted(f.path.name for f in touched_files) == ['a.fits', 'b.fits']
+
+    # Only a's content is the recorded one. Without a digest, a touched file is uploaded again.
+    scanned_files[0].digest = 'a.fits'
+    pending, synced = ledger.split_synced_files(tmp_path, DATASET_UUID, scanned_files, synced_files)
+    assert [f.path.name for f in pending] == ['b.fits'] and [f.path.name for f in synced] == ['a.fits']
+
+    ledger.update_mtimes(tmp_path, DATASET_UUID, synced)
+    synced_files = ledger.read_synced_files(tmp_path, DATASET_UUID)
+    assert [f.path.name for f in ledger.find_touched_files(tmp_path, DATASET_UUID, scanned_files, synced_files)] == \
+        ['b.fits']
+    ledger.close()
@@ -0,0 +1,67 @@
+import json
+
+from oort.common.context import Context
+from oort.uploader import walker
+from oort.uploader.datasets import DatasetCache
+from oort.uploader.metrics import Histogram, UploadMetrics
+from oort.uploader.retry import RetryPolicy
+from tests.standin import StandInArcsecond, StandInConfig
+
+
+def test_histogram():
+    histogram = Histogram([0.1, 1, 10])
+    for value in [0.05, 0.5, 0.7, 5, 50]:
+        histogram.observe(value)
+    assert histogram.get_cumulative_counts() == [1, 3, 4]
+    assert histogram.count == 5
+    assert histogram.sum == 56.25
+
+
+def test_prometheus_export():
+    metrics = UploadMetrics(buckets=[1, 10])
+    metrics.observe_phase('uploading', 2.0)
+    metrics.add_bytes(1000)
+    metrics.count_error(retryable=True)
+    metrics.count_retry()
+    metrics.count_file(success=True)
+
+    text = metrics.to_prometheus()
+    assert '# TYPE oort_upload_phase_duration_seconds histogram' in text
+    assert 'oort_upload_phase_duration_seconds_bucket{phase="uploading",le="1"} 0' in text
+    assert 'oort_upload_phase_duration_seconds_bucket{phase="uploading",le="10"} 1' in text
+    assert 'oort_upload_phase_duration_seconds_bucket{phase="uploading",le="+Inf"} 1' in text
+    assert 'oort_upload_phase_duration_seconds_count{phase="checking"} 0' in text
+    assert 'oort_upload_bytes_sent_total 1000' in text
+    assert 'oort_upload_files_total{status="ok"} 1' in text
+    assert 'oort_upload_errors_total{kind="retryable"} 1' in text
+    assert 'oort_upload_retries_total 1' in text
+
+
+def test_walk_metrics(tmp_path):
+    folder = tmp_path / 'data'
+    folder.mkdir()
+    for index in range(5):
+        (folder / f'image_{index}.fits').write_bytes(b'0' * 1000)
+
+    metrics = UploadMetrics()
+    with StandInArcsecond() as standin:
+        dataset = {'uuid': '9b6f2a8e-5c1d-4e3f-8a7b-0c2d4e6f8a1b', 'name': 'Metrics'}
+        dataset_cache = DatasetCache()
+        dataset_cache.add(dataset)
+        standin.datasets[dataset['uuid']] = dataset
+        context = Context(StandInConfig(standin.url), dataset['uuid'], '')
+        context.update_dataset(dataset)
+        walker.walk(context, str(folder), jobs=2, dataset_cache=dataset_cache,
+                    uploader_options={'metrics': metrics}, retry_policy=RetryPolicy(base_delay=0))
+
+    metrics.finish()
+    metrics.write(tmp_path / 'metrics')
+
+    summary = json.loads((tmp_path / 'metrics' / 'oort_upload.json').read_text())
+    assert summary['files'] == {'ok': 5, 'error': 0}
+    assert summary['bytes_sent'] > 5 * 1000
+    # The dataset is resolved once, and deferred tags are updated in a single batch, at the end of the walk.
+    assert {phase: histogram['count'] for phase, histogram in summary['phases'].items()} == \
+           {'checking': 1, 'uploading': 5, 'tagging': 1}
+    assert 'oort_upload_files_total{status="ok"} 5' in (tmp_path / 'metrics' / 'oort_upload.prom').read_text()
+    assert sorted(path.name for path in (tmp_path / 'metrics').iterdir()) == ['oort_upload.json', 'oort_upload.prom']
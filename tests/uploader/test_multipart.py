@@ -0,0 +1,105 @@
+import logging
+import os
+import sys
+
+import pytest
+
+from oort.common.context import Context
+from oort.uploader.multipart import FileRangeBody, MultipartFileBody
+from oort.uploader.uploader import FileUploader
+from tests.standin import StandInArcsecond, StandInConfig
+
+DATA = bytes(range(256)) * 256
+
+UPLOAD_COUNT = 10000
+
+
+def read_body(body):
+    blocks = []
+    while True:
+        block = body.read(8192)
+        if not block:
+            return b''.join(blocks)
+        blocks.append(bytes(block))
+
+
+def read_proc_status(key):
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(key + ':'):
+                return int(line.split()[1]) * 1024
+
+
+def test_multipart_body(tmp_path):
+    (tmp_path / 'image.fits').write_bytes(DATA)
+    amounts = []
+    with MultipartFileBody([('dataset', 'abc'), ('tags', 'a|b')], tmp_path / 'image.fits',
+                           callback=amounts.append) as body:
+        length = len(body)
+        content = read_body(body)
+
+    assert len(content) == length == sum(amounts)
+    assert content.startswith(f'--{body.boundary}\r\nContent-Disposition: form-data; name="dataset"'.encode())
+    assert f'filename="image.fits"\r\nContent-Type: application/octet-stream\r\n\r\n'.encode() in content
+    assert content.endswith(DATA + f'\r\n--{body.boundary}--\r\n'.encode())
+    assert body.content_type == f'multipart/form-data; boundary={body.boundary}'
+
+
+def test_multipart_body_of_empty_file(tmp_path):
+    (tmp_path / 'empty.fits').write_bytes(b'')
+    with MultipartFileBody([], tmp_path / 'empty.fits') as body:
+        content = read_body(body)
+    assert len(content) == len(body)
+    assert f'filename="empty.fits"'.encode() in content
+
+
+@pytest.mark.parametrize('offset, length', [(0, 1000), (5000, 70000), (len(DATA) - 10, 100)])
+def test_file_range_body(tmp_path, offset, length):
+    (tmp_path / 'image.fits').write_bytes(DATA)
+    with FileRangeBody(tmp_path / 'image.fits', offset, length) as body:
+        content = read_body(body)
+    assert content == DATA[offset:offset + length]
+    assert len(body) == len(content)
+
+
+def test_file_range_body_fails_on_truncated_file(tmp_path):
+    (tmp_path / 'image.fits').write_bytes(DATA * 20)
+    with FileRangeBody(tmp_path / 'image.fits') as body:
+        block = body.read()
+        (tmp_path / 'image.fits').write_bytes(b'')
+        with pytest.raises(OSError):
+            read_body(body)
+    # The views handed out are released, and the file closed.
+    with pytest.raises(ValueError):
+        bytes(block)
+    assert body.read() == b''
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason='Reads /proc to count descriptors and memory.')
+def test_uploads_do_not_leak_descriptors_nor_memory(tmp_path):
+    (tmp_path / 'image.fits').write_bytes(DATA)
+    with StandInArcsecond() as standin:
+        dataset = {'uuid': 'f1c7b2d4-2b0e-4d7e-8b51-6e9f3d1a0c55', 'name': 'Leaks'}
+        standin.datasets[dataset['uuid']] = dataset
+        context = Context(StandInConfig(standin.url), dataset['uuid'], '')
+        context.update_dataset(dataset)
+
+        fd_counts, memory_sizes = [], []
+        # Log records captured by pytest would account for most of the memory growth.
+        logging.disable(logging.INFO)
+        try:
+            for index in range(UPLOAD_COUNT):
+                uploader = FileUploader(context, tmp_path, tmp_path / 'image.fits', tags=[])
+                uploader.upload_file()
+                if index % 1000 == 999:
+                    # The stand-in keeps the uploaded content. Forget it, to only measure the uploads.
+                    standin.datafiles.clear()
+                    fd_counts.append(len(os.listdir('/proc/self/fd')))
+                    memory_sizes.append(read_proc_status('RssAnon'))
+        finally:
+            logging.disable(logging.NOTSET)
+        context.api.close()
+
+    assert max(fd_counts) == min(fd_counts)
+    # Measured after the first thousand uploads, once caches and pools are warm.
+    assert memory_sizes[-1] - memory_sizes[0] < 8 * 1024 * 1024
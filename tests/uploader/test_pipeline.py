@@ -0,0 +1,91 @@
+from pathlib import Path
+
+import pytest
+
+from oort.common.constants import Status, Substatus
+from oort.common.context import Context
+from oort.uploader import pipeline
+from oort.uploader.ledger import UploadLedger
+from oort.uploader.pipeline import walk_async
+from tests.standin import StandInArcsecond, StandInConfig
+
+FIXTURES_PATH = Path(__file__).parent.parent / 'fixtures'
+FIXTURES_FILE_COUNT = sum(1 for f in FIXTURES_PATH.glob('**/*') if f.is_file())
+
+
+@pytest.fixture
+def standin():
+    with StandInArcsecond() as standin:
+        yield standin
+
+
+def test_pipeline_uploads_every_file_into_a_single_new_dataset(standin):
+    context = Context(StandInConfig(standin.url), 'Pipeline', '')
+    context.update_dataset({'name': 'Pipeline'})
+
+    success_uploads, failed_uploads = walk_async(context, str(FIXTURES_PATH), in_flight=8)
+
+    assert len(success_uploads) == FIXTURES_FILE_COUNT and len(failed_uploads) == 0
+    assert len(standin.datasets) == 1
+    assert {datafile['dataset'] for datafile in standin.datafiles.values()} == {context.dataset_uuid}
+
+
+def test_pipeline_skips_files_in_ledger(standin, tmp_path):
+    dataset = {'uuid': '5a4b3c2d-1e0f-4a9b-8c7d-6e5f4a3b2c1d', 'name': 'Pipeline'}
+    standin.datasets[dataset['uuid']] = dataset
+    context = Context(StandInConfig(standin.url), dataset['uuid'], '')
+    context.update_dataset(dataset)
+    ledger = UploadLedger(tmp_path / 'ledger.sqlite')
+
+    success_uploads, _ = walk_async(context, str(FIXTURES_PATH), in_flight=4, ledger=ledger)
+    assert len(success_uploads) == FIXTURES_FILE_COUNT
+
+    success_uploads, failed_uploads = walk_async(context, str(FIXTURES_PATH), in_flight=4, ledger=ledger)
+    assert len(success_uploads) == 0 and len(failed_uploads) == 0
+    assert len(standin.datafiles) == FIXTURES_FILE_COUNT
+    ledger.close()
+
+
+def test_pipeline_records_digests(standin, tmp_path):
+    dataset = {'uuid': '5a4b3c2d-1e0f-4a9b-8c7d-6e5f4a3b2c1d', 'name': 'Pipeline'}
+    standin.datasets[dataset['uuid']] = dataset
+    context = Context(StandInConfig(standin.url), dataset['uuid'], '')
+    context.update_dataset(dataset)
+    ledger = UploadLedger(tmp_path / 'ledger.sqlite')
+
+    success_uploads, _ = walk_async(context, str(FIXTURES_PATH), in_flight=4, ledger=ledger, digest_algorithm='sha256')
+    assert len(success_uploads) == FIXTURES_FILE_COUNT
+    synced_files = ledger.read_synced_files(FIXTURES_PATH, dataset['uuid'])
+    assert len(synced_files) == FIXTURES_FILE_COUNT
+    assert all(digest is not None for _, _, digest in synced_files.values())
+    ledger.close()
+
+
+def test_pipeline_reports_unresolvable_dataset(standin):
+    context = Context(StandInConfig(standin.url), '5a4b3c2d-1e0f-4a9b-8c7d-6e5f4a3b2c1d', '')
+    context.update_dataset({'uuid': '5a4b3c2d-1e0f-4a9b-8c7d-6e5f4a3b2c1d'})
+
+    success_uploads, failed_uploads = walk_async(context, str(FIXTURES_PATH), in_flight=4)
+
+    assert len(success_uploads) == 0 and len(failed_uploads) == FIXTURES_FILE_COUNT
+    assert standin.request_counts == {'GET': 1}
+
+
+def test_pipeline_requeues_transient_failures_once_the_other_files_are_done(standin, monkeypatch):
+    context = Context(StandInConfig(standin.url), 'Pipeline', '')
+    context.update_dataset({'name': 'Pipeline'})
+    failed_paths = set()
+    upload_scanned_file = pipeline.upload_scanned_file
+
+    def flaky_upload_scanned_file(context, root_path, scanned_file, *args):
+        if scanned_file.path not in failed_paths:
+            failed_paths.add(scanned_file.path)
+            return Status.ERROR, Substatus.ERROR, 'boom', True
+        return upload_scanned_file(context, root_path, scanned_file, *args)
+
+    monkeypatch.setattr(pipeline, 'upload_scanned_file', flaky_upload_scanned_file)
+
+    success_uploads, failed_uploads = walk_async(context, str(FIXTURES_PATH), in_flight=4)
+
+    assert len(success_uploads) == FIXTURES_FILE_COUNT and len(failed_uploads) == 0
+    assert len(standin.datafiles) == FIXTURES_FILE_COUNT
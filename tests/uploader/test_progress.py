@@ -0,0 +1,106 @@
+import io
+import threading
+from unittest.mock import patch
+
+from oort.uploader import progress as progress_module
+from oort.uploader.progress import ProgressRenderer, ThroughputHistory, format_duration, format_size
+
+
+class FakeTerminal(io.StringIO):
+    def __init__(self):
+        super().__init__()
+        self.write_count = 0
+
+    def isatty(self):
+        return True
+
+    def write(self, s):
+        self.write_count += 1
+        return super().write(s)
+
+
+def test_formatting():
+    assert format_size(512) == '512 B'
+    assert format_size(12_300_000) == '12.3 MB'
+    assert format_duration(42.7) == '42s'
+    assert format_duration(192) == '3m12s'
+    assert format_duration(3 * 3600 + 5 * 60) == '3h05m'
+    assert format_duration(2 * 86400 + 7 * 3600) == '2d07h'
+
+
+def test_renders_at_most_once_per_interval():
+    terminal = FakeTerminal()
+    progress = ProgressRenderer(total_files=8, total_bytes=8 * 1000 * 1000, refresh_interval=60, stream=terminal)
+
+    def upload():
+        for _ in range(1000):
+            progress.add_bytes(1000)
+        progress.finish_file()
+
+    threads = [threading.Thread(target=upload) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert progress.bytes_sent == 8 * 1000 * 1000
+    assert progress.done_files == 8
+    assert terminal.write_count == 1
+    assert terminal.getvalue().startswith('\r[')
+
+
+def test_render_line():
+    progress = ProgressRenderer(total_files=4, total_bytes=4000, stream=FakeTerminal())
+    progress.add_bytes(1000)
+    progress.finish_file()
+    progress.finish_file(success=False)
+
+    line = progress.render_line()
+    assert ' 25.0%' in line
+    assert '2/4 files (1 failed)' in line
+    assert '/s | ETA ' in line
+
+
+def test_quiet_when_not_a_terminal():
+    stream = io.StringIO()
+    progress = ProgressRenderer(total_files=1, total_bytes=1000, refresh_interval=0, stream=stream)
+    progress.add_bytes(1000)
+    progress.finish_file()
+    assert stream.getvalue() == ''
+
+    progress.close()
+    assert stream.getvalue().startswith('1/1 files, 1.0 kB sent in ')
+    assert '\r' not in stream.getvalue()
+
+
+def test_throughput_history_keeps_the_last_significant_runs(tmp_path):
+    history = ThroughputHistory(tmp_path / 'throughput.json', length=2)
+    assert history.estimate() is None
+
+    history.record(10, 5.0)  # Too small to say anything about the uplink.
+    history.record(4_000_000, 2.0)
+    history.record(6_000_000, 2.0)
+    history.record(10_000_000, 2.0)
+    assert ThroughputHistory(tmp_path / 'throughput.json', length=2).estimate() == 4_000_000
+
+    (tmp_path / 'throughput.json').write_text('not json')
+    assert ThroughputHistory(tmp_path / 'throughput.json').estimate() is None
+
+
+def test_eta_starts_from_past_throughput_and_records_the_run(tmp_path):
+    history = ThroughputHistory(tmp_path / 'throughput.json')
+    history.record(2_000_000, 2.0)
+    monotonic = [100.0]
+    with patch.object(progress_module.time, 'monotonic', lambda: monotonic[0]):
+        progress = ProgressRenderer(total_files=1, total_bytes=10_000_000, stream=io.StringIO(), history=history)
+        # Nothing measured yet: the throughput of past runs is all there is.
+        assert progress.get_eta() == 10.0
+
+        # After a whole window, the measured throughput takes over.
+        monotonic[0] += progress_module.THROUGHPUT_WINDOW
+        progress.add_bytes(5_000_000)
+        assert progress.get_eta() == 10.0
+        progress.close()
+
+    assert len(history.runs) == 2
+    assert history.runs[-1]['bytes'] == 5_000_000
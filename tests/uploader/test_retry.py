@@ -0,0 +1,197 @@
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+from requests import ConnectionError, ConnectTimeout, ReadTimeout
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+
+from oort.common.constants import Status, Substatus
+from oort.common.context import Context
+from oort.uploader import walker
+from oort.uploader.datasets import DatasetCache
+from oort.uploader.errors import UploadRemoteFileCheckError
+from oort.uploader.retry import RetryPolicy, is_retryable, is_unprocessed
+from oort.uploader.scanner import build_manifest
+from tests.standin import StandInArcsecond, StandInConfig
+from .test_walker import DATASET, FIXTURES_FILE_COUNT, FIXTURES_PATH, make_context, make_dataset_cache
+
+REFUSED_CONNECTION_ERROR = ConnectionError(MaxRetryError(None, '/datafiles/', NewConnectionError(None, 'refused')))
+
+
+class FlakyUploader(object):
+    # File name -> list of errors to raise, one per attempt, before succeeding.
+    errors = {}
+    attempts = {}
+
+    def __init__(self, context, root_path, file_path, **kwargs):
+        self._file_path = file_path
+        self.datafile = {'pk': file_path.name}
+        self.log_prefix = f'[FlakyUploader: {file_path.name}]'
+
+    def upload_file(self):
+        name = self._file_path.name
+        attempt = FlakyUploader.attempts.get(name, 0)
+        FlakyUploader.attempts[name] = attempt + 1
+        errors = FlakyUploader.errors.get(name, [])
+        if attempt < len(errors):
+            raise errors[attempt]
+        return [Status.OK, Substatus.DONE, None]
+
+    @property
+    def may_have_created_datafile(self):
+        return False
+
+    def roll_back_progress(self):
+        pass
+
+
+def run_walk(errors, retry_policy):
+    FlakyUploader.errors = errors
+    FlakyUploader.attempts = {}
+    with patch.object(walker, 'FileUploader', FlakyUploader):
+        return walker.walk(make_context(), str(FIXTURES_PATH), jobs=2,
+                           dataset_cache=make_dataset_cache(), retry_policy=retry_policy)
+
+
+def test_is_retryable():
+    assert is_retryable(ConnectionError())
+    assert is_retryable(UploadRemoteFileCheckError('bad gateway', 502))
+    assert is_retryable(UploadRemoteFileCheckError('slow down', 429))
+    assert not is_retryable(UploadRemoteFileCheckError('forbidden', 403))
+    assert not is_retryable(UploadRemoteFileCheckError('unknown'))
+    assert not is_retryable(FileNotFoundError())
+
+
+def test_is_unprocessed():
+    assert is_unprocessed(ConnectTimeout())
+    assert is_unprocessed(REFUSED_CONNECTION_ERROR)
+    assert is_unprocessed(UploadRemoteFileCheckError('slow down', 429))
+    assert is_unprocessed(UploadRemoteFileCheckError('unavailable', 503))
+    # The request may have been processed before the connection dropped, or the gateway gave up.
+    assert not is_unprocessed(ConnectionError())
+    assert not is_unprocessed(ReadTimeout())
+    assert not is_unprocessed(UploadRemoteFileCheckError('bad gateway', 502))
+
+
+def test_retry_policy_backoff_is_bounded():
+    policy = RetryPolicy(base_delay=1.0, max_delay=10.0)
+    for attempt in range(10):
+        assert 0 <= policy.get_backoff_delay(attempt) <= min(10.0, 2 ** attempt)
+
+
+def test_retry_policy_budget():
+    policy = RetryPolicy(max_attempts=3, budget=2)
+    assert policy.acquire_retry(0)
+    assert policy.acquire_retry(1)
+    assert not policy.acquire_retry(0)
+    assert policy.retry_count == 2
+    assert not RetryPolicy(max_attempts=3).acquire_retry(2)
+
+
+def test_transient_errors_are_retried():
+    errors = {'very_simple.fits': [UploadRemoteFileCheckError('bad gateway', 502), ConnectionError()]}
+    success_uploads, failed_uploads = run_walk(errors, RetryPolicy(max_attempts=3, base_delay=0))
+
+    assert len(success_uploads) == FIXTURES_FILE_COUNT
+    assert len(failed_uploads) == 0
+    assert FlakyUploader.attempts['very_simple.fits'] == 3
+
+
+def test_fatal_errors_are_not_retried():
+    errors = {'very_simple.fits': [UploadRemoteFileCheckError('forbidden', 403)]}
+    success_uploads, failed_uploads = run_walk(errors, RetryPolicy(max_attempts=3, base_delay=0))
+
+    assert len(success_uploads) == FIXTURES_FILE_COUNT - 1
+    assert [(Path(path).name, error) for path, _, error in failed_uploads] == [('very_simple.fits', 'forbidden')]
+    assert FlakyUploader.attempts['very_simple.fits'] == 1
+
+
+def test_exhausted_retries_are_requeued_at_the_end():
+    # Two attempts in the first round, then one more in the requeue round.
+    errors = {'very_simple.fits': [UploadRemoteFileCheckError('unavailable', 503)] * 2}
+    success_uploads, failed_uploads = run_walk(errors, RetryPolicy(max_attempts=2, base_delay=0))
+
+    assert len(success_uploads) == FIXTURES_FILE_COUNT
+    assert FlakyUploader.attempts['very_simple.fits'] == 3
+
+
+def test_retry_budget_limits_retries_of_the_walk():
+    errors = {path.name: [UploadRemoteFileCheckError('unavailable', 503)] * 10
+              for path in FIXTURES_PATH.glob('**/*') if path.is_file()}
+    success_uploads, failed_uploads = run_walk(errors, RetryPolicy(max_attempts=5, base_delay=0, budget=3))
+
+    assert len(success_uploads) == 0
+    assert len(failed_uploads) == FIXTURES_FILE_COUNT
+    # One attempt per file and per round (the first one and the requeue), plus the budgeted retries.
+    assert sum(FlakyUploader.attempts.values()) == 2 * FIXTURES_FILE_COUNT + 3
+
+
+def test_dataset_resolution_is_retried():
+    context = make_context()
+    context.api.datasets.read.side_effect = [ConnectionError(), (None, UploadRemoteFileCheckError('gateway', 502)),
+                                             (DATASET, None)]
+    FlakyUploader.errors = {}
+    with patch.object(walker, 'FileUploader', FlakyUploader):
+        success_uploads, failed_uploads = walker.walk(context, str(FIXTURES_PATH), dataset_cache=DatasetCache(),
+                                                      retry_policy=RetryPolicy(max_attempts=3, base_delay=0))
+    assert len(success_uploads) == FIXTURES_FILE_COUNT and len(failed_uploads) == 0
+
+
+def test_dataset_resolution_failures_are_reported():
+    context = make_context()
+    context.api.datasets.read.side_effect = ConnectionError('unreachable')
+    with patch.object(walker, 'FileUploader', FlakyUploader):
+        success_uploads, failed_uploads = walker.walk(context, str(FIXTURES_PATH), dataset_cache=DatasetCache(),
+                                                      retry_policy=RetryPolicy(max_attempts=2, base_delay=0))
+    assert len(success_uploads) == 0 and len(failed_uploads) == FIXTURES_FILE_COUNT
+    assert all(error == 'unreachable' for _, _, error in failed_uploads)
+    assert context.api.datasets.read.call_count == 2
+
+
+@pytest.fixture
+def standin():
+    with StandInArcsecond() as standin:
+        yield standin
+
+
+def upload_with_failing_create(standin, tmp_path, error, created=False):
+    dataset = {'uuid': '1f2e3d4c-5b6a-4978-8a9b-0c1d2e3f4a5b', 'name': 'Retries'}
+    standin.datasets[dataset['uuid']] = dataset
+    context = Context(StandInConfig(standin.url), dataset['uuid'], '')
+    context.update_dataset(dataset)
+    (tmp_path / 'a.fits').write_bytes(b'a')
+
+    create = context.api.datafiles.create
+    calls = []
+
+    def create_and_fail_once(**kwargs):
+        calls.append(kwargs)
+        if len(calls) == 1:
+            if created:
+                # The datafile is created, but the response is lost.
+                create(**kwargs)
+            raise error
+        return create(**kwargs)
+
+    with patch.object(context.api.datafiles, 'create', side_effect=create_and_fail_once):
+        result = walker.upload_scanned_file(context, tmp_path, build_manifest(tmp_path).files[0],
+                                            retry_policy=RetryPolicy(base_delay=0))
+    return result, len(calls)
+
+
+def test_creates_are_retried_when_never_sent(standin, tmp_path):
+    (status, _, _, _), call_count = upload_with_failing_create(standin, tmp_path, REFUSED_CONNECTION_ERROR)
+    assert status == Status.OK and call_count == 2
+    assert len(standin.datafiles) == 1
+
+
+def test_creates_are_not_retried_once_processed(standin, tmp_path):
+    (status, _, _, _), call_count = upload_with_failing_create(standin, tmp_path, ReadTimeout(), created=True)
+    assert status == Status.OK and call_count == 1
+    assert len(standin.datafiles) == 1
+
+
+def test_creates_are_retried_once_sent_if_not_processed(standin, tmp_path):
+    (status, _, _, _), call_count = upload_with_failing_create(standin, tmp_path, ReadTimeout())
+    assert status == Status.OK and call_count == 2
+    assert len(standin.datafiles) == 1
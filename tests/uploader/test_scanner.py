@@ -0,0 +1,99 @@
+import gzip
+import json
+from pathlib import Path
+
+import pytest
+
+from oort.uploader.filters import PathFilter
+from oort.uploader.scanner import (Shard, build_manifest, get_root_path, read_manifest_file, scan_folder,
+                                   write_manifest_file)
+
+FIXTURES_PATH = Path(__file__).parent.parent / 'fixtures'
+
+
+def test_scan_folder_collects_size_and_mtime():
+    scanned_files = {f.path: f for f in scan_folder(FIXTURES_PATH)}
+    assert set(scanned_files.keys()) == set(f for f in FIXTURES_PATH.glob('**/*') if f.is_file())
+    for path, scanned_file in scanned_files.items():
+        assert scanned_file.size == path.stat().st_size
+        assert scanned_file.mtime == path.stat().st_mtime
+
+
+def test_scan_folder_prunes_hidden_folders(tmp_path):
+    (tmp_path / '.hidden' / 'sub').mkdir(parents=True)
+    (tmp_path / '.hidden' / 'sub' / 'a.fits').write_bytes(b'a')
+    (tmp_path / 'visible').mkdir()
+    (tmp_path / 'visible' / '.b.fits').write_bytes(b'b')
+    (tmp_path / 'visible' / 'c.fits').write_bytes(b'cc')
+
+    manifest = build_manifest(tmp_path)
+    assert [f.path for f in manifest] == [tmp_path / 'visible' / 'c.fits']
+    assert manifest.total_size == 2
+
+
+def test_scan_folder_inside_hidden_root(tmp_path):
+    root_path = tmp_path / '.archive'
+    root_path.mkdir()
+    (root_path / 'a.fits').write_bytes(b'a')
+    assert len(build_manifest(root_path)) == 1
+
+
+def test_get_root_path_of_file():
+    assert get_root_path(str(FIXTURES_PATH / 'very_simple.fits')) == FIXTURES_PATH.resolve()
+
+
+def test_manifest_file_round_trip_in_another_root(tmp_path):
+    manifest_path = tmp_path / 'manifest.jsonl.gz'
+    count = write_manifest_file(manifest_path, FIXTURES_PATH, scan_folder(FIXTURES_PATH))
+    assert count == len(build_manifest(FIXTURES_PATH))
+
+    # The same storage, mounted elsewhere.
+    manifest = read_manifest_file(manifest_path, tmp_path / 'mount')
+    expected = {f.path.relative_to(FIXTURES_PATH): (f.size, f.mtime) for f in build_manifest(FIXTURES_PATH)}
+    assert {f.path.relative_to(tmp_path / 'mount'): (f.size, f.mtime) for f in manifest} == expected
+
+    manifest = read_manifest_file(manifest_path, FIXTURES_PATH, path_filter=PathFilter(excludes=['folder2/']))
+    assert len(manifest) == count - 2
+
+
+def test_invalid_manifest_files_raise_value_errors(tmp_path):
+    manifest_path = tmp_path / 'manifest.jsonl.gz'
+    write_manifest_file(manifest_path, FIXTURES_PATH, scan_folder(FIXTURES_PATH))
+    truncated_path = tmp_path / 'truncated.jsonl.gz'
+    truncated_path.write_bytes(manifest_path.read_bytes()[:-20])
+    with pytest.raises(ValueError, match='truncated'):
+        read_manifest_file(truncated_path, FIXTURES_PATH)
+
+    header = json.dumps({'format': 'oort-manifest', 'version': 1, 'root': '/data'})
+    for line in ['null', '{"a": 1}', '[1, 2, 3]', '["/etc/passwd", 1, 1.0]', '["night1/../../etc/passwd", 1, 1.0]']:
+        with gzip.open(manifest_path, 'wt') as f:
+            f.write(header + '\n' + line + '\n')
+        with pytest.raises(ValueError):
+            read_manifest_file(manifest_path, FIXTURES_PATH)
+
+
+def test_shards_partition_a_manifest(tmp_path):
+    for index in range(200):
+        (tmp_path / f'frame_{index}.fits').write_bytes(b'x')
+    manifest_path = tmp_path.parent / f'{tmp_path.name}.jsonl.gz'
+    write_manifest_file(manifest_path, tmp_path, scan_folder(tmp_path))
+
+    shards = [read_manifest_file(manifest_path, tmp_path, Shard(number, 3)) for number in range(1, 4)]
+    paths = [set(f.path for f in shard) for shard in shards]
+    assert sum(len(shard_paths) for shard_paths in paths) == 200
+    assert set.union(*paths) == set(f.path for f in build_manifest(tmp_path))
+    assert all(40 < len(shard_paths) < 95 for shard_paths in paths)
+    # Shards only depend on relative paths.
+    assert [f.path.name for f in read_manifest_file(manifest_path, Path('/elsewhere'), Shard(2, 3))] == \
+           [f.path.name for f in shards[1]]
+
+
+def test_invalid_shards_and_manifests(tmp_path):
+    with pytest.raises(ValueError):
+        Shard(0, 2)
+    with pytest.raises(ValueError):
+        Shard(3, 2)
+    with gzip.open(tmp_path / 'other.gz', 'wt') as f:
+        f.write('{"format": "other"}\n')
+    with pytest.raises(ValueError):
+        read_manifest_file(tmp_path / 'other.gz', tmp_path)
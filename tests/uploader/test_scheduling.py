@@ -0,0 +1,29 @@
+from pathlib import Path
+
+import pytest
+
+from oort.uploader.scanner import ScannedFile
+from oort.uploader.scheduling import schedule
+
+FILES = [ScannedFile(Path('/data/night1/a.fits'), 300, 3.0),
+         ScannedFile(Path('/data/night1/b.fits'), 100, 1.0),
+         ScannedFile(Path('/data/night1/c.fits'), 200, 5.0),
+         ScannedFile(Path('/data/night2/d.fits'), 400, 2.0),
+         ScannedFile(Path('/data/night3/e.fits'), 100, 4.0)]
+
+
+@pytest.mark.parametrize('policy, names', [
+    ('scan', 'abcde'),
+    ('newest-first', 'ceadb'),
+    ('oldest-first', 'bdaec'),
+    ('smallest-first', 'becad'),
+    ('largest-first', 'dacbe'),
+    ('round-robin', 'adebc'),
+])
+def test_schedule(policy, names):
+    assert ''.join(f.path.stem for f in schedule(FILES, policy)) == names
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        schedule(FILES, 'random')
@@ -0,0 +1,106 @@
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+from oort.common.context import Context
+from oort.uploader.ledger import UploadLedger
+from oort.uploader.tags import TagBatcher, build_walk_tags, has_tags
+from oort.uploader.uploader import FileUploader
+from oort.uploader.walker import walk
+from tests.standin import StandInArcsecond, StandInConfig
+
+DATASET = {'uuid': '3f2d1c0b-8a7e-4e5f-9a1b-2c3d4e5f6a7b', 'name': 'Tags'}
+
+
+@pytest.fixture
+def standin():
+    with StandInArcsecond() as standin:
+        standin.datasets[DATASET['uuid']] = DATASET
+        yield standin
+
+
+def make_files(root_path: Path, count: int):
+    for index in range(count):
+        (root_path / f'frame_{index}.fits').write_bytes(b'frame')
+    return [root_path / f'frame_{index}.fits' for index in range(count)]
+
+
+def make_context(standin):
+    context = Context(StandInConfig(standin.url), DATASET['uuid'], '')
+    context.update_dataset(DATASET)
+    return context
+
+
+def test_has_tags_accepts_tag_objects_and_ignores_malformed_tags():
+    assert has_tags({'tags': ['a', 'b']}, ['a'])
+    assert has_tags({'tags': [{'name': 'a'}, {'name': 'b'}]}, ['a', 'b'])
+    assert not has_tags({'tags': [{'value': 'a'}, ['a'], None]}, ['a'])
+    assert not has_tags({'tags': None}, ['a'])
+
+
+def test_tags_are_sent_with_the_upload(standin, tmp_path):
+    context = make_context(standin)
+    tags = build_walk_tags(context, tmp_path)
+    for file_path in make_files(tmp_path, 3):
+        FileUploader(context, tmp_path, file_path, tags=tags).upload_file()
+
+    assert standin.request_counts == {'POST': 3}
+    assert all(datafile['tags'] == tags for datafile in standin.datafiles.values())
+
+
+def test_ignored_tags_are_deferred_and_updated_in_batches(standin, tmp_path):
+    standin.ignore_creation_tags = True
+    context = make_context(standin)
+    tag_batcher = TagBatcher(context.api, build_walk_tags(context, tmp_path), batch_size=2)
+    for file_path in make_files(tmp_path, 5):
+        FileUploader(context, tmp_path, file_path, tags=tag_batcher.tags, tag_batcher=tag_batcher).upload_file()
+    assert standin.request_counts == {'POST': 5}
+
+    assert tag_batcher.flush() == []
+    assert standin.request_counts == {'POST': 5, 'PATCH': 5}
+    assert all(datafile['tags'] == tag_batcher.tags for datafile in standin.datafiles.values())
+
+
+def test_tag_batcher_reports_datafiles_it_could_not_tag(standin):
+    context = make_context(standin)
+    tag_batcher = TagBatcher(context.api, ['oort|root|/'], max_attempts=1)
+    tag_batcher.defer(404)
+    assert tag_batcher.flush() == [404]
+
+
+def test_deferred_datafiles_keep_their_metadata_tags(standin, tmp_path):
+    standin.ignore_creation_tags = True
+    context = make_context(standin)
+    tag_batcher = TagBatcher(context.api, build_walk_tags(context, tmp_path))
+    file_path = make_files(tmp_path, 1)[0]
+    FileUploader(context, tmp_path, file_path, tags=tag_batcher.tags, tag_batcher=tag_batcher,
+                 metadata={'OBJECT': 'M 42', 'DATE-OBS': '2024-03-01T22:10:00'}).upload_file()
+
+    assert tag_batcher.flush() == []
+    datafile = list(standin.datafiles.values())[0]
+    assert datafile['tags'] == tag_batcher.tags + ['fits|DATE-OBS|2024-03-01T22:10:00', 'fits|OBJECT|M 42']
+
+
+def test_walk_reports_untagged_files_and_tags_them_on_next_walk(standin, tmp_path):
+    standin.ignore_creation_tags = True
+    standin.reject_datafile_updates = True
+    root_path = tmp_path / 'root'
+    root_path.mkdir()
+    file_paths = make_files(root_path, 2)
+    ledger = UploadLedger(tmp_path / 'ledger.sqlite')
+    # No waiting between the attempts to update the tags.
+    with patch('oort.uploader.tags.random.uniform', return_value=0):
+        success_uploads, failed_uploads = walk(make_context(standin), str(root_path), ledger=ledger)
+    assert success_uploads == []
+    assert sorted(path for path, _, _ in failed_uploads) == sorted(str(path) for path in file_paths)
+
+    # Files are not uploaded again: only their tags are updated.
+    standin.reject_datafile_updates = False
+    (root_path / 'new.fits').write_bytes(b'new')
+    success_uploads, failed_uploads = walk(make_context(standin), str(root_path), ledger=ledger)
+    assert success_uploads == [str(root_path / 'new.fits')] and failed_uploads == []
+    assert standin.request_counts['POST'] == 3
+    assert all(datafile['tags'] for datafile in standin.datafiles.values())
+    assert ledger.read_untagged_datafiles(root_path, DATASET['uuid']) == {}
+    ledger.close()
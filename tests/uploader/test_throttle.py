@@ -0,0 +1,48 @@
+import threading
+import time
+
+from oort.uploader.throttle import AdaptiveConcurrencyLimiter, TokenBucket
+
+
+def test_token_bucket_limits_the_shared_rate():
+    bucket = TokenBucket(rate=400_000)
+
+    def send():
+        for _ in range(10):
+            bucket.consume(10_000)
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=send) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    # 400 kB at 400 kB/s, minus the initial burst of 100 kB.
+    assert 0.7 < elapsed < 1.5
+
+
+def test_adaptive_limiter_increases_without_errors_and_halves_on_errors():
+    limiter = AdaptiveConcurrencyLimiter(max_limit=8, initial_limit=4, window=0)
+
+    limiter.record_bytes(1000)
+    assert limiter.limit == 5
+
+    limiter.acquire()
+    limiter.release(success=False)
+    assert limiter.limit == 2
+
+
+def test_adaptive_limiter_blocks_above_limit():
+    limiter = AdaptiveConcurrencyLimiter(max_limit=4, initial_limit=1, window=3600)
+    limiter.acquire()
+
+    acquired = threading.Event()
+    thread = threading.Thread(target=lambda: (limiter.acquire(), acquired.set()))
+    thread.start()
+    assert not acquired.wait(0.2)
+
+    limiter.release()
+    assert acquired.wait(1.0)
+    thread.join()
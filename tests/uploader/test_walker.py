@@ -0,0 +1,156 @@
+import os
+import threading
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+from oort.common.constants import Status, Substatus
+from oort.uploader import walker
+from oort.uploader.datasets import DatasetCache
+from oort.uploader.errors import UploadRemoteFileCheckError
+from oort.uploader.ledger import UploadLedger
+from .test_headers import make_card, make_header
+
+FIXTURES_PATH = Path(__file__).parent.parent / 'fixtures'
+FIXTURES_FILE_COUNT = sum(1 for f in FIXTURES_PATH.glob('**/*') if f.is_file())
+
+
+class FakeUploader(object):
+    failing_names = set()
+    # When set, the first two uploads wait for each other: passing it proves that they overlapped.
+    overlap_barrier = None
+    overlapped = False
+
+    def __init__(self, context, root_path, file_path, **kwargs):
+        self._file_path = file_path
+        self.datafile = {'pk': file_path.name}
+        self.log_prefix = f'[FakeUploader: {file_path.name}]'
+
+    def upload_file(self):
+        if FakeUploader.overlap_barrier is not None:
+            try:
+                FakeUploader.overlap_barrier.wait(timeout=10)
+                FakeUploader.overlapped = True
+            except threading.BrokenBarrierError:
+                pass
+            # Later uploads do not wait.
+            FakeUploader.overlap_barrier.abort()
+        if self._file_path.name in FakeUploader.failing_names:
+            raise UploadRemoteFileCheckError('boom')
+        return [Status.OK, Substatus.DONE, None]
+
+    @property
+    def may_have_created_datafile(self):
+        return False
+
+    def roll_back_progress(self):
+        pass
+
+
+DATASET = {'uuid': 'c3f3e2e0-3c8a-4b6a-9d3e-0f0f0f0f0f0f', 'name': 'Walker Tests'}
+
+
+def make_context():
+    context = MagicMock()
+    context.config.api_name = 'dev'
+    context.dataset_uuid = DATASET['uuid']
+    return context
+
+
+def make_dataset_cache():
+    dataset_cache = DatasetCache()
+    dataset_cache.add(DATASET)
+    return dataset_cache
+
+
+def test_walk_parallel_uploads_every_file():
+    FakeUploader.failing_names = set()
+    FakeUploader.overlap_barrier = threading.Barrier(2)
+    FakeUploader.overlapped = False
+    try:
+        with patch.object(walker, 'FileUploader', FakeUploader):
+            success_uploads, failed_uploads = walker.walk(make_context(), str(FIXTURES_PATH), jobs=4,
+                                                          dataset_cache=make_dataset_cache())
+    finally:
+        FakeUploader.overlap_barrier = None
+
+    assert len(success_uploads) == FIXTURES_FILE_COUNT
+    assert len(failed_uploads) == 0
+    assert FakeUploader.overlapped
+
+
+def test_walk_parallel_failing_upload_does_not_abort_walk():
+    FakeUploader.failing_names = {'very_simple.fits', 'very_simple_2.fits'}
+    with patch.object(walker, 'FileUploader', FakeUploader):
+        success_uploads, failed_uploads = walker.walk(make_context(), str(FIXTURES_PATH), jobs=2,
+                                                      dataset_cache=make_dataset_cache())
+
+    assert len(success_uploads) == FIXTURES_FILE_COUNT - 2
+    assert sorted(Path(path).name for path, _, _ in failed_uploads) == ['very_simple.fits', 'very_simple_2.fits']
+    assert all(substatus == Substatus.ERROR and error == 'boom' for _, substatus, error in failed_uploads)
+
+
+def test_walk_skips_files_already_in_ledger(tmp_path):
+    FakeUploader.failing_names = {'very_simple.fits'}
+    ledger = UploadLedger(tmp_path / 'ledger.sqlite')
+    dataset_cache = make_dataset_cache()
+    with patch.object(walker, 'FileUploader', FakeUploader):
+        success_uploads, failed_uploads = walker.walk(make_context(), str(FIXTURES_PATH),
+                                                      ledger=ledger, dataset_cache=dataset_cache)
+        assert len(success_uploads) == FIXTURES_FILE_COUNT - 1
+
+        FakeUploader.failing_names = set()
+        success_uploads, failed_uploads = walker.walk(make_context(), str(FIXTURES_PATH),
+                                                      ledger=ledger, dataset_cache=dataset_cache)
+        assert [Path(path).name for path in success_uploads] == ['very_simple.fits']
+
+        success_uploads, failed_uploads = walker.walk(make_context(), str(FIXTURES_PATH),
+                                                      ledger=ledger, force=True, dataset_cache=dataset_cache)
+        assert len(success_uploads) == FIXTURES_FILE_COUNT
+    ledger.close()
+
+
+def test_walk_hashes_uploaded_files_and_skips_touched_but_unchanged_ones(tmp_path):
+    root_path = tmp_path / 'root'
+    root_path.mkdir()
+    (root_path / 'a.fits').write_bytes(b'a' * 100)
+    (root_path / 'b.fits').write_bytes(b'b' * 100)
+    FakeUploader.failing_names = set()
+    ledger = UploadLedger(tmp_path / 'ledger.sqlite')
+    dataset_cache = make_dataset_cache()
+    with patch.object(walker, 'FileUploader', FakeUploader):
+        success_uploads, _ = walker.walk(make_context(), str(root_path), ledger=ledger, dataset_cache=dataset_cache,
+                                         digest_algorithm='sha256')
+        assert len(success_uploads) == 2
+        assert all(digest is not None for _, _, digest in ledger.read_synced_files(root_path, DATASET['uuid']).values())
+
+        # Both are touched, only b is modified (same size).
+        os.utime(root_path / 'a.fits', (1000000000, 1000000000))
+        (root_path / 'b.fits').write_bytes(b'c' * 100)
+        os.utime(root_path / 'b.fits', (1000000000, 1000000000))
+        success_uploads, _ = walker.walk(make_context(), str(root_path), ledger=ledger, dataset_cache=dataset_cache,
+                                         digest_algorithm='sha256')
+        assert [Path(path).name for path in success_uploads] == ['b.fits']
+    ledger.close()
+
+
+def test_walk_skips_undated_files(tmp_path):
+    (tmp_path / 'dated.fits').write_bytes((FIXTURES_PATH / 'very_simple.fits').read_bytes())
+    (tmp_path / 'undated.fits').write_bytes(make_header([make_card('SIMPLE', 'T'), make_card('OBJECT', "'M42'")]))
+    (tmp_path / 'notes.txt').write_bytes(b'notes')
+    FakeUploader.failing_names = set()
+    with patch.object(walker, 'FileUploader', FakeUploader):
+        success_uploads, failed_uploads = walker.walk(make_context(), str(tmp_path), jobs=2,
+                                                      dataset_cache=make_dataset_cache(), skip_undated=True)
+
+    assert sorted(Path(path).name for path in success_uploads) == ['dated.fits', 'notes.txt']
+    assert len(failed_uploads) == 0
+
+
+def test_walk_uploads_in_scheduled_order():
+    FakeUploader.failing_names = set()
+    with patch.object(walker, 'FileUploader', FakeUploader):
+        success_uploads, _ = walker.walk(make_context(), str(FIXTURES_PATH), jobs=1,
+                                         dataset_cache=make_dataset_cache(), scheduling_policy='largest-first')
+
+    sizes = [Path(path).stat().st_size for path in success_uploads]
+    assert sizes == sorted(sizes, reverse=True)
@@ -0,0 +1,133 @@
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+
+from oort.common.context import Context
+from oort.uploader.ledger import UploadLedger
+from oort.uploader.watcher import FolderWatcher, InotifyEventSource, is_inotify_available
+from tests.standin import StandInArcsecond, StandInConfig
+
+DATASET = {'uuid': '7e6d5c4b-3a29-4180-9f8e-7d6c5b4a3928', 'name': 'Watch'}
+
+
+@pytest.fixture
+def standin():
+    with StandInArcsecond() as standin:
+        standin.datasets[DATASET['uuid']] = DATASET
+        yield standin
+
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return condition()
+
+
+def start_watcher(standin, root_path, ledger, use_polling):
+    context = Context(StandInConfig(standin.url), DATASET['uuid'], '')
+    context.update_dataset(DATASET)
+    watcher = FolderWatcher(context, root_path, ledger, jobs=2, settle_delay=0.3,
+                            use_polling=use_polling, poll_interval=0.2)
+    thread = threading.Thread(target=watcher.run)
+    thread.start()
+    return watcher, thread
+
+
+@pytest.mark.parametrize('use_polling', [
+    True,
+    pytest.param(False, marks=pytest.mark.skipif(not is_inotify_available(), reason='inotify is not available'))
+])
+def test_watcher_uploads_new_files_once_settled(standin, tmp_path, use_polling):
+    root_path = tmp_path / 'root'
+    (root_path / 'night1').mkdir(parents=True)
+    (root_path / 'night1' / 'existing.fits').write_bytes(b'existing')
+    ledger = UploadLedger(tmp_path / 'ledger.sqlite')
+
+    watcher, thread = start_watcher(standin, root_path, ledger, use_polling)
+    try:
+        assert wait_for(lambda: len(standin.datafiles) == 1)
+
+        # New files are looked up in the ledger one batch at a time, without reading all of it.
+        original_read_synced_files = ledger.read_synced_files
+
+        def read_synced_files(root_path, dataset_uuid, relative_paths=None):
+            assert relative_paths is not None
+            return original_read_synced_files(root_path, dataset_uuid, relative_paths)
+
+        patch.object(ledger, 'read_synced_files', side_effect=read_synced_files).start()
+        (root_path / 'night1' / 'new.fits').write_bytes(b'new')
+        (root_path / 'night2').mkdir()
+        (root_path / 'night2' / 'other.fits').write_bytes(b'other')
+        (root_path / 'night2' / '.hidden.fits').write_bytes(b'hidden')
+        assert wait_for(lambda: len(standin.datafiles) == 3)
+    finally:
+        patch.stopall()
+        watcher.stop()
+        thread.join()
+
+    assert sorted(datafile['file'] for datafile in standin.datafiles.values()) == \
+           ['existing.fits', 'new.fits', 'other.fits']
+    assert len(watcher.success_uploads) == 3
+    ledger.close()
+
+
+def test_watcher_lets_files_found_at_startup_settle(standin, tmp_path):
+    root_path = tmp_path / 'root'
+    root_path.mkdir()
+    (root_path / 'existing.fits').write_bytes(b'existing')
+    ledger = UploadLedger(tmp_path / 'ledger.sqlite')
+    context = Context(StandInConfig(standin.url), DATASET['uuid'], '')
+    context.update_dataset(DATASET)
+    watcher = FolderWatcher(context, root_path, ledger, settle_delay=1.0, use_polling=True, poll_interval=0.2)
+
+    thread = threading.Thread(target=watcher.run)
+    thread.start()
+    try:
+        time.sleep(0.3)
+        assert len(standin.datafiles) == 0
+        assert wait_for(lambda: len(standin.datafiles) == 1)
+    finally:
+        watcher.stop()
+        thread.join()
+    ledger.close()
+
+
+@pytest.mark.skipif(not is_inotify_available(), reason='inotify is not available')
+def test_watcher_does_not_busy_loop_without_settle_delay(standin, tmp_path):
+    root_path = tmp_path / 'root'
+    root_path.mkdir()
+    ledger = UploadLedger(tmp_path / 'ledger.sqlite')
+    context = Context(StandInConfig(standin.url), DATASET['uuid'], '')
+    context.update_dataset(DATASET)
+    watcher = FolderWatcher(context, root_path, ledger, settle_delay=0)
+
+    with patch('oort.uploader.watcher.InotifyEventSource.read_changed_paths', autospec=True,
+               return_value=[]) as read_changed_paths:
+        thread = threading.Thread(target=watcher.run)
+        thread.start()
+        time.sleep(0.3)
+        watcher.stop()
+        thread.join()
+
+    assert all(call.kwargs['timeout'] > 0 for call in read_changed_paths.call_args_list)
+    ledger.close()
+
+
+@pytest.mark.skipif(not is_inotify_available(), reason='inotify is not available')
+def test_inotify_source_skips_folders_removed_before_being_watched(tmp_path):
+    (tmp_path / 'night1').mkdir()
+    (tmp_path / 'night1' / 'a.fits').write_bytes(b'a')
+    event_source = InotifyEventSource(tmp_path)
+    try:
+        (tmp_path / 'night2').mkdir()
+        (tmp_path / 'night2' / 'b.fits').write_bytes(b'b')
+        (tmp_path / 'night2' / 'b.fits').unlink()
+        (tmp_path / 'night2').rmdir()
+        (tmp_path / 'night1' / 'c.fits').write_bytes(b'c')
+
+        assert tmp_path / 'night1' / 'c.fits' in event_source.read_changed_paths(timeout=1.0)
+    finally:
+        event_source.close()